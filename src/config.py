@@ -1,7 +1,10 @@
-from typing import List
+from enum import Enum
+from typing import Dict, List, Optional
 
 from pydantic import BaseModel, Field
+from pyrogram.enums import ChatType as PyrogramChatType, MessageMediaType
 
+from src.new_message import MediaType
 from src.tools import get_dict_key_by_path, convert_string_size_to_bytes
 
 
@@ -12,16 +15,231 @@ class S3Config(BaseModel):
         validate_by_name = True
 
 
+class SerializationFormat(str, Enum):
+    JSON = 'json'
+    MSGPACK = 'msgpack'
+
+
+class KafkaOutboxConfig(BaseModel):
+    enabled: bool = Field(default=False)
+    directory: str = Field(default='outbox', min_length=1)
+    segment_size: int = Field(default=64 * 1000 ** 2, gt=0)
+    fsync_interval: float = Field(default=0.5, gt=0)
+    replay_batch_size: int = Field(default=500, gt=0)
+    retry_interval: float = Field(default=5.0, gt=0)
+    # Events Kafka has not acknowledged within this many seconds are stored in the outbox
+    send_timeout: float = Field(default=2.0, gt=0)
+
+
 class KafkaConfig(BaseModel):
     bootstrap_servers: str = Field(min_length=1)
     messages_topic: str = Field(min_length=1)
+    messages_format: SerializationFormat = Field(default=SerializationFormat.JSON)
+    linger_ms: int = Field(default=5, ge=0)
+    batch_size: int = Field(default=1_000_000, gt=0)
+    queue_buffering_max_messages: int = Field(default=100_000, gt=0)
+    compression_type: str = Field(default='lz4', min_length=1)
+    enqueue_timeout: float = Field(default=5.0, ge=0)
+    delivery_timeout_ms: int = Field(default=30_000, gt=0)
+    statistics_interval_ms: int = Field(default=15_000, ge=0)
+    outbox: KafkaOutboxConfig = Field(default_factory=KafkaOutboxConfig)
+
+
+class OverflowPolicy(str, Enum):
+    BLOCK = 'block'
+    DROP_MEDIA = 'drop-media'
+    DROP_MESSAGE = 'drop-message'
+
+
+class IngestConfig(BaseModel):
+    queue_size: int = Field(default=100, gt=0)
+    lanes: int = Field(default=16, gt=0)
+    overflow_policy: OverflowPolicy = Field(default=OverflowPolicy.BLOCK)
+    max_in_flight: int = Field(default=64, gt=0)
+
+
+class VariantPolicy(str, Enum):
+    # The original file, or its largest thumbnail under the size cap
+    ORIGINAL = 'original'
+    THUMBNAIL = 'thumbnail'
+
+
+class MediaTypeConfig(BaseModel):
+    bucket: str = Field(min_length=3)
+    max_file_size: int = Field(gt=0)
+    concurrency: int = Field(default=4, gt=0)
+    variant: VariantPolicy = Field(default=VariantPolicy.ORIGINAL)
+
+
+class ImageFormat(str, Enum):
+    WEBP = 'webp'
+    JPEG = 'jpeg'
+
+
+class MediaProcessingConfig(BaseModel):
+    enabled: bool = Field(default=False)
+    workers: int = Field(default=2, gt=0)
+    format: ImageFormat = Field(default=ImageFormat.WEBP)
+    quality: int = Field(default=80, ge=1, le=100)
+    max_dimension: int = Field(default=2048, gt=0)
+    # Processed media is downloaded into memory first instead of being streamed
+    max_file_size: int = Field(default=20 * 1000 ** 2, gt=0)
+    types: List[MediaType] = Field(default_factory=lambda: [MediaType.PHOTO])
+
+
+class PerceptualHashConfig(BaseModel):
+    enabled: bool = Field(default=False)
+    workers: int = Field(default=1, gt=0)
+    # Images whose hashes differ in at most this many of 64 bits are considered the same
+    max_distance: int = Field(default=4, ge=0, lt=16)
+    index_size: int = Field(default=100_000, gt=0)
+    # Hashed media is downloaded into memory first instead of being streamed
+    max_file_size: int = Field(default=20 * 1000 ** 2, gt=0)
+    types: List[MediaType] = Field(default_factory=lambda: [MediaType.PHOTO])
+
+
+class MediaConfig(BaseModel):
+    # S3 multipart parts can't be smaller than 5MiB
+    part_size: int = Field(default=5 * 1024 ** 2, ge=5 * 1024 ** 2)
+    parallel_uploads: int = Field(default=2, gt=0)
+    cache_size: int = Field(default=10_000, gt=0)
+    cache_check_s3: bool = Field(default=True)
+    types: Dict[MediaType, MediaTypeConfig] = Field(default_factory=dict)
+    processing: MediaProcessingConfig = Field(default_factory=MediaProcessingConfig)
+    perceptual_hash: PerceptualHashConfig = Field(default_factory=PerceptualHashConfig)
+
+
+class FilterConfig(BaseModel):
+    # Updates from any other chat are dropped
+    whitelist: List[int] = Field()
+    # Empty allows every chat type
+    chat_types: List[PyrogramChatType] = Field(default_factory=list)
+    deny_media_types: List[MessageMediaType] = Field(default_factory=list)
+    allow_bots: bool = Field(default=True)
+
+
+class CardinalityMode(str, Enum):
+    # Fixed memory per counter, counts are estimates
+    HYPERLOGLOG = 'hyperloglog'
+    # Every id is kept in memory
+    EXACT = 'exact'
+
+
+class CardinalityConfig(BaseModel):
+    mode: CardinalityMode = Field(default=CardinalityMode.HYPERLOGLOG)
+    # 2 ** precision bytes per counter
+    precision: int = Field(default=14, ge=4, le=18)
+    # Counts are not kept across restarts if None
+    snapshot_path: Optional[str] = Field(default=None)
+    snapshot_interval: float = Field(default=60.0, gt=0)
+
+
+DEFAULT_STAGE_BUCKETS = [0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0]
+DEFAULT_END_TO_END_BUCKETS = [0.5, 1.0, 2.0, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 600.0]
+
+
+class LatencyConfig(BaseModel):
+    stage_buckets: List[float] = Field(default_factory=lambda: list(DEFAULT_STAGE_BUCKETS), min_length=1)
+    end_to_end_buckets: List[float] = Field(default_factory=lambda: list(DEFAULT_END_TO_END_BUCKETS), min_length=1)
+
+
+class MetricsConfig(BaseModel):
+    cardinality: CardinalityConfig = Field(default_factory=CardinalityConfig)
+    latency: LatencyConfig = Field(default_factory=LatencyConfig)
+
+
+class SendSchedulerConfig(BaseModel):
+    # Telegram allows bots about 30 messages per second overall, one per second in a private chat
+    # and 20 per minute in a group
+    global_rate: float = Field(default=30.0, gt=0)
+    global_burst: int = Field(default=30, gt=0)
+    private_rate: float = Field(default=1.0, gt=0)
+    private_burst: int = Field(default=3, gt=0)
+    group_rate: float = Field(default=20 / 60, gt=0)
+    group_burst: int = Field(default=3, gt=0)
+    # Sends waiting for a token, further sends are rejected
+    max_pending: int = Field(default=1_000, gt=0)
+    # Sends that Telegram asks to delay for longer, or that got a FloodWait this many times, fail
+    max_flood_wait: float = Field(default=60.0, ge=0)
+    max_attempts: int = Field(default=3, gt=0)
+
+
+class LoggingConfig(BaseModel):
+    # SERVER_LOG_LEVEL overrides it
+    level: str = Field(default='INFO', min_length=1)
+    # Records waiting for the logging thread, further records are dropped
+    queue_size: int = Field(default=10_000, gt=0)
+    # Longer message texts and captions are cut
+    max_text_length: int = Field(default=200, gt=0)
+    # Chats with more messages than this per window are noisy, only a sample of their messages is logged
+    noisy_chat_threshold: int = Field(default=30, gt=0)
+    noisy_chat_window: float = Field(default=60.0, gt=0)
+    noisy_chat_sample_every: int = Field(default=10, gt=0)
 
 
 class FrontendConfig(BaseModel):
     name: str = Field(min_length=1)
     max_file_size: int = Field()
     upload_files: bool = Field(default=True)
-    whitelist: List[int] = Field()
+    two_phase_publish: bool = Field(default=False)
+    filter: FilterConfig = Field()
+    ingest: IngestConfig = Field(default_factory=IngestConfig)
+    media: MediaConfig = Field(default_factory=MediaConfig)
+    metrics: MetricsConfig = Field(default_factory=MetricsConfig)
+    send: SendSchedulerConfig = Field(default_factory=SendSchedulerConfig)
+
+
+def get_media_type_configs(conf: dict, default_max_file_size: int) -> Dict[MediaType, MediaTypeConfig]:
+    """
+    Every media type except OTHER is uploaded to a bucket named after it, unless frontend.media.types overrides it
+    """
+
+    overrides = get_dict_key_by_path(conf, 'frontend.media.types', fail=False, default={})
+    configs = {}
+    for media_type in MediaType:
+        if media_type == MediaType.OTHER:
+            continue
+        override = overrides.get(media_type.value.lower().replace('_', '-'), {})
+        max_file_size = override.get('max-file-size')
+        configs[media_type] = MediaTypeConfig(
+            bucket=override.get('bucket', media_type.value.lower().replace('_', '-')),
+            max_file_size=convert_string_size_to_bytes(str(max_file_size))
+            if max_file_size is not None else default_max_file_size,
+            concurrency=override.get('concurrency', 4),
+            variant=override.get('variant', VariantPolicy.ORIGINAL),
+        )
+    return configs
+
+
+def get_filter_config(conf: dict) -> FilterConfig:
+    """
+    Chat and media types are written as lower-case names with dashes, e.g. supergroup or video-note
+    """
+
+    return FilterConfig(
+        whitelist=get_dict_key_by_path(conf, 'frontend.chat.whitelist'),
+        chat_types=[
+            PyrogramChatType[it.upper()]
+            for it in get_dict_key_by_path(conf, 'frontend.filter.chat-types', fail=False, default=[])
+        ],
+        deny_media_types=[
+            MessageMediaType[it.upper().replace('-', '_')]
+            for it in get_dict_key_by_path(conf, 'frontend.filter.deny-media-types', fail=False, default=[])
+        ],
+        allow_bots=get_dict_key_by_path(conf, 'frontend.filter.allow-bots', fail=False, default=True),
+    )
+
+
+def get_logging_config(conf: dict) -> LoggingConfig:
+    return LoggingConfig(
+        level=get_dict_key_by_path(conf, 'logging.level', fail=False, default='INFO'),
+        queue_size=get_dict_key_by_path(conf, 'logging.queue-size', fail=False, default=10_000),
+        max_text_length=get_dict_key_by_path(conf, 'logging.max-text-length', fail=False, default=200),
+        noisy_chat_threshold=get_dict_key_by_path(conf, 'logging.noisy-chats.threshold', fail=False, default=30),
+        noisy_chat_window=get_dict_key_by_path(conf, 'logging.noisy-chats.window', fail=False, default=60.0),
+        noisy_chat_sample_every=get_dict_key_by_path(conf, 'logging.noisy-chats.sample-every', fail=False,
+                                                     default=10),
+    )
 
 
 def get_configurations(conf: dict) -> tuple[S3Config, KafkaConfig, FrontendConfig]:
@@ -29,12 +247,133 @@ def get_configurations(conf: dict) -> tuple[S3Config, KafkaConfig, FrontendConfi
     kafka_config = KafkaConfig(
         bootstrap_servers=get_dict_key_by_path(conf, 'kafka.bootstrap.servers'),
         messages_topic=get_dict_key_by_path(conf, 'kafka.messages.topic'),
+        messages_format=get_dict_key_by_path(
+            conf, 'kafka.messages.format', fail=False, default=SerializationFormat.JSON
+        ),
+        linger_ms=get_dict_key_by_path(conf, 'kafka.producer.linger-ms', fail=False, default=5),
+        batch_size=convert_string_size_to_bytes(
+            str(get_dict_key_by_path(conf, 'kafka.producer.batch-size', fail=False, default='1MB'))
+        ),
+        queue_buffering_max_messages=get_dict_key_by_path(
+            conf, 'kafka.producer.queue-size', fail=False, default=100_000
+        ),
+        compression_type=get_dict_key_by_path(conf, 'kafka.producer.compression', fail=False, default='lz4'),
+        enqueue_timeout=get_dict_key_by_path(conf, 'kafka.producer.enqueue-timeout', fail=False, default=5.0),
+        delivery_timeout_ms=get_dict_key_by_path(
+            conf, 'kafka.producer.delivery-timeout-ms', fail=False, default=30_000
+        ),
+        statistics_interval_ms=get_dict_key_by_path(
+            conf, 'kafka.producer.statistics-interval-ms', fail=False, default=15_000
+        ),
+        outbox=KafkaOutboxConfig(
+            enabled=get_dict_key_by_path(conf, 'kafka.outbox.enabled', fail=False, default=False),
+            directory=get_dict_key_by_path(conf, 'kafka.outbox.directory', fail=False, default='outbox'),
+            segment_size=convert_string_size_to_bytes(
+                str(get_dict_key_by_path(conf, 'kafka.outbox.segment-size', fail=False, default='64MB'))
+            ),
+            fsync_interval=get_dict_key_by_path(conf, 'kafka.outbox.fsync-interval', fail=False, default=0.5),
+            replay_batch_size=get_dict_key_by_path(conf, 'kafka.outbox.replay-batch-size', fail=False, default=500),
+            retry_interval=get_dict_key_by_path(conf, 'kafka.outbox.retry-interval', fail=False, default=5.0),
+            send_timeout=get_dict_key_by_path(conf, 'kafka.outbox.send-timeout', fail=False, default=2.0),
+        ),
     )
+    max_file_size = convert_string_size_to_bytes(get_dict_key_by_path(conf, 'frontend.max-file-size'))
     frontend_config = FrontendConfig(
         name=get_dict_key_by_path(conf, 'frontend.name'),
-        max_file_size=convert_string_size_to_bytes(get_dict_key_by_path(conf, 'frontend.max-file-size')),
-        upload_files=get_dict_key_by_path(conf, 'frontend.upload-files', fail=False),
-        whitelist=get_dict_key_by_path(conf, 'frontend.chat.whitelist'),
+        max_file_size=max_file_size,
+        upload_files=get_dict_key_by_path(conf, 'frontend.upload-files', fail=False, default=True),
+        two_phase_publish=get_dict_key_by_path(conf, 'frontend.two-phase-publish', fail=False, default=False),
+        filter=get_filter_config(conf),
+        ingest=IngestConfig(
+            queue_size=get_dict_key_by_path(conf, 'frontend.ingest.queue-size', fail=False, default=100),
+            lanes=get_dict_key_by_path(conf, 'frontend.ingest.lanes', fail=False, default=16),
+            overflow_policy=get_dict_key_by_path(
+                conf, 'frontend.ingest.overflow-policy', fail=False, default=OverflowPolicy.BLOCK
+            ),
+            max_in_flight=get_dict_key_by_path(conf, 'frontend.ingest.max-in-flight', fail=False, default=64),
+        ),
+        media=MediaConfig(
+            part_size=convert_string_size_to_bytes(
+                str(get_dict_key_by_path(conf, 'frontend.media.part-size', fail=False, default='5MiB'))
+            ),
+            parallel_uploads=get_dict_key_by_path(conf, 'frontend.media.parallel-uploads', fail=False, default=2),
+            cache_size=get_dict_key_by_path(conf, 'frontend.media.cache-size', fail=False, default=10_000),
+            cache_check_s3=get_dict_key_by_path(conf, 'frontend.media.cache-check-s3', fail=False, default=True),
+            types=get_media_type_configs(conf, max_file_size),
+            processing=MediaProcessingConfig(
+                enabled=get_dict_key_by_path(conf, 'frontend.media.processing.enabled', fail=False, default=False),
+                workers=get_dict_key_by_path(conf, 'frontend.media.processing.workers', fail=False, default=2),
+                format=get_dict_key_by_path(
+                    conf, 'frontend.media.processing.format', fail=False, default=ImageFormat.WEBP
+                ),
+                quality=get_dict_key_by_path(conf, 'frontend.media.processing.quality', fail=False, default=80),
+                max_dimension=get_dict_key_by_path(
+                    conf, 'frontend.media.processing.max-dimension', fail=False, default=2048
+                ),
+                max_file_size=convert_string_size_to_bytes(
+                    str(get_dict_key_by_path(conf, 'frontend.media.processing.max-file-size', fail=False,
+                                             default='20MB'))
+                ),
+                types=[
+                    MediaType(it.upper().replace('-', '_'))
+                    for it in get_dict_key_by_path(conf, 'frontend.media.processing.types', fail=False,
+                                                   default=['photo'])
+                ],
+            ),
+            perceptual_hash=PerceptualHashConfig(
+                enabled=get_dict_key_by_path(conf, 'frontend.media.perceptual-hash.enabled', fail=False,
+                                             default=False),
+                workers=get_dict_key_by_path(conf, 'frontend.media.perceptual-hash.workers', fail=False, default=1),
+                max_distance=get_dict_key_by_path(
+                    conf, 'frontend.media.perceptual-hash.max-distance', fail=False, default=4
+                ),
+                index_size=get_dict_key_by_path(
+                    conf, 'frontend.media.perceptual-hash.index-size', fail=False, default=100_000
+                ),
+                max_file_size=convert_string_size_to_bytes(
+                    str(get_dict_key_by_path(conf, 'frontend.media.perceptual-hash.max-file-size', fail=False,
+                                             default='20MB'))
+                ),
+                types=[
+                    MediaType(it.upper().replace('-', '_'))
+                    for it in get_dict_key_by_path(conf, 'frontend.media.perceptual-hash.types', fail=False,
+                                                   default=['photo'])
+                ],
+            ),
+        ),
+        metrics=MetricsConfig(
+            cardinality=CardinalityConfig(
+                mode=get_dict_key_by_path(
+                    conf, 'frontend.metrics.cardinality.mode', fail=False, default=CardinalityMode.HYPERLOGLOG
+                ),
+                precision=get_dict_key_by_path(conf, 'frontend.metrics.cardinality.precision', fail=False,
+                                               default=14),
+                snapshot_path=get_dict_key_by_path(
+                    conf, 'frontend.metrics.cardinality.snapshot-path', fail=False, default=None
+                ),
+                snapshot_interval=get_dict_key_by_path(
+                    conf, 'frontend.metrics.cardinality.snapshot-interval', fail=False, default=60.0
+                ),
+            ),
+            latency=LatencyConfig(
+                stage_buckets=get_dict_key_by_path(
+                    conf, 'frontend.metrics.latency.stage-buckets', fail=False, default=DEFAULT_STAGE_BUCKETS
+                ),
+                end_to_end_buckets=get_dict_key_by_path(conf, 'frontend.metrics.latency.end-to-end-buckets',
+                                                        fail=False, default=DEFAULT_END_TO_END_BUCKETS),
+            ),
+        ),
+        send=SendSchedulerConfig(
+            global_rate=get_dict_key_by_path(conf, 'frontend.send.global-rate', fail=False, default=30.0),
+            global_burst=get_dict_key_by_path(conf, 'frontend.send.global-burst', fail=False, default=30),
+            private_rate=get_dict_key_by_path(conf, 'frontend.send.private-rate', fail=False, default=1.0),
+            private_burst=get_dict_key_by_path(conf, 'frontend.send.private-burst', fail=False, default=3),
+            group_rate=get_dict_key_by_path(conf, 'frontend.send.group-rate', fail=False, default=20 / 60),
+            group_burst=get_dict_key_by_path(conf, 'frontend.send.group-burst', fail=False, default=3),
+            max_pending=get_dict_key_by_path(conf, 'frontend.send.max-pending', fail=False, default=1_000),
+            max_flood_wait=get_dict_key_by_path(conf, 'frontend.send.max-flood-wait', fail=False, default=60.0),
+            max_attempts=get_dict_key_by_path(conf, 'frontend.send.max-attempts', fail=False, default=3),
+        ),
     )
 
     return s3_config, kafka_config, frontend_config
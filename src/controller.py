@@ -1,23 +1,55 @@
+import asyncio
 import logging
-from typing import Optional, List
+import math
+from typing import Awaitable, Callable, Optional, List
 
 from fastapi import APIRouter
 from fastapi.encoders import jsonable_encoder
 from fastapi.responses import JSONResponse, Response
 from pydantic import BaseModel, Field
 from pyrogram import Client as PyrogramClient, enums
+from pyrogram.errors import FloodWait
 from starlette import status
 
+from src.send_scheduler import SendPriority, SendQueueFull, SendRejected, SendScheduler
+
 
 class SendTextMessageRequest(BaseModel):
     text: str = Field()
     reply_to: Optional[str] = Field(None)
+    priority: SendPriority = Field(SendPriority.NORMAL)
 
 
 class SendMessageResponse(BaseModel):
     message_id: str = Field()
 
 
+# Requests with more messages are rejected, so one request can't fill the send queue
+MAX_BATCH_SIZE = 100
+
+
+class BatchTextMessageRequest(SendTextMessageRequest):
+    chat_id: str = Field()
+
+
+class SendTextMessagesRequest(BaseModel):
+    messages: List[BatchTextMessageRequest] = Field(min_length=1, max_length=MAX_BATCH_SIZE)
+
+
+class SendTextMessageResult(BaseModel):
+    # Either message_id, or error_code and error_message are set
+    message_id: Optional[str] = Field(None)
+    error_code: Optional[str] = Field(None)
+    error_message: Optional[str] = Field(None)
+    # Seconds, only set for FLOOD_WAIT
+    retry_after: Optional[int] = Field(None)
+
+
+class SendTextMessagesResponse(BaseModel):
+    # In the order of the requested messages
+    results: List[SendTextMessageResult] = Field()
+
+
 class SendMessageErrorResponse(BaseModel):
     error_message: str = Field()
     error_code: str = Field()
@@ -27,27 +59,39 @@ class GetAdminsResponse(BaseModel):
     admin_ids: List[int] = Field()
 
 
+def get_throttled_response(error_message: str, error_code: str, retry_after: Optional[float]) -> Response:
+    return JSONResponse(
+        status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+        content=jsonable_encoder(SendMessageErrorResponse(error_message=error_message, error_code=error_code)),
+        headers={'Retry-After': str(math.ceil(retry_after))} if retry_after is not None else None,
+    )
+
+
 class Controller:
     def __init__(self,
-                 pyrogram_client: PyrogramClient
+                 pyrogram_client: PyrogramClient,
+                 scheduler: SendScheduler,
                  ):
         self.log = logging.getLogger(f'{__name__}.{self.__class__.__name__}')
         self.pyrogram_client = pyrogram_client
+        self.scheduler = scheduler
         self.router = APIRouter()
 
         self.router.add_api_route('/chats/{chat_id}/text-messages', self.send_text_message, methods=['POST'])
+        self.router.add_api_route('/text-messages', self.send_text_messages, methods=['POST'])
         self.router.add_api_route('/chats/{chat_id}/admins', self.get_chat_admins, methods=['GET'])
         self.router.add_api_route('/chats/{chat_id}/actions/typing', self.send_typing, methods=['POST'])
         self.router.add_api_route('/chats/{chat_id}/actions/typing', self.stop_typing, methods=['DELETE'])
 
     async def send_text_message(self, chat_id: str, request: SendTextMessageRequest) -> Response:
-        self.log.info(f'Sending text message to chat_id {chat_id}')
-        self.log.info(f'Body: {request.model_dump_json(indent=2)}')
+        self.log.info('Sending text message to chat_id %s', chat_id)
+        if self.log.isEnabledFor(logging.DEBUG):
+            self.log.debug('Body: %s', request.model_dump_json())
         try:
-            sent_message = await self.pyrogram_client.send_message(
-                chat_id=int(chat_id),
-                text=request.text,
-                reply_to_message_id=int(request.reply_to) if request.reply_to is not None else None
+            sent_message = await self.scheduler.submit(
+                int(chat_id),
+                self._get_text_sender(int(chat_id), request),
+                request.priority,
             )
             return JSONResponse(
                 status_code=status.HTTP_200_OK,
@@ -57,18 +101,15 @@ class Controller:
                     )
                 )
             )
-            # return JSONResponse(
-            #     status_code=status.HTTP_200_OK,
-            #     content=jsonable_encoder(
-            #         SendMessageResponse(
-            #             message_id=str(1337)
-            #         )
-            #     )
-            # )
+        except SendQueueFull as e:
+            self.log.warning('Rejected text message to chat_id %s: %s', chat_id, e)
+            return get_throttled_response(str(e), 'QUEUE_FULL', retry_after=None)
+        except SendRejected as e:
+            self.log.warning('Rejected text message to chat_id %s: %s', chat_id, e)
+            return get_throttled_response(str(e), 'FLOOD_WAIT', retry_after=e.retry_after)
         except RuntimeError as e:
-            self.log.error('Error while trying to send message with parameters:\n'
-                           f'{request.model_dump_json()}')
-            self.log.error(e, exc_info=True)
+            self.log.error('Error while trying to send message with parameters: %s', request.model_dump_json(),
+                           exc_info=True)
 
             return JSONResponse(
                 status_code=status.HTTP_400_BAD_REQUEST,
@@ -80,21 +121,74 @@ class Controller:
                 )
             )
         except Exception as e:
-            self.log.error('Unrecoverable exception while trying to send message')
-            self.log.error(e, exc_info=True)
+            self.log.error('Unrecoverable exception while trying to send message', exc_info=True)
             raise e
 
+    async def send_text_messages(self, request: SendTextMessagesRequest) -> Response:
+        """
+        Messages are queued in the order of the request, so messages to one chat are sent in that order.
+        Failed messages don't fail the request, every message gets its own result
+        """
+
+        self.log.info('Sending %s text messages', len(request.messages))
+        if self.log.isEnabledFor(logging.DEBUG):
+            self.log.debug('Body: %s', request.model_dump_json())
+
+        results: List[Optional[SendTextMessageResult]] = [None] * len(request.messages)
+        pending = {}
+        for index, item in enumerate(request.messages):
+            try:
+                chat_id = int(item.chat_id)
+                if item.reply_to is not None:
+                    int(item.reply_to)
+            except ValueError:
+                results[index] = SendTextMessageResult(
+                    error_code='INVALID_ID',
+                    error_message=f'Invalid chat or reply ID: {item.chat_id}, {item.reply_to}',
+                )
+                continue
+            try:
+                pending[index] = self.scheduler.enqueue(chat_id, self._get_text_sender(chat_id, item), item.priority)
+            except SendQueueFull as e:
+                results[index] = SendTextMessageResult(error_code='QUEUE_FULL', error_message=str(e))
+
+        outcomes = await asyncio.gather(*pending.values(), return_exceptions=True)
+        for index, outcome in zip(pending, outcomes):
+            if isinstance(outcome, SendRejected):
+                results[index] = SendTextMessageResult(
+                    error_code='FLOOD_WAIT',
+                    error_message=str(outcome),
+                    retry_after=math.ceil(outcome.retry_after),
+                )
+            elif isinstance(outcome, Exception):
+                self.log.error('Error while trying to send message to chat_id %s', request.messages[index].chat_id,
+                               exc_info=outcome)
+                results[index] = SendTextMessageResult(error_code='UNKNOWN_ERROR', error_message=str(outcome))
+            else:
+                results[index] = SendTextMessageResult(message_id=str(outcome.id))
+
+        return JSONResponse(
+            status_code=status.HTTP_200_OK,
+            content=jsonable_encoder(SendTextMessagesResponse(results=results), exclude_none=True),
+        )
+
+    def _get_text_sender(self, chat_id: int, request: SendTextMessageRequest) -> Callable[[], Awaitable]:
+        return lambda: self.pyrogram_client.send_message(
+            chat_id=chat_id,
+            text=request.text,
+            reply_to_message_id=int(request.reply_to) if request.reply_to is not None else None
+        )
+
     async def get_chat_admins(self, chat_id: str) -> Response:
-        self.log.info(f'Getting chat admins for chat_id {chat_id}')
-        self.log.info(f'::get_chat_admins unimplemented')
+        self.log.info('Getting chat admins for chat_id %s', chat_id)
+        self.log.info('::get_chat_admins unimplemented')
         try:
             return JSONResponse(
                 status_code=status.HTTP_200_OK,
                 content=jsonable_encoder(GetAdminsResponse(admin_ids=[]))
             )
         except RuntimeError as e:
-            self.log.error(f'Error while trying to get chat ids for chat {chat_id}')
-            self.log.error(e, exc_info=True)
+            self.log.error('Error while trying to get chat ids for chat %s', chat_id, exc_info=True)
 
             return JSONResponse(
                 status_code=status.HTTP_400_BAD_REQUEST,
@@ -107,15 +201,21 @@ class Controller:
             )
 
     async def send_typing(self, chat_id: str) -> Response:
-        self.log.info(f'Sending typing action for chat id {chat_id}')
+        self.log.info('Sending typing action for chat id %s', chat_id)
 
-        await self.pyrogram_client.send_chat_action(chat_id=chat_id, action=enums.ChatAction.TYPING)
+        try:
+            await self.pyrogram_client.send_chat_action(chat_id=chat_id, action=enums.ChatAction.TYPING)
+        except FloodWait as e:
+            return get_throttled_response(str(e), 'FLOOD_WAIT', retry_after=e.value)
 
         return Response(status_code=status.HTTP_200_OK)
 
     async def stop_typing(self, chat_id: str) -> Response:
-        self.log.info(f'Stopping typing action for chat id {chat_id}')
+        self.log.info('Stopping typing action for chat id %s', chat_id)
 
-        await self.pyrogram_client.send_chat_action(chat_id=chat_id, action=enums.ChatAction.CANCEL)
+        try:
+            await self.pyrogram_client.send_chat_action(chat_id=chat_id, action=enums.ChatAction.CANCEL)
+        except FloodWait as e:
+            return get_throttled_response(str(e), 'FLOOD_WAIT', retry_after=e.value)
 
         return Response(status_code=status.HTTP_200_OK)
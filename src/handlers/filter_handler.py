@@ -0,0 +1,88 @@
+import logging
+import time
+from typing import Callable, List, Optional, Tuple
+
+import pyrogram
+from prometheus_client import Counter
+from pyrogram import Client
+from pyrogram.types import Message as PyrogramMessage
+
+from src.config import FilterConfig
+from src.ingest_latency import IngestLatency, get_latency_labels
+from src.prometheus_metrics import prometheus_frontend_filtered
+
+Check = Tuple[Counter, Callable[[PyrogramMessage], bool]]
+
+
+def compile_checks(config: FilterConfig) -> Tuple[Check, ...]:
+    """
+    Turns the rule set into predicates that reject a message. Rules that allow everything are left out,
+    so they cost nothing per update. The cheapest and most selective check goes first
+    """
+
+    checks: List[Check] = []
+
+    whitelist = frozenset(config.whitelist)
+    checks.append((prometheus_frontend_filtered.labels('chat'),
+                   lambda it: it.chat is None or it.chat.id not in whitelist))
+
+    if config.chat_types:
+        chat_types = frozenset(config.chat_types)
+        checks.append((prometheus_frontend_filtered.labels('chat_type'), lambda it: it.chat.type not in chat_types))
+
+    if config.deny_media_types:
+        media_types = frozenset(config.deny_media_types)
+        checks.append((prometheus_frontend_filtered.labels('media_type'), lambda it: it.media in media_types))
+
+    if not config.allow_bots:
+        checks.append((prometheus_frontend_filtered.labels('bot'),
+                       lambda it: it.from_user is not None and it.from_user.is_bot))
+
+    return tuple(checks)
+
+
+class FilterEngine:
+    """
+    Decides whether an update is worth handling at all. The rule set can be replaced at runtime,
+    the swap is a single assignment, so updates see either the old or the new rules, never a mix
+    """
+
+    def __init__(self, config: FilterConfig):
+        self.log = logging.getLogger(f'{__name__}.{self.__class__.__name__}')
+        self._checks = compile_checks(config)
+
+    def reload(self, config: FilterConfig) -> None:
+        self._checks = compile_checks(config)
+        self.log.info('Filter rules reloaded: %s', config)
+
+    def reject(self, message: PyrogramMessage) -> Optional[Counter]:
+        """
+        :return: counter of the rule that rejected the message, None if the message is accepted
+        """
+
+        for counter, rejects in self._checks:
+            if rejects(message):
+                return counter
+        return None
+
+
+def register_filter_handler(client: Client,
+                            engine: FilterEngine,
+                            group: int = -458158,
+                            latency: Optional[IngestLatency] = None,
+                            ):
+    """
+    Must be registered in the earliest group: rejected updates stop propagating,
+    so no later group spends any time on them
+    """
+
+    async def __filter_handler(_: Client, message: PyrogramMessage):
+        started_at = time.perf_counter()
+        counter = engine.reject(message)
+        if latency is not None:
+            latency.observe('filter', get_latency_labels(message), time.perf_counter() - started_at)
+        if counter is not None:
+            counter.inc()
+            message.stop_propagation()
+
+    client.add_handler(pyrogram.handlers.MessageHandler(__filter_handler, filters=None), group=group)
@@ -7,10 +7,12 @@ from aiohttp import ClientError
 from pyrogram import Client
 from pyrogram.types import Message as PyrogramMessage, User, Chat
 
+from src.message_snapshot import MessageSnapshot, get_snapshot
 from src.new_message_request import NewMessageUser, NewMessageChat, NewMessageRequest
 from src.pyrogram_utils import get_fullname, get_chat_type, get_action_info, get_message_type, get_media_type
 
 
+# Accept snapshots as well, see src.message_snapshot
 def pyrogram_user_to_dto_user(value: User) -> NewMessageUser:
     return NewMessageUser(
         id=str(value.id),
@@ -27,6 +29,20 @@ def pyrogram_chat_to_dto_chat(value: Chat) -> NewMessageChat:
     )
 
 
+def snapshot_to_new_message_request(value: MessageSnapshot, frontend_name: str) -> NewMessageRequest:
+    return NewMessageRequest(
+        id=str(value.id),
+        author=pyrogram_user_to_dto_user(value.from_user),
+        chat=pyrogram_chat_to_dto_chat(value.chat),
+        frontend=frontend_name,
+        text=value.text,
+        type=get_message_type(value),
+        reply_to=str(value.reply_to_message_id),
+        action_info=get_action_info(value),
+        media_type=get_media_type(value),
+    )
+
+
 def register_gateway_handler(
         client: Client,
         message_gateway_addresses: list[str],
@@ -36,23 +52,7 @@ def register_gateway_handler(
     log = logging.getLogger(f'{__name__}.gateway_logging_handler')
 
     async def __gateway_logging_handler(_: Client, pyrogram_message: PyrogramMessage):
-        author = pyrogram_user_to_dto_user(pyrogram_message.from_user)
-        chat = pyrogram_chat_to_dto_chat(pyrogram_message.chat)
-        message_type = get_message_type(pyrogram_message)
-        action_info = get_action_info(pyrogram_message)
-        media_type = get_media_type(pyrogram_message)
-
-        message = NewMessageRequest(
-            id=str(pyrogram_message.id),
-            author=author,
-            chat=chat,
-            frontend=frontend_name,
-            text=pyrogram_message.text,
-            type=message_type,
-            reply_to=str(pyrogram_message.reply_to_message_id),
-            action_info=action_info,
-            media_type=media_type,
-        )
+        message = snapshot_to_new_message_request(get_snapshot(pyrogram_message), frontend_name)
 
         for gateway_address in message_gateway_addresses:
             async with aiohttp.ClientSession() as session:
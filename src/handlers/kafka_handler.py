@@ -1,42 +1,53 @@
+import asyncio
 import logging
-import pathlib
-from asyncio import AbstractEventLoop
-from io import BytesIO
-from typing import Optional, Set
+import time
+from datetime import datetime
+from typing import Dict, Optional
 
 import pyrogram
-from confluent_kafka import Producer
-from miniopy_async import Minio
-from pydantic import ValidationError
+from confluent_kafka import KafkaException
+from pydantic import BaseModel, ValidationError
 from pyrogram import Client
 from pyrogram.types import Message as PyrogramMessage
 
-from src.new_message import User, Chat, ChatType, NewMessage, MediaType
+from src.config import IngestConfig
+from src.ingest_latency import IngestLatency, LatencyLabels, get_latency_labels
+from src.ingest_queue import IngestQueue, IngestJob
+from src.kafka_producer import AsyncKafkaProducer
+from src.media import MediaIngestor
+from src.message_snapshot import MessageSnapshot, UserSnapshot, ChatSnapshot, get_snapshot, get_user_snapshot
+from src.new_message import User, Chat, ChatType, NewMessage, MediaType, MediaReady, MediaStatus
+from src.outbox import KafkaOutbox
+from src.perceptual_hash import format_hash
+from src.serializers import EventSerializer
+
+
+MEDIA_TYPES: Dict[pyrogram.enums.MessageMediaType, MediaType] = {
+    pyrogram.enums.MessageMediaType.STICKER: MediaType.STICKER,
+    pyrogram.enums.MessageMediaType.AUDIO: MediaType.AUDIO,
+    pyrogram.enums.MessageMediaType.VOICE: MediaType.VOICE,
+    pyrogram.enums.MessageMediaType.PHOTO: MediaType.PHOTO,
+    pyrogram.enums.MessageMediaType.VIDEO: MediaType.VIDEO,
+    pyrogram.enums.MessageMediaType.ANIMATION: MediaType.ANIMATION,
+    pyrogram.enums.MessageMediaType.VIDEO_NOTE: MediaType.VIDEO_NOTE,
+}
+
+CHAT_TYPES: Dict[pyrogram.enums.ChatType, ChatType] = {
+    pyrogram.enums.ChatType.PRIVATE: ChatType.PRIVATE,
+    pyrogram.enums.ChatType.BOT: ChatType.PRIVATE,
+    pyrogram.enums.ChatType.GROUP: ChatType.GROUP,
+    pyrogram.enums.ChatType.SUPERGROUP: ChatType.GROUP,
+    pyrogram.enums.ChatType.CHANNEL: ChatType.GROUP,
+}
 
 
 def pyrogram_mediatype_to_mediatype(value: Optional[pyrogram.enums.MessageMediaType]) -> Optional[MediaType]:
     if value is None:
         return None
-    match value:
-        case pyrogram.enums.MessageMediaType.STICKER:
-            return MediaType.STICKER
-        case pyrogram.enums.MessageMediaType.AUDIO:
-            return MediaType.AUDIO
-        case pyrogram.enums.MessageMediaType.VOICE:
-            return MediaType.VOICE
-        case pyrogram.enums.MessageMediaType.PHOTO:
-            return MediaType.PHOTO
-        case pyrogram.enums.MessageMediaType.VIDEO:
-            return MediaType.VIDEO
-        case pyrogram.enums.MessageMediaType.ANIMATION:
-            return MediaType.ANIMATION
-        case pyrogram.enums.MessageMediaType.VIDEO_NOTE:
-            return MediaType.VIDEO_NOTE
-        case _:
-            return MediaType.OTHER
+    return MEDIA_TYPES.get(value, MediaType.OTHER)
 
 
-def pyrogram_user_to_user(value: Optional[pyrogram.types.User]) -> Optional[User]:
+def user_snapshot_to_user(value: Optional[UserSnapshot]) -> Optional[User]:
     if value is None:
         return None
 
@@ -49,115 +60,208 @@ def pyrogram_user_to_user(value: Optional[pyrogram.types.User]) -> Optional[User
     )
 
 
-def pyrogram_chat_to_chat(value: Optional[pyrogram.types.Chat]) -> Optional[Chat]:
+def chat_snapshot_to_chat(value: Optional[ChatSnapshot]) -> Optional[Chat]:
     if value is None:
         return None
 
-    chat_type: ChatType
-    match value.type:
-        case pyrogram.enums.ChatType.PRIVATE:
-            chat_type = ChatType.PRIVATE
-        case pyrogram.enums.ChatType.BOT:
-            chat_type = ChatType.PRIVATE
-        case pyrogram.enums.ChatType.GROUP:
-            chat_type = ChatType.GROUP
-        case pyrogram.enums.ChatType.SUPERGROUP:
-            chat_type = ChatType.GROUP
-        case pyrogram.enums.ChatType.CHANNEL:
-            chat_type = ChatType.GROUP
-        case _:
-            return None
+    chat_type = CHAT_TYPES.get(value.type)
+    if chat_type is None:
+        return None
 
     chat_title: str
     if chat_type == ChatType.PRIVATE:
-        if value.first_name is None and value.last_name is not None:
-            chat_title = value.last_name
-        elif value.first_name is not None and value.last_name is None:
-            chat_title = value.first_name
-        elif value.first_name is not None and value.last_name is not None:
+        if value.first_name is not None and value.last_name is not None:
             chat_title = f'{value.first_name} {value.last_name}'
-        elif value.username is not None:
-            chat_title = value.username
-        elif value.title is not None:
-            chat_title = value.title
         else:
-            chat_title = str(value.id)
+            chat_title = value.first_name or value.last_name or value.username or value.title or str(value.id)
     else:
         chat_title = value.title
 
     return Chat(
         id=str(value.id),
         title=chat_title,
-        type=chat_type
+        type=chat_type,
     )
 
 
+def pyrogram_user_to_user(value: Optional[pyrogram.types.User]) -> Optional[User]:
+    return user_snapshot_to_user(get_user_snapshot(value))
+
+
+def pyrogram_chat_to_chat(value: Optional[pyrogram.types.Chat]) -> Optional[Chat]:
+    return chat_snapshot_to_chat(ChatSnapshot(value) if value is not None else None)
+
+
+def snapshot_to_new_message(value: MessageSnapshot, frontend: str) -> NewMessage:
+    return NewMessage(
+        user=user_snapshot_to_user(value.from_user),
+        chat=chat_snapshot_to_chat(value.chat),
+        forward_from=user_snapshot_to_user(value.forward_from),
+        frontend=frontend,
+        text=value.text,
+        mentioned=value.mentioned,
+        reply_to_message_id=str(value.reply_to_message_id) if value.reply_to_message_id is not None else None,
+        media_type=pyrogram_mediatype_to_mediatype(value.media),
+        s3_bucket=None,
+        s3_object=None,
+    )
+
+
+def pyrogram_message_to_new_message(value: PyrogramMessage, frontend: str) -> NewMessage:
+    return snapshot_to_new_message(get_snapshot(value), frontend)
+
+
+def get_correlation_id(value: MessageSnapshot) -> str:
+    return f'{value.chat.id}:{value.id}'
+
+
 def register_kafka_handler(
         client: Client,
         group: int,
-        minio: Minio,
-        kafka_producer: Producer,
-        event_loop: AbstractEventLoop,
+        media_ingestor: MediaIngestor,
+        kafka_producer: AsyncKafkaProducer,
+        serializer: EventSerializer,
         frontend: str,
         topic: str,
-        max_file_size: int,
-        whitelist: Set[int],
-):
+        upload_files: bool,
+        ingest_config: IngestConfig,
+        outbox: Optional[KafkaOutbox] = None,
+        two_phase_publish: bool = False,
+        latency: Optional[IngestLatency] = None,
+) -> IngestQueue:
+    """
+    Messages are converted, uploaded and published by ingest queue workers, not by the handler itself.
+    The returned queue must be started by the caller
+    :param outbox: if set, events Kafka can't accept are stored there instead of being lost
+    :param two_phase_publish: publish NewMessage before its media is uploaded, and MediaReady after
+    :param latency: if set, time spent in every stage is observed there
+    """
+
     log = logging.getLogger(f'{__name__}.register_kafka_handler')
 
-    def produce(topic: str, key: str, value: str) -> None:
-        kafka_producer.produce(topic=topic, key=key, value=value)
+    async def __publish(chat_id: int, event: BaseModel, labels: LatencyLabels,
+                        message_date: Optional[datetime] = None):
+        """
+        Returns once the event is in the producer queue or in the outbox, the acknowledgement is awaited by
+        a task detached from the lane. The idempotent producer keeps the order of a partition, and the outbox
+        holds later events of a chat behind one that timed out, so events of one chat stay in order
+        :param message_date: date of the message this event completes, observed as end-to-end latency
+        """
 
-    async def __kafka_handler(_: Client, message: PyrogramMessage):
-        if message.chat.id not in whitelist:
-            return
+        key = str(chat_id)
+        value = serializer.serialize(event)
+        headers = serializer.get_headers(event)
+        started_at = enqueued_at = time.perf_counter()
+        enqueued = asyncio.get_running_loop().create_future()
+
+        def on_enqueued():
+            nonlocal enqueued_at
+            enqueued_at = time.perf_counter()
+            if not enqueued.done():
+                enqueued.set_result(None)
+
+        async def deliver():
+            try:
+                if outbox is not None:
+                    delivered = await outbox.publish(topic=topic, key=key, value=value, headers=headers,
+                                                     on_enqueued=on_enqueued)
+                else:
+                    await kafka_producer.send(topic=topic, key=key, value=value, headers=headers,
+                                              on_enqueued=on_enqueued)
+                    delivered = True
+            except BufferError:
+                log.error('Kafka producer queue is full, %s from chat %s was not sent', type(event).__name__, key)
+                return
+            except KafkaException as e:
+                log.error('%s from chat %s was not delivered: %s', type(event).__name__, key, e)
+                return
+
+            if latency is not None and delivered:
+                acked_at = time.perf_counter()
+                latency.observe('kafka_enqueue', labels, enqueued_at - started_at)
+                latency.observe('kafka_ack', labels, acked_at - enqueued_at)
+                if message_date is not None:
+                    latency.observe_end_to_end(labels, time.time() - message_date.timestamp())
+
+        task = await ingest_queue.detach(chat_id, deliver())
+        await asyncio.wait((enqueued, task), return_when=asyncio.FIRST_COMPLETED)
+
+    async def __upload_media(job: IngestJob, chat: Chat, media_type: MediaType,
+                             labels: LatencyLabels) -> MediaReady:
+        snapshot = job.snapshot
+        media_ready = MediaReady(
+            correlation_id=get_correlation_id(snapshot),
+            chat=chat,
+            frontend=frontend,
+            media_type=media_type,
+            status=MediaStatus.SKIPPED,
+        )
+        if job.media is None:
+            log.warning('Message %s has media type %s, yet its media is not set', snapshot.id, media_type.value)
+            return media_ready
         try:
-            user = pyrogram_user_to_user(message.from_user)
-            forwarded_from = pyrogram_user_to_user(message.forward_from)
-            chat = pyrogram_chat_to_chat(message.chat)
-            kafka_message = NewMessage(
-                user=user,
-                chat=chat,
-                forward_from=forwarded_from,
-                frontend=frontend,
-                text=message.text,
-                mentioned=message.mentioned,
-                reply_to_message_id=message.reply_to_message_id,
-                media_type=pyrogram_mediatype_to_mediatype(message.media),
-                s3_bucket=None,
-                s3_object=None,
-            )
+            uploaded = await media_ingestor.ingest(job.media, media_type)
+            if uploaded is not None:
+                media_ready.s3_bucket, media_ready.s3_object = uploaded.bucket_name, uploaded.object_name
+                if uploaded.perceptual_hash is not None:
+                    media_ready.perceptual_hash = format_hash(uploaded.perceptual_hash)
+                media_ready.near_duplicate_distance = uploaded.near_duplicate_distance
+                media_ready.status = MediaStatus.READY
+                if latency is not None:
+                    if uploaded.download_seconds is not None:
+                        latency.observe('download', labels, uploaded.download_seconds)
+                    if uploaded.upload_seconds is not None:
+                        latency.observe('upload', labels, uploaded.upload_seconds)
+        except Exception as e:
+            log.error('Unable to upload media of message %s from chat %s', snapshot.id, snapshot.chat.id)
+            log.error(e, exc_info=True)
+            media_ready.status = MediaStatus.FAILED
+        return media_ready
+
+    async def __process(job: IngestJob):
+        snapshot = job.snapshot
+        labels = get_latency_labels(snapshot)
+        started_at = time.perf_counter()
+        try:
+            kafka_message = snapshot_to_new_message(snapshot, frontend)
         except ValidationError as e:
             log.error('Contract violation! Expected fields were not filled: %s', e)
             return
-        if message.photo is not None:
-            if kafka_message.media_type != MediaType.PHOTO:
-                log.warning('message.photo is not None, yet MediaType is not PHOTO')
-            if message.photo.file_size < max_file_size:
-                downloaded: BytesIO = await message.download(in_memory=True, block=True)
-                # TODO: Sounds like shit. Probably we should not seek this
-                downloaded.seek(0)
-                # TODO: Test if pathlib raises error if no suffix found
-                object_name = str(message.photo.file_id) + pathlib.Path(downloaded.name).suffix
-                await minio.put_object(
-                    bucket_name='photo',
-                    object_name=object_name,
-                    data=downloaded,
-                    length=message.photo.file_size,
-                )
-                downloaded.close()
-                kafka_message.s3_bucket = 'photo'
-                kafka_message.s3_object = object_name
-            pass
-        try:
-            await event_loop.run_in_executor(
-                None,
-                produce,
-                topic,
-                kafka_message.chat.id,
-                kafka_message.model_dump_json()
-            )
-        except Exception as e:
-            log.error(e)
+        if latency is not None:
+            latency.observe('conversion', labels, time.perf_counter() - started_at)
+        if not upload_files or kafka_message.media_type is None or job.skip_media:
+            await __publish(snapshot.chat.id, kafka_message, labels, snapshot.date)
+            return
+
+        if two_phase_publish:
+            kafka_message.media_pending = True
+            kafka_message.correlation_id = get_correlation_id(snapshot)
+            await __publish(snapshot.chat.id, kafka_message, labels)
+            media_ready = await __upload_media(job, kafka_message.chat, kafka_message.media_type, labels)
+            await __publish(snapshot.chat.id, media_ready, labels, snapshot.date)
+            return
+
+        media_ready = await __upload_media(job, kafka_message.chat, kafka_message.media_type, labels)
+        kafka_message.s3_bucket, kafka_message.s3_object = media_ready.s3_bucket, media_ready.s3_object
+        kafka_message.perceptual_hash = media_ready.perceptual_hash
+        kafka_message.near_duplicate_distance = media_ready.near_duplicate_distance
+        await __publish(snapshot.chat.id, kafka_message, labels, snapshot.date)
+
+    ingest_queue = IngestQueue(
+        processor=__process,
+        max_size=ingest_config.queue_size,
+        lanes=ingest_config.lanes,
+        overflow_policy=ingest_config.overflow_policy,
+        max_in_flight=ingest_config.max_in_flight,
+    )
+
+    async def __kafka_handler(_: Client, message: PyrogramMessage):
+        if message.chat is None:
+            # Lanes are picked by chat and events are keyed by it
+            log.warning('Message %s has no chat, skipped', message.id)
+            return
+        await ingest_queue.put(message)
 
     client.add_handler(pyrogram.handlers.MessageHandler(__kafka_handler, filters=None), group=group)
+
+    return ingest_queue
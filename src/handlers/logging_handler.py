@@ -1,41 +1,103 @@
 import logging
+import time
+from typing import Callable, Dict, Optional
 
 import pyrogram
 from pyrogram import Client
 from pyrogram.types import Message as PyrogramMessage
 
+from src.config import LoggingConfig
+from src.message_snapshot import MessageSnapshot, get_snapshot
+from src.pyrogram_utils import get_fullname
+from src.structured_logging import FIELDS_ATTRIBUTE
+
+
+def truncate(text: str, max_length: int) -> str:
+    return text if len(text) <= max_length else f'{text[:max_length]}…'
+
+
+def get_message_fields(message: MessageSnapshot, max_text_length: int = 200) -> dict:
+    fields = {
+        'message_id': message.id,
+        'chat_id': message.chat.id,
+        'chat_type': message.chat.type.value if message.chat.type is not None else None,
+        'chat_title': message.chat.title if message.chat.title is not None else get_fullname(message.chat),
+    }
+    if message.from_user is not None:
+        fields['user_id'] = message.from_user.id
+        fields['username'] = message.from_user.username
+    if message.media is not None:
+        fields['media'] = message.media.value
+    if message.service is not None:
+        fields['service'] = message.service.value
+    if message.text is not None:
+        fields['text'] = truncate(message.text, max_text_length)
+    if message.caption is not None:
+        fields['caption'] = truncate(message.caption, max_text_length)
+    return fields
+
+
+class ChatLogSampler:
+    """
+    Chats with more than threshold messages in a window are noisy: only every sample_every-th
+    of their further messages is logged until the window ends.
+    Counts are reset every window, so memory is bounded by the chats active in one window
+    """
+
+    def __init__(self,
+                 threshold: int,
+                 window: float,
+                 sample_every: int,
+                 clock: Callable[[], float] = time.monotonic,
+                 ):
+        self.threshold = threshold
+        self.window = window
+        self.sample_every = sample_every
+        self.clock = clock
+
+        self._window_started = clock()
+        self._counts: Dict[int, int] = {}
+        self._skipped: Dict[int, int] = {}
+
+    def sample(self, chat_id: int) -> Optional[int]:
+        """
+        :return: None if the message should not be logged,
+        otherwise the number of messages of the chat skipped since the last logged one
+        """
+
+        now = self.clock()
+        if now - self._window_started >= self.window:
+            self._window_started = now
+            self._counts.clear()
+            self._skipped.clear()
+
+        count = self._counts.get(chat_id, 0) + 1
+        self._counts[chat_id] = count
+        if count <= self.threshold or (count - self.threshold) % self.sample_every == 0:
+            return self._skipped.pop(chat_id, 0)
+        self._skipped[chat_id] = self._skipped.get(chat_id, 0) + 1
+        return None
+
+
+def register_logging_handler(client: Client, group: int = -458156, config: Optional[LoggingConfig] = None):
+    """
+    Nothing is read from the message unless INFO is enabled
+    """
 
-def register_logging_handler(client: Client, group: int = -458156):
     log = logging.getLogger(f'{__name__}.logging_handler')
+    config = config if config is not None else LoggingConfig()
+    sampler = ChatLogSampler(config.noisy_chat_threshold, config.noisy_chat_window, config.noisy_chat_sample_every)
 
     async def __logging_handler(_: Client, pyrogram_message: PyrogramMessage):
-        result = f'Incoming message: {pyrogram_message.id}\n'
-        # Chat info
-        if pyrogram_message.chat.title is not None:
-            result += f'From chat: {pyrogram_message.chat.title} ({pyrogram_message.chat.id})\n'
-        else:
-            fullname = pyrogram_message.chat.first_name + pyrogram_message.chat.last_name if pyrogram_message.chat.last_name else ''
-            result += f'From chat: @{pyrogram_message.chat.username} "{fullname}" ({pyrogram_message.chat.id})\n'
-
-        # User info
-        result += f'From user: @{pyrogram_message.from_user.username} "{pyrogram_message.from_user.first_name} {pyrogram_message.from_user.last_name}" ({pyrogram_message.from_user.id})\n'
-
-        # Media
-        if pyrogram_message.media is not None:
-            result += f'Media: {pyrogram_message.media.name}\n'
-
-        # Service
-        if pyrogram_message.service is not None:
-            result += f'Service: {pyrogram_message.service.name}\n'
-
-        # Text
-        if pyrogram_message.text is not None:
-            result += f'Text: {pyrogram_message.text}\n'
-
-        # Caption
-        if pyrogram_message.caption is not None:
-            result += f'Caption: {pyrogram_message.caption}\n'
-
-        log.info(result.strip())
+        if not log.isEnabledFor(logging.INFO):
+            return
+        message = get_snapshot(pyrogram_message)
+        skipped = sampler.sample(message.chat.id)
+        if skipped is None:
+            return
+        fields = get_message_fields(message, config.max_text_length)
+        if skipped:
+            fields['skipped'] = skipped
+        log.info('Incoming message', extra={FIELDS_ATTRIBUTE: fields})
 
     client.add_handler(pyrogram.handlers.MessageHandler(__logging_handler, filters=None), group=group)
@@ -0,0 +1,61 @@
+from typing import Dict, Tuple
+
+from prometheus_client import CollectorRegistry, Histogram, REGISTRY
+
+from src.config import LatencyConfig
+
+# Media type, chat type
+LatencyLabels = Tuple[str, str]
+
+STAGES: Tuple[str, ...] = ('filter', 'conversion', 'download', 'upload', 'kafka_enqueue', 'kafka_ack')
+
+
+def get_latency_labels(message) -> LatencyLabels:
+    """
+    :param message: Pyrogram message or its snapshot
+    """
+
+    return (
+        message.media.value if message.media is not None else 'none',
+        message.chat.type.value if message.chat is not None and message.chat.type is not None else 'unknown',
+    )
+
+
+class IngestLatency:
+    """
+    Where an update spends its time on the way from Telegram to a Kafka ack, by media type and chat type.
+    Buckets come from the config, so unlike the metrics in prometheus_metrics these histograms
+    are created at startup, once per registry
+    """
+
+    def __init__(self, config: LatencyConfig, registry: CollectorRegistry = REGISTRY):
+        self.stages = Histogram(
+            'frontend_ingest_stage_seconds',
+            'Time an update spent in an ingest stage',
+            ['stage', 'media_type', 'chat_type'],
+            buckets=config.stage_buckets,
+            registry=registry,
+        )
+        self.end_to_end = Histogram(
+            'frontend_ingest_end_to_end_seconds',
+            'Time from the Telegram message date to the Kafka ack of its event, Telegram dates are whole seconds',
+            ['media_type', 'chat_type'],
+            buckets=config.end_to_end_buckets,
+            registry=registry,
+        )
+        # Label children by (stage, media type, chat type) and by (media type, chat type)
+        self._stage_children: Dict[Tuple[str, str, str], Histogram] = {}
+        self._end_to_end_children: Dict[LatencyLabels, Histogram] = {}
+
+    def observe(self, stage: str, labels: LatencyLabels, seconds: float) -> None:
+        key = (stage, *labels)
+        child = self._stage_children.get(key)
+        if child is None:
+            child = self._stage_children[key] = self.stages.labels(*key)
+        child.observe(seconds)
+
+    def observe_end_to_end(self, labels: LatencyLabels, seconds: float) -> None:
+        child = self._end_to_end_children.get(labels)
+        if child is None:
+            child = self._end_to_end_children[labels] = self.end_to_end.labels(*labels)
+        child.observe(seconds)
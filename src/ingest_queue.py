@@ -0,0 +1,176 @@
+import asyncio
+import logging
+import time
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, List, Optional, Set
+
+from pyrogram.types import Message as PyrogramMessage
+
+from src.config import OverflowPolicy
+from src.message_snapshot import MessageSnapshot, get_snapshot
+from src.prometheus_metrics import prometheus_frontend_ingest_queue_depth, \
+    prometheus_frontend_ingest_queue_wait_seconds, prometheus_frontend_ingest_dropped, \
+    prometheus_frontend_ingest_lane_processing_seconds
+
+GOLDEN_RATIO_64 = 0x9E3779B97F4A7C15
+MASK_64 = 0xFFFFFFFFFFFFFFFF
+
+
+def get_lane_index(chat_id: int, lanes: int) -> int:
+    # Fibonacci hashing: sequential chat ids still spread evenly between lanes
+    return (((chat_id * GOLDEN_RATIO_64) & MASK_64) >> 32) % lanes
+
+
+@dataclass(slots=True)
+class IngestJob:
+    """
+    A queued message without its Pyrogram object graph: the snapshot, plus the media object
+    (message.photo, message.voice...) while the media still has to be uploaded
+    """
+
+    snapshot: MessageSnapshot
+    media: Optional[Any]
+    enqueued_at: float
+    skip_media: bool = False
+
+
+class IngestLane:
+    def __init__(self, index: int, max_size: int, max_in_flight: int):
+        self.index = index
+        self.label = str(index)
+        self.queue: asyncio.Queue[IngestJob] = asyncio.Queue(maxsize=max_size)
+        self.in_flight = asyncio.Semaphore(max_in_flight)
+        self.depth = prometheus_frontend_ingest_queue_depth.labels(self.label)
+        self.wait_seconds = prometheus_frontend_ingest_queue_wait_seconds.labels(self.label)
+        self.processing_seconds = prometheus_frontend_ingest_lane_processing_seconds.labels(self.label)
+
+
+class IngestQueue:
+    """
+    Bounded queue between Pyrogram handlers and the downstream I/O (S3, Kafka).
+    Handlers enqueue jobs and return. Every chat is pinned to one lane by its id, and every lane is
+    drained by a single worker task: messages of one chat are processed strictly in order,
+    while different lanes are processed concurrently.
+    Work that doesn't have to finish before the next job, like waiting for a Kafka acknowledgement,
+    can be detached from the lane, up to max_in_flight detached tasks per lane.
+    """
+
+    def __init__(self,
+                 processor: Callable[[IngestJob], Awaitable[None]],
+                 max_size: int,
+                 lanes: int,
+                 overflow_policy: OverflowPolicy = OverflowPolicy.BLOCK,
+                 max_in_flight: int = 1,
+                 ):
+        """
+        :param max_size: capacity of every lane. With the drop-media policy, jobs past it are enqueued without
+        their media, up to twice the capacity
+        """
+
+        self.log = logging.getLogger(f'{__name__}.{self.__class__.__name__}')
+        self.processor = processor
+        self.max_size = max_size
+        self.overflow_policy = overflow_policy
+
+        lane_size = max_size * 2 if overflow_policy == OverflowPolicy.DROP_MEDIA else max_size
+        self._lanes: List[IngestLane] = [
+            IngestLane(index, lane_size, max_in_flight) for index in range(lanes)
+        ]
+        self._worker_tasks: List[asyncio.Task] = []
+        self._detached: Set[asyncio.Task] = set()
+
+    def qsize(self) -> int:
+        return sum(lane.queue.qsize() for lane in self._lanes)
+
+    def get_lane(self, chat_id: int) -> IngestLane:
+        return self._lanes[get_lane_index(chat_id, len(self._lanes))]
+
+    async def put(self, message: PyrogramMessage) -> bool:
+        """
+        Enqueue a message according to the overflow policy. Only the block policy ever waits for room
+        :return: False if the message was dropped
+        """
+
+        snapshot = get_snapshot(message)
+        lane = self.get_lane(snapshot.chat.id)
+        media = getattr(message, snapshot.media.value, None) if snapshot.media is not None else None
+        job = IngestJob(snapshot=snapshot, media=media, enqueued_at=time.monotonic())
+        if self.overflow_policy == OverflowPolicy.BLOCK:
+            await lane.queue.put(job)
+        else:
+            if self.overflow_policy == OverflowPolicy.DROP_MEDIA and snapshot.media is not None \
+                    and lane.queue.qsize() >= self.max_size:
+                prometheus_frontend_ingest_dropped.labels('media').inc()
+                job.media, job.skip_media = None, True
+            try:
+                lane.queue.put_nowait(job)
+            except asyncio.QueueFull:
+                prometheus_frontend_ingest_dropped.labels('message').inc()
+                self.log.warning('Ingest lane %d is full, dropping message %s from chat %s',
+                                 lane.index, snapshot.id, snapshot.chat.id)
+                return False
+        lane.depth.set(lane.queue.qsize())
+        return True
+
+    async def detach(self, chat_id: int, coroutine: Awaitable) -> asyncio.Task:
+        """
+        Runs the coroutine in a task the lane of the chat doesn't wait for.
+        Waits while the lane already has max_in_flight detached tasks
+        """
+
+        lane = self.get_lane(chat_id)
+        try:
+            await lane.in_flight.acquire()
+        except BaseException:
+            coroutine.close()
+            raise
+        task = asyncio.create_task(coroutine)
+        self._detached.add(task)
+
+        def on_done(_: asyncio.Task) -> None:
+            self._detached.discard(task)
+            lane.in_flight.release()
+            if not task.cancelled() and task.exception() is not None:
+                self.log.error('Detached task of chat %s failed', chat_id, exc_info=task.exception())
+
+        task.add_done_callback(on_done)
+        return task
+
+    def start(self) -> None:
+        if self._worker_tasks:
+            raise RuntimeError('Ingest queue workers are already running')
+        self._worker_tasks = [
+            asyncio.create_task(self._worker(lane), name=f'ingest-lane-{lane.index}') for lane in self._lanes
+        ]
+
+    async def stop(self, timeout: float = 10.0) -> None:
+        try:
+            await asyncio.wait_for(
+                asyncio.gather(*(lane.queue.join() for lane in self._lanes)),
+                timeout=timeout,
+            )
+        except asyncio.TimeoutError:
+            self.log.error('%d messages were not processed before shutdown', self.qsize())
+        for task in self._worker_tasks:
+            task.cancel()
+        await asyncio.gather(*self._worker_tasks, return_exceptions=True)
+        self._worker_tasks = []
+        if self._detached:
+            _, pending = await asyncio.wait(self._detached, timeout=timeout)
+            if pending:
+                self.log.error('%d detached tasks did not finish before shutdown', len(pending))
+
+    async def _worker(self, lane: IngestLane) -> None:
+        while True:
+            job = await lane.queue.get()
+            lane.depth.set(lane.queue.qsize())
+            started_at = time.monotonic()
+            lane.wait_seconds.observe(started_at - job.enqueued_at)
+            try:
+                await self.processor(job)
+            except Exception as e:
+                self.log.error('Failed to process message %s from chat %s', job.snapshot.id, job.snapshot.chat.id)
+                self.log.error(e, exc_info=True)
+            finally:
+                lane.processing_seconds.observe(time.monotonic() - started_at)
+                lane.queue.task_done()
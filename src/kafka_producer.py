@@ -0,0 +1,140 @@
+import asyncio
+import logging
+import threading
+import time
+from asyncio import AbstractEventLoop, Future
+from typing import Callable, Optional, Union
+
+from confluent_kafka import Producer, KafkaError, KafkaException, Message as KafkaMessage
+
+from src.config import KafkaConfig
+from src.prometheus_metrics import prometheus_frontend_kafka_delivery_errors, prometheus_frontend_kafka_delivery_seconds
+
+Headers = Union[dict[str, bytes], list[tuple[str, bytes]]]
+
+
+def build_producer_config(kafka_config: KafkaConfig) -> dict:
+    return {
+        'bootstrap.servers': kafka_config.bootstrap_servers,
+        'linger.ms': kafka_config.linger_ms,
+        'batch.size': kafka_config.batch_size,
+        'queue.buffering.max.messages': kafka_config.queue_buffering_max_messages,
+        'compression.type': kafka_config.compression_type,
+        'message.timeout.ms': kafka_config.delivery_timeout_ms,
+        'statistics.interval.ms': kafka_config.statistics_interval_ms,
+        # Several messages of a chat are in flight at once, retries must not reorder them
+        'enable.idempotence': True,
+    }
+
+
+class AsyncKafkaProducer:
+    """
+    Owns a confluent_kafka Producer and serves its delivery reports from a single poll thread.
+    Every `send` returns only after the broker acknowledged (or permanently rejected) the message.
+    """
+
+    def __init__(self,
+                 config: dict,
+                 enqueue_timeout: float = 5.0,
+                 poll_timeout: float = 0.1,
+                 producer_factory: Callable[[dict], Producer] = Producer,
+                 stats_cb: Optional[Callable[[str], None]] = None,
+                 ):
+        """
+        :param stats_cb: receives librdkafka statistics JSON on the poll thread
+        """
+
+        self.log = logging.getLogger(f'{__name__}.{self.__class__.__name__}')
+        self.enqueue_timeout = enqueue_timeout
+        self.poll_timeout = poll_timeout
+        # False while librdkafka reports that no broker can be reached, until the next successful delivery
+        self.available = True
+        config = {**config, 'error_cb': self._on_error}
+        if stats_cb is not None:
+            config['stats_cb'] = stats_cb
+        self.producer = producer_factory(config)
+
+        self._loop: Optional[AbstractEventLoop] = None
+        self._poll_thread: Optional[threading.Thread] = None
+        self._running = threading.Event()
+
+    def start(self, loop: AbstractEventLoop) -> None:
+        if self._poll_thread is not None:
+            raise RuntimeError('Producer poll loop is already running')
+        self._loop = loop
+        self._running.set()
+        self._poll_thread = threading.Thread(target=self._poll_loop, name='kafka-producer-poll', daemon=True)
+        self._poll_thread.start()
+
+    async def stop(self, flush_timeout: float = 10.0) -> None:
+        """
+        Joins the poll thread and flushes the producer in the default executor: both block,
+        and delivery reports served by the flush must still reach the loop
+        """
+
+        if self._poll_thread is None:
+            return
+        loop = asyncio.get_running_loop()
+        self._running.clear()
+        await loop.run_in_executor(None, self._poll_thread.join)
+        self._poll_thread = None
+        remaining = await loop.run_in_executor(None, self.producer.flush, flush_timeout)
+        if remaining > 0:
+            self.log.error('%d messages were not delivered before shutdown', remaining)
+
+    def _on_error(self, err: KafkaError) -> None:
+        if err.code() == KafkaError._ALL_BROKERS_DOWN:
+            self.available = False
+        self.log.error('Kafka producer error: %s', err)
+
+    def _poll_loop(self) -> None:
+        while self._running.is_set():
+            self.producer.poll(self.poll_timeout)
+
+    async def send(self, topic: str, key: Optional[str], value: bytes,
+                   headers: Optional[Headers] = None,
+                   on_enqueued: Optional[Callable[[], None]] = None,
+                   ) -> KafkaMessage:
+        """
+        :param on_enqueued: called once the message is in the local producer queue, before it is acknowledged
+        """
+
+        if self._loop is None:
+            raise RuntimeError('Producer poll loop is not started')
+        future: Future = self._loop.create_future()
+
+        def on_delivery(err, msg: KafkaMessage) -> None:
+            if err is None:
+                self.available = True
+                latency = msg.latency()
+                if latency is not None:
+                    prometheus_frontend_kafka_delivery_seconds.labels(
+                        msg.topic(), str(msg.partition())
+                    ).observe(latency)
+            else:
+                prometheus_frontend_kafka_delivery_errors.labels(err.name()).inc()
+            self._loop.call_soon_threadsafe(_resolve_delivery, future, err, msg)
+
+        deadline = time.monotonic() + self.enqueue_timeout
+        while True:
+            try:
+                self.producer.produce(topic=topic, key=key, value=value, headers=headers, on_delivery=on_delivery)
+                break
+            except BufferError:
+                # Local queue is full: wait for the poll thread to serve delivery reports
+                if time.monotonic() >= deadline:
+                    raise
+                await asyncio.sleep(self.poll_timeout)
+        if on_enqueued is not None:
+            on_enqueued()
+
+        return await future
+
+
+def _resolve_delivery(future: Future, err, msg: KafkaMessage) -> None:
+    if future.done():
+        return
+    if err is not None:
+        future.set_exception(KafkaException(err))
+    else:
+        future.set_result(msg)
@@ -0,0 +1,118 @@
+import json
+import logging
+import threading
+from typing import Iterable, Optional
+
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily, Metric
+from prometheus_client.registry import Collector
+
+# librdkafka rolling window fields exported as quantile gauges.
+# Batch size windows are only reported per topic, delivery latency per partition is observed by AsyncKafkaProducer
+WINDOW_QUANTILES = (('avg', 'avg'), ('0.5', 'p50'), ('0.95', 'p95'), ('0.99', 'p99'))
+
+
+def _add_window(family: GaugeMetricFamily, labels: list[str], window: Optional[dict], scale: float = 1.0) -> None:
+    if not window or window.get('cnt', 0) == 0:
+        return
+    for quantile, key in WINDOW_QUANTILES:
+        family.add_metric(labels + [quantile], window[key] * scale)
+
+
+class KafkaStatisticsCollector(Collector):
+    """
+    Bridges librdkafka statistics (statistics.interval.ms, stats_cb) into Prometheus.
+    `update` is called from the producer poll thread, so parsing never happens on the event loop;
+    scrapes only read the latest parsed snapshot.
+    """
+
+    def __init__(self):
+        self.log = logging.getLogger(f'{__name__}.{self.__class__.__name__}')
+        self._lock = threading.Lock()
+        self._stats: Optional[dict] = None
+
+    def update(self, stats_json: str) -> None:
+        try:
+            stats = json.loads(stats_json)
+        except ValueError as e:
+            self.log.error('Unable to parse librdkafka statistics: %s', e)
+            return
+        with self._lock:
+            self._stats = stats
+
+    def collect(self) -> Iterable[Metric]:
+        with self._lock:
+            stats = self._stats
+        if stats is None:
+            return []
+
+        queue_messages = GaugeMetricFamily(
+            'frontend_kafka_producer_queue_messages', 'Messages waiting in the librdkafka producer queue')
+        queue_messages.add_metric([], stats.get('msg_cnt', 0))
+        queue_bytes = GaugeMetricFamily(
+            'frontend_kafka_producer_queue_bytes', 'Size of messages waiting in the librdkafka producer queue')
+        queue_bytes.add_metric([], stats.get('msg_size', 0))
+        tx_bytes = CounterMetricFamily(
+            'frontend_kafka_producer_tx_bytes', 'Total bytes transmitted to Kafka brokers')
+        tx_bytes.add_metric([], stats.get('tx_bytes', 0))
+        rx_bytes = CounterMetricFamily(
+            'frontend_kafka_producer_rx_bytes', 'Total bytes received from Kafka brokers')
+        rx_bytes.add_metric([], stats.get('rx_bytes', 0))
+        tx_messages = CounterMetricFamily(
+            'frontend_kafka_producer_tx_messages', 'Total messages transmitted to Kafka brokers')
+        tx_messages.add_metric([], stats.get('txmsgs', 0))
+
+        broker_rtt = GaugeMetricFamily(
+            'frontend_kafka_broker_rtt_seconds', 'Broker round-trip time over the last statistics window',
+            labels=['broker', 'quantile'])
+        broker_retries = CounterMetricFamily(
+            'frontend_kafka_broker_tx_retries', 'Total request retries sent to a broker', labels=['broker'])
+        broker_errors = CounterMetricFamily(
+            'frontend_kafka_broker_tx_errors', 'Total transmission errors for a broker', labels=['broker'])
+        broker_timeouts = CounterMetricFamily(
+            'frontend_kafka_broker_request_timeouts', 'Total request timeouts for a broker', labels=['broker'])
+        for broker in stats.get('brokers', {}).values():
+            if broker.get('nodeid', -1) < 0:
+                # Bootstrap placeholder entries are not real brokers
+                continue
+            name = broker['name']
+            _add_window(broker_rtt, [name], broker.get('rtt'), scale=1e-6)
+            broker_retries.add_metric([name], broker.get('txretries', 0))
+            broker_errors.add_metric([name], broker.get('txerrs', 0))
+            broker_timeouts.add_metric([name], broker.get('req_timeouts', 0))
+
+        batch_bytes = GaugeMetricFamily(
+            'frontend_kafka_topic_batch_bytes', 'Size of produced batches over the last statistics window',
+            labels=['topic', 'quantile'])
+        batch_messages = GaugeMetricFamily(
+            'frontend_kafka_topic_batch_messages', 'Messages per produced batch over the last statistics window',
+            labels=['topic', 'quantile'])
+        partition_queue_messages = GaugeMetricFamily(
+            'frontend_kafka_partition_queue_messages', 'Messages waiting to be sent to a partition',
+            labels=['topic', 'partition'])
+        partition_tx_messages = CounterMetricFamily(
+            'frontend_kafka_partition_tx_messages', 'Total messages transmitted to a partition',
+            labels=['topic', 'partition'])
+        partition_tx_bytes = CounterMetricFamily(
+            'frontend_kafka_partition_tx_bytes', 'Total bytes transmitted to a partition',
+            labels=['topic', 'partition'])
+        partition_in_flight = GaugeMetricFamily(
+            'frontend_kafka_partition_in_flight_messages', 'Messages sent to a partition and not yet acknowledged',
+            labels=['topic', 'partition'])
+        for topic_name, topic in stats.get('topics', {}).items():
+            _add_window(batch_bytes, [topic_name], topic.get('batchsize'))
+            _add_window(batch_messages, [topic_name], topic.get('batchcnt'))
+            for partition_id, partition in topic.get('partitions', {}).items():
+                if partition_id == '-1':
+                    # Internal UA (unassigned) partition
+                    continue
+                partition_queue_messages.add_metric([topic_name, partition_id], partition.get('msgq_cnt', 0))
+                partition_tx_messages.add_metric([topic_name, partition_id], partition.get('txmsgs', 0))
+                partition_tx_bytes.add_metric([topic_name, partition_id], partition.get('txbytes', 0))
+                partition_in_flight.add_metric([topic_name, partition_id], partition.get('msgs_inflight', 0))
+
+        return [
+            queue_messages, queue_bytes, tx_bytes, rx_bytes, tx_messages,
+            broker_rtt, broker_retries, broker_errors, broker_timeouts,
+            batch_bytes, batch_messages, partition_queue_messages, partition_tx_messages, partition_tx_bytes,
+            partition_in_flight,
+        ]
@@ -1,28 +1,42 @@
-# TODO: Fix logging. Can't set DEBUG level
 import asyncio
-import logging.config
+import logging
 import os
+import signal
 import sys
+from typing import Optional
 
-from confluent_kafka import Producer
 from miniopy_async import Minio
 
 from controller import Controller
 from fastapi import FastAPI
-from prometheus_client import make_asgi_app
+from prometheus_client import make_asgi_app, REGISTRY
 from pydantic import BaseModel, Field
 from pyrogram import Client
 import pydantic
 import yaml
 
-from src.config import get_configurations
+from src.cardinality import CardinalitySnapshots
+from src.config import get_configurations, get_filter_config, get_logging_config
+from src.handlers.filter_handler import FilterEngine, register_filter_handler
 from src.handlers.kafka_handler import register_kafka_handler
 from src.handlers.logging_handler import register_logging_handler
 from src.handlers.prometheus_handler import register_prometheus_handler
+from src.ingest_latency import IngestLatency
+from src.ingest_queue import IngestQueue
+from src.kafka_producer import AsyncKafkaProducer, build_producer_config
+from src.kafka_statistics import KafkaStatisticsCollector
+from src.media import MediaUploader, MediaCache, MediaIngestor
+from src.media_processing import MediaProcessor
+from src.perceptual_hash import HashIndex, PerceptualHasher
+from src.send_scheduler import PacedClient, SendScheduler
+from src.outbox import KafkaOutbox
+from src.serializers import get_serializer
+from src.structured_logging import configure_logging
 
 
 class ProgramArguments(BaseModel):
-    log_level: str = Field('INFO', min_length=1)
+    # logging.level from config.yaml if not set
+    log_level: Optional[str] = Field(None, min_length=1)
     bot_token: str = Field(min_length=1)
     api_hash: str = Field(min_length=1)
     api_id: str = Field(min_length=1)
@@ -33,7 +47,7 @@ class ProgramArguments(BaseModel):
 def parse_arguments() -> ProgramArguments:
     try:
         return ProgramArguments(
-            log_level=os.environ.get('SERVER_LOG_LEVEL', 'INFO'),
+            log_level=os.environ.get('SERVER_LOG_LEVEL'),
             bot_token=os.environ.get('BOT_TOKEN'),
             api_hash=os.environ.get('API_HASH'),
             api_id=os.environ.get('API_ID'),
@@ -51,24 +65,20 @@ with open('config.yaml') as fp:
     conf = yaml.load(fp, Loader=yaml.FullLoader)
 
 s3_config, kafka_config, frontend_config = get_configurations(conf)
-# Configure logging
-# with open('logging.yaml') as fp:
-#     conf = yaml.load(fp, Loader=yaml.FullLoader)
-#
-# conf['root']['level'] = arguments.log_level
+logging_config = get_logging_config(conf)
 
-logging.basicConfig()
-main_logger = logging.getLogger('__main__')
-logging.debug('lol')
-main_logger.debug('lol')
-# logging.config.dictConfig(conf)
-
-logging.debug('lol')
-main_logger.debug('lol')
+with open('logging.yaml') as fp:
+    log_listener = configure_logging(
+        config=yaml.load(fp, Loader=yaml.FullLoader),
+        level=arguments.log_level or logging_config.level,
+        queue_size=logging_config.queue_size,
+    )
+log_listener.start()
 
 log = logging.getLogger(f'{__name__}.main')
 
-pyrogram_app: Client = Client(
+# FloodWaits of sends run by the send scheduler are left to it, other calls keep the default sleep threshold
+pyrogram_app: Client = PacedClient(
     name='OmegaMomiji',
     bot_token=arguments.bot_token,
     api_hash=arguments.api_hash,
@@ -82,6 +92,64 @@ pyrogram_app: Client = Client(
 # )
 
 
+kafka_statistics = KafkaStatisticsCollector()
+REGISTRY.register(kafka_statistics)
+
+kafka_producer = AsyncKafkaProducer(
+    config=build_producer_config(kafka_config),
+    enqueue_timeout=kafka_config.enqueue_timeout,
+    stats_cb=kafka_statistics.update if kafka_config.statistics_interval_ms > 0 else None,
+)
+
+outbox: Optional[KafkaOutbox] = None
+if kafka_config.outbox.enabled:
+    outbox = KafkaOutbox(
+        producer=kafka_producer,
+        directory=kafka_config.outbox.directory,
+        segment_size=kafka_config.outbox.segment_size,
+        fsync_interval=kafka_config.outbox.fsync_interval,
+        replay_batch_size=kafka_config.outbox.replay_batch_size,
+        retry_interval=kafka_config.outbox.retry_interval,
+        send_timeout=kafka_config.outbox.send_timeout,
+    )
+
+filter_engine = FilterEngine(frontend_config.filter)
+ingest_latency = IngestLatency(frontend_config.metrics.latency)
+send_scheduler = SendScheduler(frontend_config.send)
+
+
+def reload_filter_rules():
+    try:
+        with open('config.yaml') as config_fp:
+            filter_config = get_filter_config(yaml.load(config_fp, Loader=yaml.FullLoader))
+    except Exception as e:
+        log.error('Unable to reload filter rules, keeping the current ones: %s', e)
+        return
+    filter_engine.reload(filter_config)
+
+
+media_processor: Optional[MediaProcessor] = None
+if frontend_config.upload_files and frontend_config.media.processing.enabled:
+    media_processor = MediaProcessor(
+        workers=frontend_config.media.processing.workers,
+        image_format=frontend_config.media.processing.format,
+        quality=frontend_config.media.processing.quality,
+        max_dimension=frontend_config.media.processing.max_dimension,
+        max_file_size=frontend_config.media.processing.max_file_size,
+        types=frontend_config.media.processing.types,
+    )
+
+perceptual_hasher: Optional[PerceptualHasher] = None
+if frontend_config.upload_files and frontend_config.media.perceptual_hash.enabled:
+    perceptual_hasher = PerceptualHasher(
+        workers=frontend_config.media.perceptual_hash.workers,
+        max_file_size=frontend_config.media.perceptual_hash.max_file_size,
+        types=frontend_config.media.perceptual_hash.types,
+    )
+
+ingest_queue: Optional[IngestQueue] = None
+cardinality_snapshots: Optional[CardinalitySnapshots] = None
+
 fastapi_app = FastAPI()
 
 metrics_app = make_asgi_app()
@@ -107,38 +175,90 @@ async def readiness_probe():
 async def startup_event():
     log.info('Application startup')
     await pyrogram_app.start()
-    loop = asyncio.get_event_loop()
-
-    config = {
-        'bootstrap.servers': kafka_config.bootstrap_servers,
-    }
-    register_logging_handler(client=pyrogram_app, group=-458155)
-    register_prometheus_handler(client=pyrogram_app, group=-458156)
+    send_scheduler.start()
+    kafka_producer.start(asyncio.get_event_loop())
+    if outbox is not None:
+        await outbox.start()
+    if media_processor is not None:
+        media_processor.start()
+    if perceptual_hasher is not None:
+        perceptual_hasher.start()
+
+    register_filter_handler(client=pyrogram_app, engine=filter_engine, group=-458158, latency=ingest_latency)
+    asyncio.get_running_loop().add_signal_handler(signal.SIGHUP, reload_filter_rules)
+    register_logging_handler(client=pyrogram_app, group=-458155, config=logging_config)
+    global cardinality_snapshots
+    cardinality_snapshots = register_prometheus_handler(
+        client=pyrogram_app,
+        group=-458156,
+        cardinality=frontend_config.metrics.cardinality,
+    )
+    if cardinality_snapshots is not None:
+        cardinality_snapshots.start()
 
     minio = Minio(s3_config.url,
                   secure=False,
                   access_key=arguments.s3_access_key,
                   secret_key=arguments.s3_secret_key,
                   )
-    register_kafka_handler(
+    global ingest_queue
+    ingest_queue = register_kafka_handler(
         client=pyrogram_app,
         group=-458157,
-        minio=minio,
-        kafka_producer=Producer(config),
-        event_loop=loop,
+        media_ingestor=MediaIngestor(
+            uploader=MediaUploader(
+                client=pyrogram_app,
+                minio=minio,
+                part_size=frontend_config.media.part_size,
+                parallel_uploads=frontend_config.media.parallel_uploads,
+            ),
+            cache=MediaCache(
+                minio=minio,
+                max_size=frontend_config.media.cache_size,
+                check_s3=frontend_config.media.cache_check_s3,
+            ),
+            types=frontend_config.media.types,
+            processor=media_processor,
+            hasher=perceptual_hasher,
+            hash_index=HashIndex(
+                max_distance=frontend_config.media.perceptual_hash.max_distance,
+                max_size=frontend_config.media.perceptual_hash.index_size,
+            ),
+        ),
+        kafka_producer=kafka_producer,
+        serializer=get_serializer(kafka_config.messages_format),
         frontend=frontend_config.name,
         topic=kafka_config.messages_topic,
-        max_file_size=frontend_config.max_file_size,
-        whitelist=set(frontend_config.whitelist),
+        upload_files=frontend_config.upload_files,
+        ingest_config=frontend_config.ingest,
+        outbox=outbox,
+        two_phase_publish=frontend_config.two_phase_publish,
+        latency=ingest_latency,
     )
+    ingest_queue.start()
 
 
 @fastapi_app.on_event("shutdown")
 async def shutdown_event():
     log.info('Application shutdown')
+    await send_scheduler.stop()
+    # Intake stops first, queued messages are drained while the client can still download their media
+    await pyrogram_app.dispatcher.stop()
+    if ingest_queue is not None:
+        await ingest_queue.stop()
     await pyrogram_app.stop()
-
-
-controller = Controller(pyrogram_client=pyrogram_app)
+    if cardinality_snapshots is not None:
+        await cardinality_snapshots.stop()
+    if perceptual_hasher is not None:
+        perceptual_hasher.stop()
+    if media_processor is not None:
+        media_processor.stop()
+    if outbox is not None:
+        await outbox.stop()
+    await kafka_producer.stop()
+    log_listener.stop()
+
+
+controller = Controller(pyrogram_client=pyrogram_app, scheduler=send_scheduler)
 
 fastapi_app.include_router(controller.router)
@@ -0,0 +1,448 @@
+import asyncio
+import io
+import logging
+import mimetypes
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from miniopy_async import Minio
+from miniopy_async.datatypes import Part
+from miniopy_async.error import S3Error
+from pyrogram import Client
+
+from src.config import MediaTypeConfig, VariantPolicy
+from src.media_processing import MediaProcessor
+from src.new_message import MediaType
+from src.perceptual_hash import HashIndex, PerceptualHasher
+from src.prometheus_metrics import prometheus_frontend_media_cache_lookups, prometheus_frontend_media_skipped, \
+    prometheus_frontend_media_thumbnails, prometheus_frontend_media_stage_seconds, \
+    prometheus_frontend_media_near_duplicates, prometheus_frontend_media_processing_failures
+
+# Used when Telegram does not report a mime type, photos never have one
+DEFAULT_CONTENT_TYPES: Dict[MediaType, str] = {
+    MediaType.STICKER: 'image/webp',
+    MediaType.AUDIO: 'audio/mpeg',
+    MediaType.VOICE: 'audio/ogg',
+    MediaType.PHOTO: 'image/jpeg',
+    MediaType.VIDEO: 'video/mp4',
+    MediaType.ANIMATION: 'video/mp4',
+    MediaType.VIDEO_NOTE: 'video/mp4',
+}
+
+
+# Telegram thumbnails are JPEG, except for stickers
+THUMBNAIL_CONTENT_TYPE = 'image/jpeg'
+STICKER_THUMBNAIL_CONTENT_TYPE = 'image/webp'
+
+
+def get_object_name(key: str, content_type: str) -> str:
+    return f'{key}{mimetypes.guess_extension(content_type) or ""}'
+
+
+@dataclass(slots=True)
+class MediaVariant:
+    file: Any
+    # Telegram gives every size of a file the same file_unique_id, so thumbnails are told apart by dimensions
+    key: str
+    file_size: int
+    content_type: str
+    is_thumbnail: bool
+
+    @property
+    def object_name(self) -> str:
+        return get_object_name(self.key, self.content_type)
+
+
+@dataclass(slots=True)
+class IngestedMedia:
+    bucket_name: str
+    object_name: str
+    perceptual_hash: Optional[int] = None
+    # Set when the media is a near-duplicate of an already uploaded image, the object is that image
+    near_duplicate_distance: Optional[int] = None
+    # Time spent waiting for Telegram and for S3, None if the media was not transferred (cache hits)
+    download_seconds: Optional[float] = field(default=None, compare=False)
+    upload_seconds: Optional[float] = field(default=None, compare=False)
+
+
+def get_content_type(media, media_type: MediaType) -> str:
+    return getattr(media, 'mime_type', None) or DEFAULT_CONTENT_TYPES[media_type]
+
+
+def select_variant(media, media_type: MediaType, config: MediaTypeConfig) -> Optional[MediaVariant]:
+    """
+    Picks the original file if it fits the size cap, otherwise the largest thumbnail that does.
+    With the thumbnail policy only thumbnails are considered
+    """
+
+    if config.variant == VariantPolicy.ORIGINAL and media.file_size and media.file_size < config.max_file_size:
+        return MediaVariant(
+            file=media,
+            key=media.file_unique_id,
+            file_size=media.file_size,
+            content_type=get_content_type(media, media_type),
+            is_thumbnail=False,
+        )
+
+    thumbnails = [
+        it for it in getattr(media, 'thumbs', None) or [] if it.file_size and it.file_size < config.max_file_size
+    ]
+    if not thumbnails:
+        return None
+    thumbnail = max(thumbnails, key=lambda it: it.file_size)
+    return MediaVariant(
+        file=thumbnail,
+        key=f'{thumbnail.file_unique_id}_{thumbnail.width}x{thumbnail.height}',
+        file_size=thumbnail.file_size,
+        content_type=STICKER_THUMBNAIL_CONTENT_TYPE if media_type == MediaType.STICKER else THUMBNAIL_CONTENT_TYPE,
+        is_thumbnail=True,
+    )
+
+
+# S3 rejects multipart parts smaller than this, except for the last one
+MIN_PART_SIZE = 5 * 1024 ** 2
+
+
+class TelegramMediaStream:
+    """
+    File-like adapter over Pyrogram `stream_media` chunks.
+    Holds at most one Telegram chunk besides what the reader asked for.
+    """
+
+    def __init__(self, chunks: AsyncIterator[bytes]):
+        self._chunks = chunks
+        self._buffer = bytearray()
+        self._exhausted = False
+        # Time spent waiting for Telegram chunks, the rest of a streamed upload is spent on S3
+        self.wait_seconds = 0.0
+
+    async def read(self, size: int = -1) -> bytes:
+        while not self._exhausted and (size < 0 or len(self._buffer) < size):
+            started_at = time.perf_counter()
+            try:
+                self._buffer += await anext(self._chunks)
+            except StopAsyncIteration:
+                self._exhausted = True
+            self.wait_seconds += time.perf_counter() - started_at
+        if size < 0 or size >= len(self._buffer):
+            result = bytes(self._buffer)
+            self._buffer.clear()
+        else:
+            result = bytes(self._buffer[:size])
+            del self._buffer[:size]
+        return result
+
+
+class MultipartUploads:
+    """
+    miniopy_async only does multipart uploads inside put_object, which wants a file-like object.
+    Its private multipart calls are made here and nowhere else, their signatures are those of
+    miniopy-async 1.23.5, the version pinned in requirements.txt
+    """
+
+    def __init__(self, minio: Minio):
+        self.minio = minio
+
+    async def create(self, bucket_name: str, object_name: str, content_type: str) -> str:
+        """
+        :return: upload id
+        """
+
+        return await self.minio._create_multipart_upload(bucket_name, object_name, {'Content-Type': content_type})
+
+    async def upload_part(self, bucket_name: str, object_name: str, upload_id: str, part_number: int,
+                          data: bytes) -> Part:
+        etag = await self.minio._upload_part(bucket_name, object_name, data, None, upload_id, part_number)
+        return Part(part_number, etag)
+
+    async def complete(self, bucket_name: str, object_name: str, upload_id: str, parts: List[Part]) -> None:
+        await self.minio._complete_multipart_upload(bucket_name, object_name, upload_id, parts)
+
+    async def abort(self, bucket_name: str, object_name: str, upload_id: str) -> None:
+        await self.minio._abort_multipart_upload(bucket_name, object_name, upload_id)
+
+
+class MediaUploader:
+    """
+    Streams Telegram media straight into S3 multipart uploads: parts are uploaded while the rest is
+    still being downloaded. The next part is only read once one of parallel_uploads upload slots is free,
+    so the download waits for S3 and memory stays bounded by part_size * (parallel_uploads + 1)
+    """
+
+    def __init__(self,
+                 client: Client,
+                 minio: Minio,
+                 part_size: int = MIN_PART_SIZE,
+                 parallel_uploads: int = 2,
+                 ):
+        self.log = logging.getLogger(f'{__name__}.{self.__class__.__name__}')
+        self.client = client
+        self.minio = minio
+        self.multipart = MultipartUploads(minio)
+        self.part_size = part_size
+        self.parallel_uploads = parallel_uploads
+
+    async def upload(self,
+                     media,
+                     bucket_name: str,
+                     object_name: str,
+                     length: int,
+                     content_type: Optional[str] = None,
+                     ) -> float:
+        """
+        :param media: Pyrogram media object (Photo, Video, ...) or a file id
+        :return: seconds spent waiting for Telegram
+        """
+
+        stream = TelegramMediaStream(self.client.stream_media(media))
+        await self._put_object(stream.read, bucket_name, object_name, length, content_type)
+        return stream.wait_seconds
+
+    async def download(self, media) -> bytes:
+        return b''.join([chunk async for chunk in self.client.stream_media(media)])
+
+    async def upload_bytes(self,
+                           data: bytes,
+                           bucket_name: str,
+                           object_name: str,
+                           content_type: Optional[str] = None,
+                           ) -> None:
+        # BytesIO shares the buffer of a bytes object until it is written to
+        buffer = io.BytesIO(data)
+
+        async def read(size: int) -> bytes:
+            return buffer.read(size)
+
+        await self._put_object(read, bucket_name, object_name, len(data), content_type)
+
+    async def _put_object(self,
+                          read: Callable[[int], Awaitable[bytes]],
+                          bucket_name: str,
+                          object_name: str,
+                          length: int,
+                          content_type: Optional[str],
+                          ) -> None:
+        content_type = content_type or 'application/octet-stream'
+        if length <= self.part_size:
+            data = await self._read_part(read, length, object_name)
+            await self.minio.put_object(bucket_name, object_name, io.BytesIO(data), length, content_type=content_type)
+            return
+
+        upload_id = await self.multipart.create(bucket_name, object_name, content_type)
+        slots = asyncio.Semaphore(self.parallel_uploads)
+        tasks: List[asyncio.Task] = []
+
+        async def upload_part(data: bytes, part_number: int) -> Part:
+            try:
+                return await self.multipart.upload_part(bucket_name, object_name, upload_id, part_number, data)
+            finally:
+                slots.release()
+
+        try:
+            for part_number, offset in enumerate(range(0, length, self.part_size), start=1):
+                await slots.acquire()
+                for task in tasks:
+                    if task.done():
+                        # Raises if the part failed
+                        task.result()
+                data = await self._read_part(read, min(self.part_size, length - offset), object_name)
+                tasks.append(asyncio.create_task(upload_part(data, part_number)))
+            parts = await asyncio.gather(*tasks)
+            await self.multipart.complete(bucket_name, object_name, upload_id, parts)
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            try:
+                await self.multipart.abort(bucket_name, object_name, upload_id)
+            except Exception as e:
+                self.log.warning('Unable to abort multipart upload of %s/%s: %s', bucket_name, object_name, e)
+            raise
+
+    @staticmethod
+    async def _read_part(read: Callable[[int], Awaitable[bytes]], size: int, object_name: str) -> bytes:
+        data = await read(size)
+        if len(data) != size:
+            raise IOError(f'Stream of {object_name} ended early: expected {size} bytes, got {len(data)}')
+        return data
+
+
+class MediaCache:
+    """
+    Deduplicates uploads by Telegram file_unique_id, which, unlike file_id, is the same for every copy of a file.
+    Known objects are kept in an in-memory LRU, misses are confirmed with an S3 stat_object call
+    """
+
+    def __init__(self, minio: Minio, max_size: int = 10_000, check_s3: bool = True):
+        self.log = logging.getLogger(f'{__name__}.{self.__class__.__name__}')
+        self.minio = minio
+        self.max_size = max_size
+        self.check_s3 = check_s3
+
+        self._objects: OrderedDict[str, Tuple[str, str]] = OrderedDict()
+        self._memory_hits = prometheus_frontend_media_cache_lookups.labels('memory')
+        self._s3_hits = prometheus_frontend_media_cache_lookups.labels('s3')
+        self._misses = prometheus_frontend_media_cache_lookups.labels('miss')
+
+    def remember(self, file_unique_id: str, bucket_name: str, object_name: str) -> None:
+        self._objects[file_unique_id] = (bucket_name, object_name)
+        self._objects.move_to_end(file_unique_id)
+        if len(self._objects) > self.max_size:
+            self._objects.popitem(last=False)
+
+    async def lookup(self, file_unique_id: str, bucket_name: str, object_name: str) -> Optional[Tuple[str, str]]:
+        """
+        :param bucket_name: bucket the file would be uploaded to
+        :param object_name: object name the file would be uploaded under
+        :return: bucket and object name of an already uploaded copy, if any
+        """
+
+        cached = self._objects.get(file_unique_id)
+        if cached is not None:
+            self._objects.move_to_end(file_unique_id)
+            self._memory_hits.inc()
+            return cached
+
+        if self.check_s3:
+            try:
+                await self.minio.stat_object(bucket_name, object_name)
+                self.remember(file_unique_id, bucket_name, object_name)
+                self._s3_hits.inc()
+                return bucket_name, object_name
+            except S3Error as e:
+                if e.code != 'NoSuchKey':
+                    self.log.warning('Unable to check if %s/%s exists: %s', bucket_name, object_name, e)
+
+        self._misses.inc()
+        return None
+
+
+class MediaIngestor:
+    """
+    Uploads media of every configured type to its own bucket. Every type has its own size cap and
+    concurrency limit, so heavy videos don't take upload slots from voice notes.
+    Media over the size cap is replaced with its largest thumbnail that fits.
+    With a processor, images it accepts are downloaded, processed and uploaded instead of being streamed.
+    With a hasher, images it accepts are looked up by perceptual hash, and near-duplicates of already
+    uploaded images are not uploaded again
+    """
+
+    def __init__(self,
+                 uploader: MediaUploader,
+                 cache: MediaCache,
+                 types: Dict[MediaType, MediaTypeConfig],
+                 processor: Optional[MediaProcessor] = None,
+                 hasher: Optional[PerceptualHasher] = None,
+                 hash_index: Optional[HashIndex[Tuple[str, str]]] = None,
+                 ):
+        self.log = logging.getLogger(f'{__name__}.{self.__class__.__name__}')
+        self.uploader = uploader
+        self.cache = cache
+        self.types = types
+        self.processor = processor
+        self.hasher = hasher
+        self.hash_index = hash_index if hash_index is not None else HashIndex()
+
+        self._semaphores = {media_type: asyncio.Semaphore(config.concurrency) for media_type, config in types.items()}
+        self._stream_seconds = prometheus_frontend_media_stage_seconds.labels('stream')
+        self._download_seconds = prometheus_frontend_media_stage_seconds.labels('download')
+        self._upload_seconds = prometheus_frontend_media_stage_seconds.labels('upload')
+        self._hash_seconds = prometheus_frontend_media_stage_seconds.labels('hash')
+
+    async def ingest(self, media, media_type: MediaType) -> Optional[IngestedMedia]:
+        """
+        :param media: the Pyrogram media object: message.photo, message.voice...
+        :return: the uploaded media, None if the media was skipped
+        """
+
+        config = self.types.get(media_type)
+        if config is None:
+            return None
+        variant = select_variant(media, media_type, config)
+        if variant is None:
+            prometheus_frontend_media_skipped.labels(media_type.value).inc()
+            return None
+        if variant.is_thumbnail:
+            prometheus_frontend_media_thumbnails.labels(media_type.value).inc()
+
+        hashed = self.hasher is not None \
+            and self.hasher.accepts(media_type, variant.content_type, variant.file_size)
+        processed = self.processor is not None \
+            and self.processor.accepts(media_type, variant.content_type, variant.file_size)
+        object_name = get_object_name(variant.key, self.processor.content_type) if processed else variant.object_name
+        uploaded = await self.cache.lookup(variant.key, config.bucket, object_name)
+        if uploaded is not None:
+            return IngestedMedia(*uploaded)
+
+        async with self._semaphores[media_type]:
+            if hashed or processed:
+                return await self._buffered_ingest(variant, config.bucket, object_name, hashed, processed)
+            started_at = time.perf_counter()
+            download_seconds = await self.uploader.upload(
+                media=variant.file,
+                bucket_name=config.bucket,
+                object_name=object_name,
+                length=variant.file_size,
+                content_type=variant.content_type,
+            )
+            stream_seconds = time.perf_counter() - started_at
+            self._stream_seconds.observe(stream_seconds)
+        self.cache.remember(variant.key, config.bucket, object_name)
+        return IngestedMedia(config.bucket, object_name, download_seconds=download_seconds,
+                             upload_seconds=stream_seconds - download_seconds)
+
+    async def _buffered_ingest(self,
+                               variant: MediaVariant,
+                               bucket_name: str,
+                               object_name: str,
+                               hashed: bool,
+                               processed: bool,
+                               ) -> IngestedMedia:
+        """
+        Hashing and processing need the whole file, so it is downloaded into memory instead of being streamed.
+        If processing fails, the original file is uploaded under its own name
+        :param object_name: name of the processed object if processed
+        """
+
+        started_at = time.perf_counter()
+        data = await self.uploader.download(variant.file)
+        download_seconds = time.perf_counter() - started_at
+        self._download_seconds.observe(download_seconds)
+
+        ingested = IngestedMedia(bucket_name, object_name, download_seconds=download_seconds)
+        if hashed:
+            started_at = time.perf_counter()
+            try:
+                ingested.perceptual_hash = await self.hasher.hash(data)
+            except Exception as e:
+                self.log.warning('Unable to compute perceptual hash of %s: %s', object_name, e)
+            self._hash_seconds.observe(time.perf_counter() - started_at)
+            if ingested.perceptual_hash is not None:
+                match = self.hash_index.find(ingested.perceptual_hash)
+                if match is not None:
+                    distance, (matched_bucket, matched_object) = match
+                    prometheus_frontend_media_near_duplicates.inc()
+                    self.cache.remember(variant.key, matched_bucket, matched_object)
+                    return IngestedMedia(matched_bucket, matched_object, ingested.perceptual_hash, distance,
+                                         download_seconds=download_seconds)
+
+        content_type = variant.content_type
+        if processed:
+            try:
+                data = await self.processor.process(data)
+                content_type = self.processor.content_type
+            except Exception as e:
+                prometheus_frontend_media_processing_failures.inc()
+                self.log.warning('Unable to process %s, uploading the original file: %s', object_name, e)
+                object_name = ingested.object_name = variant.object_name
+
+        started_at = time.perf_counter()
+        await self.uploader.upload_bytes(data, bucket_name, object_name, content_type)
+        ingested.upload_seconds = time.perf_counter() - started_at
+        self._upload_seconds.observe(ingested.upload_seconds)
+        self.cache.remember(variant.key, bucket_name, object_name)
+        if ingested.perceptual_hash is not None:
+            self.hash_index.add(ingested.perceptual_hash, (bucket_name, object_name))
+        return ingested
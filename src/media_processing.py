@@ -0,0 +1,102 @@
+import asyncio
+import io
+import logging
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterable, Optional, Tuple
+
+from src.config import ImageFormat
+from src.new_message import MediaType
+from src.prometheus_metrics import prometheus_frontend_media_processing_pending, prometheus_frontend_media_stage_seconds
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+# Formats Pillow is trusted to decode, anything else is uploaded as is
+PROCESSABLE_CONTENT_TYPES = frozenset({'image/jpeg', 'image/png', 'image/webp'})
+
+CONTENT_TYPES = {
+    ImageFormat.WEBP: 'image/webp',
+    ImageFormat.JPEG: 'image/jpeg',
+}
+
+
+def normalize_image(data: bytes,
+                    image_format: ImageFormat,
+                    quality: int,
+                    max_dimension: int,
+                    submitted_at: float,
+                    ) -> Tuple[bytes, float, float]:
+    """
+    Runs in a worker process.
+    :param submitted_at: time.monotonic() of submission, the clock is shared between processes
+    :return: encoded image, seconds spent waiting for a worker and seconds spent processing
+    """
+
+    started_at = time.monotonic()
+    image = Image.open(io.BytesIO(data))
+    # Lets the JPEG decoder scale by a power of two while decoding, no-op for other formats
+    image.draft('RGB', (max_dimension, max_dimension))
+    image.thumbnail((max_dimension, max_dimension))
+    if image_format == ImageFormat.JPEG and image.mode not in ('RGB', 'L'):
+        image = image.convert('RGB')
+    output = io.BytesIO()
+    image.save(output, format=image_format.value.upper(), quality=quality)
+    return output.getvalue(), started_at - submitted_at, time.monotonic() - started_at
+
+
+class MediaProcessor:
+    """
+    Re-encodes and downscales images on a process pool, so decoding and encoding never block the event loop
+    """
+
+    def __init__(self,
+                 workers: int = 2,
+                 image_format: ImageFormat = ImageFormat.WEBP,
+                 quality: int = 80,
+                 max_dimension: int = 2048,
+                 max_file_size: int = 20 * 1000 ** 2,
+                 types: Iterable[MediaType] = (MediaType.PHOTO,),
+                 ):
+        if Image is None:
+            raise RuntimeError('Media processing requires the Pillow package to be installed')
+        self.log = logging.getLogger(f'{__name__}.{self.__class__.__name__}')
+        self.workers = workers
+        self.image_format = image_format
+        self.quality = quality
+        self.max_dimension = max_dimension
+        self.max_file_size = max_file_size
+        self.types = frozenset(types)
+        self.content_type = CONTENT_TYPES[image_format]
+
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._queue_seconds = prometheus_frontend_media_stage_seconds.labels('queue')
+        self._process_seconds = prometheus_frontend_media_stage_seconds.labels('process')
+
+    def start(self) -> None:
+        self._executor = ProcessPoolExecutor(max_workers=self.workers)
+
+    def stop(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
+
+    def accepts(self, media_type: MediaType, content_type: str, file_size: int) -> bool:
+        return media_type in self.types \
+            and content_type in PROCESSABLE_CONTENT_TYPES \
+            and file_size <= self.max_file_size
+
+    async def process(self, data: bytes) -> bytes:
+        prometheus_frontend_media_processing_pending.inc()
+        try:
+            result, queue_seconds, process_seconds = await asyncio.get_running_loop().run_in_executor(
+                self._executor, normalize_image,
+                data, self.image_format, self.quality, self.max_dimension, time.monotonic(),
+            )
+        finally:
+            prometheus_frontend_media_processing_pending.dec()
+        self._queue_seconds.observe(queue_seconds)
+        self._process_seconds.observe(process_seconds)
+        return result
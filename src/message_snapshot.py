@@ -0,0 +1,88 @@
+from datetime import datetime
+from typing import List, Optional, Tuple
+
+from pyrogram.enums import ChatType as PyrogramChatType, MessageMediaType, MessageServiceType
+from pyrogram.types import Chat as PyrogramChat, Message as PyrogramMessage, User as PyrogramUser
+
+# Message attributes counted by the Prometheus handler when they are set
+COUNTED_ATTRIBUTES: Tuple[str, ...] = (
+    'caption', 'document', 'forwards', 'group_chat_created', 'left_chat_member', 'location', 'media',
+    'new_chat_members', 'new_chat_photo', 'new_chat_title', 'photo', 'pinned_message', 'poll', 'reactions',
+    'service', 'sticker', 'supergroup_chat_created', 'text', 'video_chat_ended', 'video_chat_started', 'video',
+    'video_note', 'voice',
+)
+
+# Attribute the snapshot is cached under, Pyrogram leaves underscored attributes out of str() and ==
+SNAPSHOT_ATTRIBUTE = '_snapshot'
+
+
+class UserSnapshot:
+    __slots__ = ('id', 'username', 'first_name', 'last_name', 'is_bot')
+
+    def __init__(self, value: PyrogramUser):
+        self.id: int = value.id
+        self.username: Optional[str] = value.username
+        self.first_name: Optional[str] = value.first_name
+        self.last_name: Optional[str] = value.last_name
+        self.is_bot: bool = value.is_bot
+
+
+class ChatSnapshot:
+    __slots__ = ('id', 'type', 'title', 'username', 'first_name', 'last_name')
+
+    def __init__(self, value: PyrogramChat):
+        self.id: int = value.id
+        self.type: Optional[PyrogramChatType] = value.type
+        self.title: Optional[str] = value.title
+        self.username: Optional[str] = value.username
+        self.first_name: Optional[str] = value.first_name
+        self.last_name: Optional[str] = value.last_name
+
+
+def get_user_snapshot(value: Optional[PyrogramUser]) -> Optional[UserSnapshot]:
+    return UserSnapshot(value) if value is not None else None
+
+
+class MessageSnapshot:
+    """
+    Everything the handlers read from a Pyrogram message, read once. Attribute names match Pyrogram's,
+    so helpers that only read these attributes accept either
+    """
+
+    __slots__ = (
+        'id', 'date', 'chat', 'from_user', 'forward_from', 'text', 'caption', 'mentioned', 'reply_to_message_id',
+        'media', 'service', 'left_chat_member', 'new_chat_members', 'present',
+    )
+
+    def __init__(self, value: PyrogramMessage):
+        attributes = value.__dict__
+        self.id: int = value.id
+        self.date: Optional[datetime] = value.date
+        # Empty messages Telegram failed to return have no chat
+        self.chat: Optional[ChatSnapshot] = ChatSnapshot(value.chat) if value.chat is not None else None
+        self.from_user: Optional[UserSnapshot] = get_user_snapshot(value.from_user)
+        self.forward_from: Optional[UserSnapshot] = get_user_snapshot(value.forward_from)
+        self.text: Optional[str] = value.text
+        self.caption: Optional[str] = value.caption
+        self.mentioned: Optional[bool] = value.mentioned
+        self.reply_to_message_id: Optional[int] = value.reply_to_message_id
+        self.media: Optional[MessageMediaType] = value.media
+        self.service: Optional[MessageServiceType] = value.service
+        self.left_chat_member: Optional[UserSnapshot] = get_user_snapshot(value.left_chat_member)
+        self.new_chat_members: Optional[List[UserSnapshot]] = [
+            UserSnapshot(it) for it in value.new_chat_members
+        ] if value.new_chat_members is not None else None
+        # Counted attributes that are set, one dict lookup each instead of an attribute probe per handler
+        self.present: Tuple[str, ...] = tuple(it for it in COUNTED_ATTRIBUTES if attributes.get(it) is not None)
+
+
+def get_snapshot(value: PyrogramMessage) -> MessageSnapshot:
+    """
+    Every handler group gets the same message object, so the snapshot is built by the first one to ask
+    """
+
+    snapshot = value.__dict__.get(SNAPSHOT_ATTRIBUTE)
+    if snapshot is None:
+        snapshot = MessageSnapshot(value)
+        setattr(value, SNAPSHOT_ATTRIBUTE, snapshot)
+    return snapshot
@@ -20,6 +20,12 @@ class MediaType(str, Enum):
     OTHER = 'OTHER'
 
 
+class MediaStatus(str, Enum):
+    READY = 'READY'
+    SKIPPED = 'SKIPPED'
+    FAILED = 'FAILED'
+
+
 class Chat(BaseModel):
     id: str = Field(min_length=1)
     title: str = Field(min_length=1)
@@ -45,3 +51,22 @@ class NewMessage(BaseModel):
     media_type: Optional[MediaType] = Field(default=None)
     s3_bucket: Optional[str] = Field(default=None)
     s3_object: Optional[str] = Field(default=None)
+    # 64-bit dHash as hex. With near_duplicate_distance set, s3_object is the earlier image this one matched
+    perceptual_hash: Optional[str] = Field(default=None)
+    near_duplicate_distance: Optional[int] = Field(default=None)
+    # Two-phase publishing: media is uploaded after this event, a MediaReady event with the same correlation_id follows
+    media_pending: bool = Field(default=False)
+    correlation_id: Optional[str] = Field(default=None)
+
+
+class MediaReady(BaseModel):
+    correlation_id: str = Field(min_length=1)
+    chat: Chat = Field()
+    frontend: str = Field()
+    media_type: MediaType = Field()
+    status: MediaStatus = Field()
+    s3_bucket: Optional[str] = Field(default=None)
+    s3_object: Optional[str] = Field(default=None)
+    perceptual_hash: Optional[str] = Field(default=None)
+    near_duplicate_distance: Optional[int] = Field(default=None)
+
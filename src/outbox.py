@@ -0,0 +1,392 @@
+import asyncio
+import logging
+import os
+import struct
+import threading
+import zlib
+from collections import deque
+from dataclasses import dataclass, field
+from typing import BinaryIO, Callable, Deque, Dict, List, Optional, Set, Tuple
+
+from confluent_kafka import KafkaException
+
+from src.kafka_producer import AsyncKafkaProducer
+from src.prometheus_metrics import prometheus_frontend_kafka_outbox_bytes, prometheus_frontend_kafka_outbox_segments, \
+    prometheus_frontend_kafka_outbox_appended, prometheus_frontend_kafka_outbox_replayed, \
+    prometheus_frontend_kafka_outbox_replay_failures
+
+SEGMENT_SUFFIX = '.seg'
+CURSOR_FILE_NAME = 'cursor'
+
+# Frame: payload length, payload crc32
+FRAME_HEADER = struct.Struct('>II')
+FIELD_LENGTH = struct.Struct('>i')
+HEADER_COUNT = struct.Struct('>H')
+
+
+@dataclass(slots=True)
+class OutboxRecord:
+    topic: str
+    key: Optional[str]
+    value: bytes
+    headers: List[Tuple[str, bytes]] = field(default_factory=list)
+
+
+def _encode_field(value: Optional[bytes]) -> bytes:
+    if value is None:
+        return FIELD_LENGTH.pack(-1)
+    return FIELD_LENGTH.pack(len(value)) + value
+
+
+def _decode_field(payload: memoryview, offset: int) -> Tuple[Optional[bytes], int]:
+    (length,) = FIELD_LENGTH.unpack_from(payload, offset)
+    offset += FIELD_LENGTH.size
+    if length < 0:
+        return None, offset
+    return bytes(payload[offset:offset + length]), offset + length
+
+
+def encode_record(record: OutboxRecord) -> bytes:
+    parts = [
+        _encode_field(record.topic.encode('utf-8')),
+        _encode_field(record.key.encode('utf-8') if record.key is not None else None),
+        _encode_field(record.value),
+        HEADER_COUNT.pack(len(record.headers)),
+    ]
+    for key, value in record.headers:
+        parts.append(_encode_field(key.encode('utf-8')))
+        parts.append(_encode_field(value))
+    payload = b''.join(parts)
+    return FRAME_HEADER.pack(len(payload), zlib.crc32(payload)) + payload
+
+
+def decode_record(payload: bytes) -> OutboxRecord:
+    view = memoryview(payload)
+    topic, offset = _decode_field(view, 0)
+    key, offset = _decode_field(view, offset)
+    value, offset = _decode_field(view, offset)
+    (header_count,) = HEADER_COUNT.unpack_from(view, offset)
+    offset += HEADER_COUNT.size
+    headers = []
+    for _ in range(header_count):
+        header_key, offset = _decode_field(view, offset)
+        header_value, offset = _decode_field(view, offset)
+        headers.append((header_key.decode('utf-8'), header_value))
+    return OutboxRecord(
+        topic=topic.decode('utf-8'),
+        key=key.decode('utf-8') if key is not None else None,
+        value=value,
+        headers=headers,
+    )
+
+
+def read_records(path: str, offset: int, max_records: int) -> List[Tuple[OutboxRecord, int]]:
+    """
+    Reads complete records starting at `offset`. A torn or corrupted tail is treated as the end of the segment
+    :return: records paired with the offset right after each of them
+    """
+
+    records = []
+    with open(path, 'rb') as fp:
+        fp.seek(offset)
+        while len(records) < max_records:
+            header = fp.read(FRAME_HEADER.size)
+            if len(header) < FRAME_HEADER.size:
+                break
+            length, crc = FRAME_HEADER.unpack(header)
+            payload = fp.read(length)
+            if len(payload) < length or zlib.crc32(payload) != crc:
+                break
+            offset += FRAME_HEADER.size + length
+            records.append((decode_record(payload), offset))
+    return records
+
+
+def _sync(fp: BinaryIO, lock: threading.Lock, close: bool = False) -> None:
+    """
+    Runs on executor threads. The lock keeps a periodic fsync from racing the close of a rolled segment:
+    once a file is closed its descriptor may already belong to another file
+    """
+
+    with lock:
+        if fp.closed:
+            return
+        os.fsync(fp.fileno())
+        if close:
+            fp.close()
+
+
+class KafkaOutbox:
+    """
+    Append-only, segment based on-disk queue for events Kafka can't accept right now.
+    While the outbox holds anything, new events are appended too, so replay keeps the original order.
+    An event of a key is only sent once the previous event of that key was acknowledged or stored: if that one
+    timed out into the outbox, the later one follows it there instead of overtaking it in Kafka.
+    Fully replayed segments are deleted.
+    """
+
+    def __init__(self,
+                 producer: AsyncKafkaProducer,
+                 directory: str,
+                 segment_size: int,
+                 fsync_interval: float = 0.5,
+                 replay_batch_size: int = 500,
+                 retry_interval: float = 5.0,
+                 send_timeout: float = 2.0,
+                 ):
+        self.log = logging.getLogger(f'{__name__}.{self.__class__.__name__}')
+        self.producer = producer
+        self.directory = directory
+        self.segment_size = segment_size
+        self.fsync_interval = fsync_interval
+        self.replay_batch_size = replay_batch_size
+        self.retry_interval = retry_interval
+        self.send_timeout = send_timeout
+
+        self._segments: Deque[int] = deque()
+        self._segment_sizes: dict[int, int] = {}
+        self._writer: Optional[BinaryIO] = None
+        self._sync_lock = threading.Lock()
+        self._dirty = False
+        # Position of the next record to replay
+        self._read_segment = 0
+        self._read_offset = 0
+        self._size_bytes = 0
+        # End offsets of records in the read segment that were acknowledged after an earlier record failed
+        self._acked_ahead: Set[int] = set()
+        # Key -> resolved once the last event published with it was acknowledged or stored
+        self._key_tails: Dict[str, asyncio.Future] = {}
+
+        self._wakeup = asyncio.Event()
+        self._tasks: List[asyncio.Task] = []
+
+    def _segment_path(self, segment: int) -> str:
+        return os.path.join(self.directory, f'{segment:020d}{SEGMENT_SUFFIX}')
+
+    @property
+    def _write_segment(self) -> int:
+        return self._segments[-1]
+
+    def has_pending(self) -> bool:
+        return self._size_bytes > 0
+
+    def _update_metrics(self) -> None:
+        prometheus_frontend_kafka_outbox_bytes.set(self._size_bytes)
+        prometheus_frontend_kafka_outbox_segments.set(len(self._segments))
+
+    async def start(self) -> None:
+        os.makedirs(self.directory, exist_ok=True)
+        self._recover()
+        # Never append to a segment left by a previous run: its tail may be torn
+        self._open_segment(self._segments[-1] + 1 if self._segments else 0)
+        if self._read_segment not in self._segment_sizes:
+            self._read_segment, self._read_offset = self._segments[0], 0
+        self._update_metrics()
+        if self.has_pending():
+            self.log.info('Outbox holds %d bytes of events from a previous run', self._size_bytes)
+            self._wakeup.set()
+        self._tasks = [
+            asyncio.create_task(self._fsync_loop(), name='outbox-fsync'),
+            asyncio.create_task(self._replay_loop(), name='outbox-replay'),
+        ]
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        if self._writer is not None:
+            self._writer.flush()
+            _sync(self._writer, self._sync_lock, close=True)
+            self._writer = None
+        self._save_cursor()
+
+    def _recover(self) -> None:
+        for file_name in sorted(os.listdir(self.directory)):
+            if file_name.endswith(SEGMENT_SUFFIX):
+                segment = int(file_name.removesuffix(SEGMENT_SUFFIX))
+                self._segments.append(segment)
+                self._segment_sizes[segment] = os.path.getsize(self._segment_path(segment))
+        cursor_path = os.path.join(self.directory, CURSOR_FILE_NAME)
+        if os.path.exists(cursor_path):
+            with open(cursor_path) as fp:
+                segment, offset = fp.read().split()
+            self._read_segment, self._read_offset = int(segment), int(offset)
+        while self._segments and self._segments[0] < self._read_segment:
+            drained = self._segments.popleft()
+            del self._segment_sizes[drained]
+            os.remove(self._segment_path(drained))
+        if self._segments and self._segments[0] != self._read_segment:
+            self._read_offset = 0
+        self._size_bytes = sum(self._segment_sizes[segment] for segment in self._segments) - self._read_offset
+
+    def _save_cursor(self) -> None:
+        cursor_path = os.path.join(self.directory, CURSOR_FILE_NAME)
+        with open(f'{cursor_path}.tmp', 'w') as fp:
+            fp.write(f'{self._read_segment} {self._read_offset}')
+        os.replace(f'{cursor_path}.tmp', cursor_path)
+
+    def _open_segment(self, segment: int) -> None:
+        self._segments.append(segment)
+        self._segment_sizes[segment] = 0
+        self._writer = open(self._segment_path(segment), 'ab')
+
+    def _roll_segment(self) -> None:
+        # Flushed here so the replay loop can read the segment right away, only fsync is left to the executor
+        self._writer.flush()
+        asyncio.get_running_loop().run_in_executor(None, _sync, self._writer, self._sync_lock, True)
+        self._dirty = False
+        self._open_segment(self._write_segment + 1)
+
+    def append(self, record: OutboxRecord) -> None:
+        frame = encode_record(record)
+        self._writer.write(frame)
+        self._dirty = True
+        self._segment_sizes[self._write_segment] += len(frame)
+        self._size_bytes += len(frame)
+        if self._segment_sizes[self._write_segment] >= self.segment_size:
+            self._roll_segment()
+        prometheus_frontend_kafka_outbox_appended.inc()
+        self._update_metrics()
+        self._wakeup.set()
+
+    async def publish(self, topic: str, key: Optional[str], value: bytes,
+                      headers: Optional[List[Tuple[str, bytes]]] = None,
+                      on_enqueued: Optional[Callable[[], None]] = None,
+                      ) -> bool:
+        """
+        Sends the event to Kafka, or stores it in the outbox if Kafka can't take it or doesn't acknowledge it
+        within send_timeout. Librdkafka only reports brokers as down after a while, and the caller must not wait
+        that long. An event that timed out may still be delivered by the producer, and then again by the replay
+        :param on_enqueued: see AsyncKafkaProducer.send
+        :return: True if Kafka acknowledged the event, False if it was stored in the outbox
+        """
+
+        headers = headers or []
+        if key is None:
+            return await self._publish(topic, key, value, headers, on_enqueued)
+        previous = self._key_tails.get(key)
+        tail = self._key_tails[key] = asyncio.get_running_loop().create_future()
+        try:
+            if previous is not None:
+                await asyncio.shield(previous)
+            return await self._publish(topic, key, value, headers, on_enqueued)
+        finally:
+            tail.set_result(None)
+            if self._key_tails.get(key) is tail:
+                del self._key_tails[key]
+
+    async def _publish(self, topic: str, key: Optional[str], value: bytes, headers: List[Tuple[str, bytes]],
+                       on_enqueued: Optional[Callable[[], None]]) -> bool:
+        if not self.has_pending() and self.producer.available:
+            try:
+                await asyncio.wait_for(
+                    self.producer.send(topic=topic, key=key, value=value, headers=headers, on_enqueued=on_enqueued),
+                    self.send_timeout,
+                )
+                return True
+            except asyncio.TimeoutError:
+                self.log.warning('Kafka did not acknowledge the event within %.1f seconds, storing it in the outbox',
+                                 self.send_timeout)
+            except (BufferError, KafkaException) as e:
+                self.log.warning('Kafka did not accept the event, storing it in the outbox: %s', e)
+        self.append(OutboxRecord(topic=topic, key=key, value=value, headers=headers))
+        return False
+
+    async def _fsync_loop(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(self.fsync_interval)
+            if not self._dirty:
+                continue
+            self._dirty = False
+            writer = self._writer
+            writer.flush()
+            try:
+                await loop.run_in_executor(None, _sync, writer, self._sync_lock)
+            except OSError as e:
+                self.log.error('Unable to sync outbox segment %d: %s', self._write_segment, e)
+
+    def _compact(self) -> None:
+        """
+        Deletes the segment that was fully replayed and moves the read position to the next one
+        """
+
+        if self._read_segment == self._write_segment:
+            self._roll_segment()
+        drained = self._segments.popleft()
+        del self._segment_sizes[drained]
+        os.remove(self._segment_path(drained))
+        self._read_segment, self._read_offset = self._segments[0], 0
+        self._acked_ahead.clear()
+        self._save_cursor()
+        self._update_metrics()
+
+    async def _replay_loop(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            read_segment_size = self._segment_sizes[self._read_segment]
+            if self._read_offset >= read_segment_size and \
+                    (self._read_segment != self._write_segment or read_segment_size > 0):
+                self._compact()
+                continue
+            if not self.has_pending():
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            if self._read_segment == self._write_segment:
+                self._writer.flush()
+            batch = await loop.run_in_executor(
+                None, read_records, self._segment_path(self._read_segment), self._read_offset, self.replay_batch_size
+            )
+            if not batch:
+                self.log.error('Outbox segment %d is corrupted after offset %d, skipping the rest of it',
+                               self._read_segment, self._read_offset)
+                self._size_bytes -= self._segment_sizes[self._read_segment] - self._read_offset
+                self._read_offset = self._segment_sizes[self._read_segment]
+                continue
+
+            replayed, error = await self._replay_batch(batch)
+            if replayed > 0:
+                prometheus_frontend_kafka_outbox_replayed.inc(replayed)
+                self._save_cursor()
+                self._update_metrics()
+            if error is not None:
+                prometheus_frontend_kafka_outbox_replay_failures.inc()
+                self.log.warning('Outbox replay failed, retrying in %.1f seconds: %s', self.retry_interval, error)
+                await asyncio.sleep(self.retry_interval)
+
+    async def _replay_batch(self, batch: List[Tuple[OutboxRecord, int]]) -> Tuple[int, Optional[Exception]]:
+        """
+        Records of different keys are sent concurrently, records of one key one after another, and a key stops
+        at its first failure, so a later event of a chat never overtakes an earlier one.
+        Records acknowledged past a failure are remembered and not sent again by the retry.
+        Moves the read position past the acknowledged prefix of the batch
+        :return: number of records acknowledged, the first failure if any
+        """
+
+        by_key: Dict[Optional[str], List[Tuple[OutboxRecord, int]]] = {}
+        for record, end_offset in batch:
+            if end_offset not in self._acked_ahead:
+                by_key.setdefault(record.key, []).append((record, end_offset))
+        errors: List[Exception] = []
+
+        async def replay_key(records: List[Tuple[OutboxRecord, int]]) -> int:
+            for acked, (record, end_offset) in enumerate(records):
+                try:
+                    await self.producer.send(topic=record.topic, key=record.key, value=record.value,
+                                             headers=record.headers)
+                except Exception as e:
+                    errors.append(e)
+                    return acked
+                self._acked_ahead.add(end_offset)
+            return len(records)
+
+        replayed = sum(await asyncio.gather(*(replay_key(it) for it in by_key.values())))
+        for _, end_offset in batch:
+            if end_offset not in self._acked_ahead:
+                break
+            self._acked_ahead.discard(end_offset)
+            self._size_bytes -= end_offset - self._read_offset
+            self._read_offset = end_offset
+        return replayed, errors[0] if errors else None
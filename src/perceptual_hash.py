@@ -0,0 +1,143 @@
+import asyncio
+import io
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Generic, Iterable, List, Optional, Set, Tuple, TypeVar
+
+from src.new_message import MediaType
+
+try:
+    import numpy as np
+    from PIL import Image
+except ImportError:
+    np = None
+    Image = None
+
+HASH_BITS = 64
+HASH_SIZE = 8
+
+# Formats Pillow is trusted to decode
+HASHABLE_CONTENT_TYPES = frozenset({'image/jpeg', 'image/png', 'image/webp'})
+
+V = TypeVar('V')
+
+
+def dhash(data: bytes) -> int:
+    """
+    Difference hash: every bit tells whether a pixel of the downscaled grayscale image is brighter than its left
+    neighbour. Survives recompression and resizing, unlike file hashes
+    """
+
+    image = Image.open(io.BytesIO(data))
+    # Lets the JPEG decoder scale by a power of two while decoding, no-op for other formats
+    image.draft('L', (HASH_SIZE * 4, HASH_SIZE * 4))
+    pixels = np.asarray(
+        image.convert('L').resize((HASH_SIZE + 1, HASH_SIZE), Image.Resampling.LANCZOS), dtype=np.int16
+    )
+    bits = pixels[:, 1:] > pixels[:, :-1]
+    return int.from_bytes(np.packbits(bits).tobytes(), 'big')
+
+
+def hamming_distance(first: int, second: int) -> int:
+    return (first ^ second).bit_count()
+
+
+def format_hash(value: int) -> str:
+    return f'{value:0{HASH_BITS // 4}x}'
+
+
+class HashIndex(Generic[V]):
+    """
+    Multi-index hashing: hashes are split into max_distance + 1 chunks, and by the pigeonhole principle
+    a hash within max_distance of the query equals it in at least one chunk. A lookup is a handful of
+    dict lookups plus distance checks of the few candidates found.
+    The least recently matched or added hash is evicted once max_size is reached
+    """
+
+    def __init__(self, max_distance: int = 4, max_size: int = 100_000, bits: int = HASH_BITS):
+        self.max_distance = max_distance
+        self.max_size = max_size
+
+        chunks = max_distance + 1
+        self._chunks: List[Tuple[int, int]] = []
+        shift = 0
+        for i in range(chunks):
+            width = bits // chunks + (1 if i < bits % chunks else 0)
+            self._chunks.append((shift, (1 << width) - 1))
+            shift += width
+        self._tables: List[Dict[int, Set[int]]] = [{} for _ in range(chunks)]
+        self._entries: OrderedDict[int, V] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def add(self, value_hash: int, value: V) -> None:
+        if value_hash not in self._entries:
+            for table, (shift, mask) in zip(self._tables, self._chunks):
+                table.setdefault((value_hash >> shift) & mask, set()).add(value_hash)
+        self._entries[value_hash] = value
+        self._entries.move_to_end(value_hash)
+        if len(self._entries) > self.max_size:
+            self._remove(next(iter(self._entries)))
+
+    def find(self, value_hash: int) -> Optional[Tuple[int, V]]:
+        """
+        :return: distance to the nearest indexed hash within max_distance and its value
+        """
+
+        nearest: Optional[int] = None
+        nearest_distance = self.max_distance + 1
+        for table, (shift, mask) in zip(self._tables, self._chunks):
+            for candidate in table.get((value_hash >> shift) & mask, ()):
+                distance = hamming_distance(value_hash, candidate)
+                if distance < nearest_distance:
+                    nearest, nearest_distance = candidate, distance
+        if nearest is None:
+            return None
+        self._entries.move_to_end(nearest)
+        return nearest_distance, self._entries[nearest]
+
+    def _remove(self, value_hash: int) -> None:
+        del self._entries[value_hash]
+        for table, (shift, mask) in zip(self._tables, self._chunks):
+            key = (value_hash >> shift) & mask
+            bucket = table[key]
+            bucket.discard(value_hash)
+            if not bucket:
+                del table[key]
+
+
+class PerceptualHasher:
+    """
+    Hashes images on a thread pool: Pillow releases the GIL while decoding and resizing,
+    and sharing the downloaded bytes with a thread needs no copy
+    """
+
+    def __init__(self,
+                 workers: int = 1,
+                 max_file_size: int = 20 * 1000 ** 2,
+                 types: Iterable[MediaType] = (MediaType.PHOTO,),
+                 ):
+        if np is None or Image is None:
+            raise RuntimeError('Perceptual hashing requires the numpy and Pillow packages to be installed')
+        self.workers = workers
+        self.max_file_size = max_file_size
+        self.types = frozenset(types)
+
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+    def start(self) -> None:
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='perceptual-hash')
+
+    def stop(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
+
+    def accepts(self, media_type: MediaType, content_type: str, file_size: int) -> bool:
+        return media_type in self.types \
+            and content_type in HASHABLE_CONTENT_TYPES \
+            and file_size <= self.max_file_size
+
+    async def hash(self, data: bytes) -> int:
+        return await asyncio.get_running_loop().run_in_executor(self._executor, dhash, data)
@@ -1,30 +1,8 @@
-from prometheus_client import Counter, Gauge
+from prometheus_client import Counter, Gauge, Histogram
 
 # Message counters
-prometheus_frontend_messages_caption = Counter('frontend_messages_caption', 'Total count of caption messages received')
-prometheus_frontend_messages = Counter('frontend_messages', 'Total count of messages received')
-prometheus_frontend_messages_document = Counter('frontend_messages_document', 'Total count of document messages received')
-prometheus_frontend_messages_forwards = Counter('frontend_messages_forwards', 'Total count of forwards messages received')
-prometheus_frontend_messages_group_chat_created = Counter('frontend_messages_group_chat_created', 'Total count of group chat created messages received')
-prometheus_frontend_messages_left_chat_members = Counter('frontend_messages_left_chat_members', 'Total count of new chat members messages received')
-prometheus_frontend_messages_location = Counter('frontend_messages_location', 'Total count of location messages received')
-prometheus_frontend_messages_media = Counter('frontend_messages_media', 'Total count of media messages received')
-prometheus_frontend_messages_new_chat_members = Counter('frontend_messages_new_chat_members', 'Total count of new chat members messages received')
-prometheus_frontend_messages_new_chat_photo = Counter('frontend_messages_new_chat_photo', 'Total count of new chat photo messages received')
-prometheus_frontend_messages_new_chat_title = Counter('frontend_messages_new_chat_title', 'Total count of new chat title messages received')
-prometheus_frontend_messages_photo = Counter('frontend_messages_photo', 'Total count of photo messages received')
-prometheus_frontend_messages_pinned_message = Counter('frontend_messages_pinned_message', 'Total count of pinned message messages received')
-prometheus_frontend_messages_poll = Counter('frontend_messages_poll', 'Total count of poll messages received')
-prometheus_frontend_messages_reactions = Counter('frontend_messages_reactions', 'Total count of reactions messages received')
-prometheus_frontend_messages_service = Counter('frontend_messages_service', 'Total count of service messages received')
-prometheus_frontend_messages_sticker = Counter('frontend_messages_sticker', 'Total count of sticker messages received')
-prometheus_frontend_messages_supergroup_chat_created = Counter('frontend_messages_supergroup_chat_created', 'Total count of supergroupd chat created messages received')
-prometheus_frontend_messages_text = Counter('frontend_messages_text', 'Total count of text messages received')
-prometheus_frontend_messages_video_chat_ended = Counter('frontend_messages_video_chat_ended', 'Total count of video chat ended messages received')
-prometheus_frontend_messages_video_chat_started = Counter('frontend_messages_video_chat_started', 'Total count of video chat started messages received')
-prometheus_frontend_messages_video = Counter('frontend_messages_video', 'Total count of video messages received')
-prometheus_frontend_messages_video_note = Counter('frontend_messages_video_note', 'Total count of video note messages received')
-prometheus_frontend_messages_voice = Counter('frontend_messages_voice', 'Total count of voice messages received')
+prometheus_frontend_messages_received = Counter('frontend_messages_received', 'Total count of messages received')
+prometheus_frontend_messages = Counter('frontend_messages', 'Total count of messages received by content kind, a message can be of several kinds', ['kind'])
 
 # Chat type counts
 prometheus_frontend_known_bot_chats = Gauge('frontend_known_bot_chats', 'Total number of known bot type chats')
@@ -36,3 +14,41 @@ prometheus_frontend_known_unknown_chats = Gauge('frontend_known_unknown_chats',
 
 # Users
 prometheus_frontend_known_users = Gauge('frontend_known_users', 'Total number of known users')
+
+# Ingest queue
+prometheus_frontend_ingest_queue_depth = Gauge('frontend_ingest_queue_depth', 'Number of messages waiting in an ingest lane', ['lane'])
+prometheus_frontend_ingest_queue_wait_seconds = Histogram('frontend_ingest_queue_wait_seconds', 'Time a message spent in an ingest lane before processing', ['lane'])
+prometheus_frontend_ingest_lane_processing_seconds = Histogram('frontend_ingest_lane_processing_seconds', 'Time an ingest lane spent processing a message', ['lane'])
+prometheus_frontend_ingest_dropped = Counter('frontend_ingest_dropped', 'Total count of messages degraded or dropped because the ingest queue was full', ['what'])
+
+# Kafka producer
+prometheus_frontend_kafka_delivery_errors = Counter('frontend_kafka_delivery_errors', 'Total count of messages Kafka failed to deliver', ['error'])
+prometheus_frontend_kafka_delivery_seconds = Histogram('frontend_kafka_delivery_seconds', 'Time from produce to the broker acknowledgement of a message', ['topic', 'partition'])
+
+# Kafka outbox
+prometheus_frontend_kafka_outbox_bytes = Gauge('frontend_kafka_outbox_bytes', 'Size of events waiting in the Kafka outbox')
+prometheus_frontend_kafka_outbox_segments = Gauge('frontend_kafka_outbox_segments', 'Number of Kafka outbox segment files')
+prometheus_frontend_kafka_outbox_appended = Counter('frontend_kafka_outbox_appended', 'Total count of events stored in the Kafka outbox')
+prometheus_frontend_kafka_outbox_replayed = Counter('frontend_kafka_outbox_replayed', 'Total count of events replayed from the Kafka outbox')
+prometheus_frontend_kafka_outbox_replay_failures = Counter('frontend_kafka_outbox_replay_failures', 'Total count of failed Kafka outbox replay attempts')
+
+# Media
+prometheus_frontend_media_cache_lookups = Counter('frontend_media_cache_lookups', 'Total count of media deduplication lookups by result', ['result'])
+prometheus_frontend_media_skipped = Counter('frontend_media_skipped', 'Total count of media not uploaded because neither it nor its thumbnails fit the size cap', ['media_type'])
+prometheus_frontend_media_thumbnails = Counter('frontend_media_thumbnails', 'Total count of media uploaded as a thumbnail instead of the original file', ['media_type'])
+prometheus_frontend_media_stage_seconds = Histogram('frontend_media_stage_seconds', 'Time spent in a media ingest stage', ['stage'])
+prometheus_frontend_media_processing_pending = Gauge('frontend_media_processing_pending', 'Number of media files submitted to the processing pool and not yet processed')
+prometheus_frontend_media_processing_failures = Counter('frontend_media_processing_failures', 'Total count of media uploaded as is because processing failed')
+prometheus_frontend_media_near_duplicates = Counter('frontend_media_near_duplicates', 'Total count of images not uploaded because a perceptually similar image already was')
+
+# Filter
+prometheus_frontend_filtered = Counter('frontend_filtered', 'Total count of updates dropped before any handler by the rule that rejected them', ['rule'])
+
+# Outgoing messages
+prometheus_frontend_send_queue_depth = Gauge('frontend_send_queue_depth', 'Number of outgoing messages waiting for the send scheduler', ['priority'])
+prometheus_frontend_send_wait_seconds = Histogram('frontend_send_wait_seconds', 'Time an outgoing message waited in the send scheduler before its first attempt', ['priority'], buckets=[0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0])
+prometheus_frontend_send_flood_waits = Counter('frontend_send_flood_waits', 'Total count of FloodWait errors Telegram returned for outgoing messages')
+prometheus_frontend_send_rejected = Counter('frontend_send_rejected', 'Total count of outgoing messages rejected by the send scheduler', ['reason'])
+
+# Logging
+prometheus_frontend_log_records_dropped = Counter('frontend_log_records_dropped', 'Total count of log records dropped because the logging queue was full')
@@ -1,10 +1,28 @@
-from typing import Optional
+from typing import Dict, Optional
 
 from pyrogram import types
 from pyrogram.enums import MessageServiceType, MessageMediaType
 from pyrogram.types import Message as PyrogramMessage, Chat
 
-from new_message_request import NewMessageUser, ChatType, MessageType, ActionType, NewMessageActionInfo, MediaType
+from src.new_message_request import NewMessageUser, ChatType, MessageType, ActionType, NewMessageActionInfo, MediaType
+
+
+# Every helper below reads only attributes MessageSnapshot shares with Pyrogram messages, so it accepts either
+
+MEDIA_TYPES: Dict[MessageMediaType, str] = {
+    MessageMediaType.ANIMATION: MediaType.GIF,
+    MessageMediaType.VIDEO: MediaType.VIDEO,
+    MessageMediaType.VOICE: MediaType.VOICE,
+    MessageMediaType.VIDEO_NOTE: MediaType.VIDEO_NOTE,
+    MessageMediaType.AUDIO: MediaType.AUDIO,
+    MessageMediaType.PHOTO: MediaType.PHOTO,
+    MessageMediaType.STICKER: MediaType.STICKER,
+}
+
+ACTION_TYPES: Dict[MessageServiceType, str] = {
+    MessageServiceType.NEW_CHAT_MEMBERS: ActionType.NEW_MEMBER,
+    MessageServiceType.LEFT_CHAT_MEMBERS: ActionType.MEMBER_LEFT,
+}
 
 
 def get_fullname(user: types.User) -> Optional[str]:
@@ -44,16 +62,11 @@ def get_action_related_user(value: PyrogramMessage) -> NewMessageUser:
 
 
 def get_action_type(value: PyrogramMessage) -> str:
-    if value.service == MessageServiceType.NEW_CHAT_MEMBERS:
-        return ActionType.NEW_MEMBER
-    elif value.service == MessageServiceType.LEFT_CHAT_MEMBERS:
-        return ActionType.MEMBER_LEFT
-    else:
-        return ActionType.OTHER
+    return ACTION_TYPES.get(value.service, ActionType.OTHER)
 
 
 def get_message_type(value: PyrogramMessage) -> str:
-    if value.service == MessageServiceType.LEFT_CHAT_MEMBERS or value.service == MessageServiceType.NEW_CHAT_MEMBERS:
+    if value.service in ACTION_TYPES:
         return MessageType.ACTION
     if value.service is not None:
         return MessageType.OTHER
@@ -82,19 +95,4 @@ def get_media_type(value: PyrogramMessage) -> Optional[MediaType]:
     :param value: pyrogram message instance
     """
 
-    if value.media == MessageMediaType.ANIMATION:
-        return MediaType.GIF
-    if value.media == MessageMediaType.VIDEO:
-        return MediaType.VIDEO
-    if value.media == MessageMediaType.VOICE:
-        return MediaType.VOICE
-    if value.media == MessageMediaType.VIDEO_NOTE:
-        return MediaType.VIDEO_NOTE
-    if value.media == MessageMediaType.AUDIO:
-        return MediaType.AUDIO
-    if value.media == MessageMediaType.PHOTO:
-        return MediaType.PHOTO
-    if value.media == MessageMediaType.STICKER:
-        return MediaType.STICKER
-
-    return None
+    return MEDIA_TYPES.get(value.media)
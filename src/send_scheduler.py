@@ -0,0 +1,339 @@
+import asyncio
+import itertools
+import logging
+import time
+from collections import deque
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from enum import Enum
+from typing import Awaitable, Callable, Deque, Dict, List, Optional, Set
+
+from pyrogram import Client
+from pyrogram.errors import FloodWait, SlowmodeWait
+from pyrogram.session import Session
+
+from src.config import SendSchedulerConfig
+from src.prometheus_metrics import prometheus_frontend_send_queue_depth, prometheus_frontend_send_wait_seconds, \
+    prometheus_frontend_send_flood_waits, prometheus_frontend_send_rejected
+
+# Every FloodWait halves the rate of the chat that got it, and takes a tenth off the global rate.
+# Every successful send gives back a share of the configured rate
+CHAT_BACKOFF = 0.5
+GLOBAL_BACKOFF = 0.9
+RECOVERY = 0.05
+MIN_RATE_FACTOR = 0.05
+
+# Idle chats are forgotten once their bucket is full again, checked this often
+SWEEP_INTERVAL = 60.0
+
+
+# Sleep threshold of Telegram calls made in the current context, the client one if None
+flood_sleep_threshold: ContextVar[Optional[float]] = ContextVar('flood_sleep_threshold', default=None)
+
+
+class PacedClient(Client):
+    """
+    Pyrogram sleeps through FloodWaits shorter than sleep_threshold inside the call. Sends run by the scheduler
+    must see every FloodWait instead, while other calls keep the client threshold
+    """
+
+    async def invoke(self, query, retries: int = Session.MAX_RETRIES, timeout: float = Session.WAIT_TIMEOUT,
+                     sleep_threshold: Optional[float] = None):
+        if sleep_threshold is None:
+            sleep_threshold = flood_sleep_threshold.get()
+        return await super().invoke(query, retries, timeout, sleep_threshold)
+
+
+class SendPriority(str, Enum):
+    # Replies a user is waiting for
+    HIGH = 'high'
+    NORMAL = 'normal'
+    # Broadcasts and anything else that can wait
+    LOW = 'low'
+
+
+PRIORITY_ORDER: Dict[SendPriority, int] = {SendPriority.HIGH: 0, SendPriority.NORMAL: 1, SendPriority.LOW: 2}
+
+
+class SendQueueFull(Exception):
+    pass
+
+
+class SendRejected(Exception):
+    """
+    Telegram asked to wait longer than the scheduler is allowed to, or the send was retried too many times
+    """
+
+    def __init__(self, retry_after: float):
+        super().__init__(f'Telegram asked to retry in {retry_after:.0f}s')
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    __slots__ = ('rate', 'capacity', 'tokens', 'updated')
+
+    def __init__(self, rate: float, capacity: float, now: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = now
+
+    def _refill(self, now: float) -> None:
+        if now > self.updated:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+    def ready_at(self, now: float) -> float:
+        self._refill(now)
+        if self.tokens >= 1:
+            return now
+        return now + (1 - self.tokens) / self.rate
+
+    def take(self, now: float) -> None:
+        self._refill(now)
+        self.tokens -= 1
+
+    def is_full(self, now: float) -> bool:
+        self._refill(now)
+        return self.tokens >= self.capacity
+
+
+@dataclass(slots=True)
+class SendJob:
+    send: Callable[[], Awaitable]
+    priority: SendPriority
+    future: asyncio.Future
+    enqueued_at: float
+    sequence: int
+    attempts: int = 0
+
+
+@dataclass(slots=True)
+class ChatState:
+    bucket: TokenBucket
+    base_rate: float
+    queues: List[Deque[SendJob]] = field(default_factory=lambda: [deque() for _ in PRIORITY_ORDER])
+    blocked_until: float = 0.0
+    rate_factor: float = 1.0
+    in_flight: bool = False
+
+    def head(self) -> Optional[SendJob]:
+        for queue in self.queues:
+            if queue:
+                return queue[0]
+        return None
+
+
+class SendScheduler:
+    """
+    Paces outgoing sends under Telegram flood limits: a global token bucket, and a token bucket per chat
+    with the private or group limit. Sends of one chat go out one at a time and in order, higher priorities first;
+    different chats are sent concurrently. A FloodWait blocks the chat for the requested time, retries the send
+    and lowers the rates, which recover with every successful send.
+    Bursts wait in a bounded queue instead of being rejected
+    """
+
+    def __init__(self, config: SendSchedulerConfig, clock: Callable[[], float] = time.monotonic):
+        self.log = logging.getLogger(f'{__name__}.{self.__class__.__name__}')
+        self.config = config
+        self.clock = clock
+
+        now = clock()
+        self._global = TokenBucket(config.global_rate, config.global_burst, now)
+        self._global_factor = 1.0
+        self._chats: Dict[int, ChatState] = {}
+        # Chats with queued jobs
+        self._pending_chats: Set[int] = set()
+        self._pending = 0
+        self._sequence = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._in_flight: Set[asyncio.Task] = set()
+        self._last_sweep = now
+        self._depth = {priority: prometheus_frontend_send_queue_depth.labels(priority.value) for priority in SendPriority}
+        self._wait_seconds = {
+            priority: prometheus_frontend_send_wait_seconds.labels(priority.value) for priority in SendPriority
+        }
+
+    def qsize(self) -> int:
+        return self._pending
+
+    async def submit(self, chat_id: int, send: Callable[[], Awaitable], priority: SendPriority = SendPriority.NORMAL):
+        """
+        :param send: makes the Telegram call, may be called again after a FloodWait
+        :return: what send returned
+        :raises SendQueueFull: if max_pending sends are already waiting
+        :raises SendRejected: if Telegram asked to wait longer than max_flood_wait
+        """
+
+        return await self.enqueue(chat_id, send, priority)
+
+    def enqueue(self,
+                chat_id: int,
+                send: Callable[[], Awaitable],
+                priority: SendPriority = SendPriority.NORMAL,
+                ) -> asyncio.Future:
+        """
+        Like submit, but queues the send right away: sends enqueued one after another keep their order in a chat
+        :return: future of what send returned
+        """
+
+        if self._pending >= self.config.max_pending:
+            prometheus_frontend_send_rejected.labels('queue_full').inc()
+            raise SendQueueFull(f'{self._pending} sends are already waiting')
+
+        job = SendJob(
+            send=send,
+            priority=priority,
+            future=asyncio.get_running_loop().create_future(),
+            enqueued_at=self.clock(),
+            sequence=next(self._sequence),
+        )
+        chat = self._get_chat(chat_id)
+        chat.queues[PRIORITY_ORDER[priority]].append(job)
+        self._pending_chats.add(chat_id)
+        self._pending += 1
+        self._depth[priority].inc()
+        self._wakeup.set()
+        return job.future
+
+    def start(self) -> None:
+        if self._task is not None:
+            raise RuntimeError('Send scheduler is already running')
+        self._task = asyncio.create_task(self._dispatch_loop(), name='send-scheduler')
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        await asyncio.gather(self._task, *self._in_flight, return_exceptions=True)
+        self._task = None
+        for chat in self._chats.values():
+            for queue in chat.queues:
+                for job in queue:
+                    if not job.future.done():
+                        job.future.cancel()
+                queue.clear()
+        self._pending_chats.clear()
+        self._pending = 0
+
+    def _get_chat(self, chat_id: int) -> ChatState:
+        chat = self._chats.get(chat_id)
+        if chat is None:
+            # Users have positive ids, groups and channels negative ones
+            if chat_id > 0:
+                rate, burst = self.config.private_rate, self.config.private_burst
+            else:
+                rate, burst = self.config.group_rate, self.config.group_burst
+            chat = self._chats[chat_id] = ChatState(bucket=TokenBucket(rate, burst, self.clock()), base_rate=rate)
+        return chat
+
+    def _pick(self, now: float) -> tuple[Optional[int], float]:
+        """
+        :return: the chat to send next, if one is ready, and the time the next chat gets ready otherwise
+        """
+
+        best_id, best_key = None, None
+        next_ready = float('inf')
+        for chat_id in self._pending_chats:
+            chat = self._chats[chat_id]
+            if chat.in_flight:
+                continue
+            ready_at = max(chat.blocked_until, chat.bucket.ready_at(now))
+            if ready_at > now:
+                next_ready = min(next_ready, ready_at)
+                continue
+            head = chat.head()
+            key = (PRIORITY_ORDER[head.priority], head.sequence)
+            if best_key is None or key < best_key:
+                best_id, best_key = chat_id, key
+        return best_id, next_ready
+
+    async def _dispatch_loop(self) -> None:
+        while True:
+            self._wakeup.clear()
+            now = self.clock()
+            if now - self._last_sweep >= SWEEP_INTERVAL:
+                self._sweep(now)
+
+            global_ready_at = self._global.ready_at(now)
+            chat_id, next_ready = self._pick(now) if global_ready_at <= now else (None, global_ready_at)
+            if chat_id is None:
+                timeout = next_ready - now if next_ready != float('inf') else None
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            chat = self._chats[chat_id]
+            job = chat.queues[PRIORITY_ORDER[chat.head().priority]].popleft()
+            if chat.head() is None:
+                self._pending_chats.discard(chat_id)
+            self._pending -= 1
+            self._depth[job.priority].dec()
+            self._global.take(now)
+            chat.bucket.take(now)
+            chat.in_flight = True
+            if job.attempts == 0:
+                self._wait_seconds[job.priority].observe(now - job.enqueued_at)
+            task = asyncio.create_task(self._run(chat_id, chat, job))
+            self._in_flight.add(task)
+            task.add_done_callback(self._in_flight.discard)
+
+    async def _run(self, chat_id: int, chat: ChatState, job: SendJob) -> None:
+        job.attempts += 1
+        # Every send runs in a task of its own, so this doesn't leak to other calls
+        flood_sleep_threshold.set(0)
+        try:
+            result = await job.send()
+        except (FloodWait, SlowmodeWait) as e:
+            self._on_flood_wait(chat_id, chat, job, float(e.value))
+        except Exception as e:
+            if not job.future.done():
+                job.future.set_exception(e)
+        else:
+            self._recover(chat)
+            if not job.future.done():
+                job.future.set_result(result)
+        finally:
+            chat.in_flight = False
+            self._wakeup.set()
+
+    def _on_flood_wait(self, chat_id: int, chat: ChatState, job: SendJob, seconds: float) -> None:
+        prometheus_frontend_send_flood_waits.inc()
+        self.log.warning('Telegram asked to wait %.0fs before sending to chat %s', seconds, chat_id)
+        chat.blocked_until = self.clock() + seconds
+        chat.rate_factor = max(MIN_RATE_FACTOR, chat.rate_factor * CHAT_BACKOFF)
+        chat.bucket.rate = chat.base_rate * chat.rate_factor
+        self._global_factor = max(MIN_RATE_FACTOR, self._global_factor * GLOBAL_BACKOFF)
+        self._global.rate = self.config.global_rate * self._global_factor
+
+        if seconds > self.config.max_flood_wait or job.attempts >= self.config.max_attempts:
+            prometheus_frontend_send_rejected.labels('flood_wait').inc()
+            if not job.future.done():
+                job.future.set_exception(SendRejected(seconds))
+            return
+        # Back to the front: the chat keeps its order
+        chat.queues[PRIORITY_ORDER[job.priority]].appendleft(job)
+        self._pending_chats.add(chat_id)
+        self._pending += 1
+        self._depth[job.priority].inc()
+
+    def _recover(self, chat: ChatState) -> None:
+        if chat.rate_factor < 1.0:
+            chat.rate_factor = min(1.0, chat.rate_factor + RECOVERY)
+            chat.bucket.rate = chat.base_rate * chat.rate_factor
+        if self._global_factor < 1.0:
+            self._global_factor = min(1.0, self._global_factor + RECOVERY)
+            self._global.rate = self.config.global_rate * self._global_factor
+
+    def _sweep(self, now: float) -> None:
+        self._last_sweep = now
+        idle = [
+            chat_id for chat_id, chat in self._chats.items()
+            if chat_id not in self._pending_chats and not chat.in_flight and chat.rate_factor >= 1.0
+            and chat.blocked_until <= now and chat.bucket.is_full(now)
+        ]
+        for chat_id in idle:
+            del self._chats[chat_id]
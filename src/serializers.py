@@ -0,0 +1,78 @@
+from abc import ABC, abstractmethod
+from typing import Dict, List, Tuple
+
+from pydantic import BaseModel
+
+from src.config import SerializationFormat
+
+SCHEMA_VERSION = '1'
+
+CONTENT_TYPE_HEADER = 'content-type'
+SCHEMA_VERSION_HEADER = 'schema-version'
+EVENT_TYPE_HEADER = 'event-type'
+
+
+class EventSerializer(ABC):
+    content_type: str
+
+    def __init__(self):
+        self.headers: List[Tuple[str, bytes]] = [
+            (CONTENT_TYPE_HEADER, self.content_type.encode('ascii')),
+            (SCHEMA_VERSION_HEADER, SCHEMA_VERSION.encode('ascii')),
+        ]
+        self._event_headers: Dict[type, List[Tuple[str, bytes]]] = {}
+
+    def get_headers(self, value: BaseModel) -> List[Tuple[str, bytes]]:
+        """
+        Headers are built once per event type: every event of a type carries the same ones
+        """
+
+        headers = self._event_headers.get(type(value))
+        if headers is None:
+            headers = self.headers + [(EVENT_TYPE_HEADER, type(value).__name__.encode('ascii'))]
+            self._event_headers[type(value)] = headers
+        return headers
+
+    @abstractmethod
+    def serialize(self, value: BaseModel) -> bytes:
+        pass
+
+
+class JsonSerializer(EventSerializer):
+    """
+    Serializes straight to bytes with pydantic-core, without building an intermediate str or dict
+    """
+
+    content_type = 'application/json'
+
+    def serialize(self, value: BaseModel) -> bytes:
+        return value.__pydantic_serializer__.to_json(value)
+
+
+class MsgpackSerializer(EventSerializer):
+    """
+    Smaller events than JSON, but slower: the model is dumped to a dict before it is packed
+    """
+
+    content_type = 'application/msgpack'
+
+    def __init__(self):
+        try:
+            import msgpack
+        except ImportError as e:
+            raise RuntimeError('msgpack serialization format requires the msgpack package to be installed') from e
+        self._packer = msgpack.Packer()
+        super().__init__()
+
+    def serialize(self, value: BaseModel) -> bytes:
+        return self._packer.pack(value.model_dump(mode='json'))
+
+
+def get_serializer(serialization_format: SerializationFormat) -> EventSerializer:
+    match serialization_format:
+        case SerializationFormat.JSON:
+            return JsonSerializer()
+        case SerializationFormat.MSGPACK:
+            return MsgpackSerializer()
+        case _:
+            raise ValueError(f'Unknown serialization format: {serialization_format}')
@@ -0,0 +1,80 @@
+import copy
+import json
+import logging
+import logging.config
+import queue
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+
+from src.prometheus_metrics import prometheus_frontend_log_records_dropped
+
+# Record attribute holding structured fields, pass them as log.info('...', extra={FIELDS_ATTRIBUTE: {...}})
+FIELDS_ATTRIBUTE = 'fields'
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    One JSON object per line. Structured fields of a record are merged into it
+    """
+
+    def format(self, record: logging.LogRecord) -> str:
+        result = {
+            'time': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'thread': record.threadName,
+            'message': record.getMessage(),
+        }
+        fields = getattr(record, FIELDS_ATTRIBUTE, None)
+        if fields:
+            result.update(fields)
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            result['exception'] = record.exc_text
+        return json.dumps(result, ensure_ascii=False, default=str)
+
+
+class StructuredQueueHandler(QueueHandler):
+    """
+    Hands records over to a QueueListener thread. Unlike QueueHandler, keeps the message and the exception
+    apart instead of formatting them into one string, and drops records if the queue is full
+    instead of blocking the caller
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Arguments may be mutable objects owned by the caller, so the message is rendered right away
+        record = copy.copy(record)
+        record.msg = record.message = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            prometheus_frontend_log_records_dropped.inc()
+
+
+def configure_logging(config: dict, level: str, queue_size: int = 10_000) -> QueueListener:
+    """
+    Applies a logging.config.dictConfig configuration with the root level overridden,
+    then moves the root handlers behind a queue, so their I/O happens on the listener thread.
+    Handlers attached to other loggers are left in place
+    :return: listener, it must be started and stopped by the caller
+    """
+
+    config = copy.deepcopy(config)
+    config.setdefault('root', {})['level'] = level.upper()
+    logging.config.dictConfig(config)
+
+    root = logging.getLogger()
+    handlers = list(root.handlers)
+    for handler in handlers:
+        root.removeHandler(handler)
+    records: queue.Queue = queue.Queue(maxsize=queue_size)
+    root.addHandler(StructuredQueueHandler(records))
+    return QueueListener(records, *handlers, respect_handler_level=True)
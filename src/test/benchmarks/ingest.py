@@ -0,0 +1,356 @@
+"""
+End-to-end ingest throughput: synthetic updates from src/test/tools/message_generator.py are dispatched through
+the real logging, Prometheus and Kafka handlers, with an in-memory Kafka producer and a local S3 server in place
+of Kafka and MinIO. Run from the repository root:
+    python -m src.test.benchmarks.ingest [--messages 5000] [--mix text --mix photos] [--ack-latency 0.005]
+Every mix runs in a fresh process, so its peak RSS is its own. Media payloads are zero bytes, not real images,
+so image processing and perceptual hashing are not covered
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import multiprocessing
+import resource
+import shutil
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from collections import defaultdict, deque
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Callable, Deque, Dict, List, Optional, Tuple
+
+import yaml
+from aiohttp import web
+from miniopy_async import Minio
+from pyrogram import ContinuePropagation, StopPropagation
+from pyrogram.enums import MessageMediaType
+from pyrogram.types import Message as PyrogramMessage
+
+from src.config import get_configurations
+from src.handlers.kafka_handler import register_kafka_handler
+from src.handlers.logging_handler import register_logging_handler
+from src.handlers.prometheus_handler import register_prometheus_handler
+from src.kafka_producer import AsyncKafkaProducer, Headers
+from src.media import MediaCache, MediaIngestor, MediaUploader
+from src.serializers import get_serializer
+from src.test.fakes import FakeMessage
+from src.test.tools.message_generator import GeneratorConfig, generate_messages
+
+CONFIG_PATH = Path(__file__).parents[3] / 'config.yaml'
+CHUNK_SIZE = 1024 ** 2
+
+# Media mix name -> media weights of the generated updates, None is a text message
+MEDIA_MIXES: Dict[str, Dict[Optional[MessageMediaType], float]] = {
+    'text': {None: 1},
+    'chat': GeneratorConfig().media,
+    'photos': {None: 0.5, MessageMediaType.PHOTO: 0.4, MessageMediaType.STICKER: 0.1},
+    'voice': {None: 0.5, MessageMediaType.VOICE: 0.4, MessageMediaType.VIDEO_NOTE: 0.1},
+    'video': {None: 0.5, MessageMediaType.VIDEO: 0.3, MessageMediaType.ANIMATION: 0.2},
+}
+
+
+class InMemoryProducer:
+    """
+    confluent_kafka Producer stand-in: every message is acknowledged ack_latency seconds after it was produced
+    """
+
+    def __init__(self, ack_latency: float = 0.005, capacity: int = 100_000):
+        self.ack_latency = ack_latency
+        self.capacity = capacity
+        self.delivered = 0
+        self._pending: Deque[Tuple[float, tuple, Callable]] = deque()
+        # Wakes up poll when a message is produced, the way librdkafka wakes it up on a delivery report
+        self._condition = threading.Condition()
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+    def produce(self, topic, key=None, value=None, headers=None, on_delivery=None):
+        with self._condition:
+            if len(self._pending) >= self.capacity:
+                raise BufferError('Local: Queue full')
+            self._pending.append((time.monotonic() + self.ack_latency, FakeMessage((topic, key, value)), on_delivery))
+            self._condition.notify()
+
+    def poll(self, timeout=None):
+        deadline = time.monotonic() + (timeout or 0)
+        with self._condition:
+            while True:
+                now = time.monotonic()
+                if self._pending and self._pending[0][0] <= now:
+                    break
+                if now >= deadline:
+                    return 0
+                next_ack = self._pending[0][0] if self._pending else deadline
+                self._condition.wait(min(deadline, next_ack) - now)
+            acked = []
+            while self._pending and self._pending[0][0] <= now:
+                acked.append(self._pending.popleft())
+        for _, message, on_delivery in acked:
+            self.delivered += 1
+            on_delivery(None, message)
+        return len(acked)
+
+    def flush(self, timeout=None):
+        while len(self._pending) > 0:
+            self.poll(0.1)
+        return 0
+
+
+class LocalS3Server:
+    """
+    Just enough of the S3 API for miniopy_async put_object and stat_object, objects are stored under directory.
+    Runs its own event loop on a thread, so serving requests doesn't compete with the frontend
+    """
+
+    def __init__(self, directory: Path):
+        self.directory = directory
+        self.port: Optional[int] = None
+        self._uploads: Dict[str, Dict[int, Path]] = {}
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name='local-s3', daemon=True)
+        self._runner: Optional[web.AppRunner] = None
+
+    def start(self) -> None:
+        self._thread.start()
+        asyncio.run_coroutine_threadsafe(self._start(), self._loop).result()
+
+    def stop(self) -> None:
+        asyncio.run_coroutine_threadsafe(self._runner.cleanup(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+
+    async def _start(self) -> None:
+        app = web.Application(client_max_size=1024 ** 3)
+        app.router.add_route('*', '/{bucket}/{key:.+}', self._handle_object)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, '127.0.0.1', 0)
+        await site.start()
+        self.port = self._runner.addresses[0][1]
+
+    def _get_path(self, request: web.Request) -> Path:
+        return self.directory / request.match_info['bucket'] / request.match_info['key']
+
+    async def _handle_object(self, request: web.Request) -> web.StreamResponse:
+        path = self._get_path(request)
+        query = request.query
+        if request.method == 'HEAD':
+            if not path.is_file():
+                return web.Response(status=404)
+            return web.Response(headers={
+                'ETag': '"0"',
+                'Content-Length': str(path.stat().st_size),
+                'Last-Modified': 'Mon, 01 Jan 2024 00:00:00 GMT',
+            })
+        if request.method == 'POST' and 'uploads' in query:
+            upload_id = uuid.uuid4().hex
+            self._uploads[upload_id] = {}
+            return self._xml('InitiateMultipartUploadResult', Bucket=request.match_info['bucket'],
+                             Key=request.match_info['key'], UploadId=upload_id)
+        if request.method == 'PUT' and 'uploadId' in query:
+            part = path.with_name(f'{path.name}.{query["uploadId"]}.{query["partNumber"]}')
+            await self._write(request, part)
+            self._uploads[query['uploadId']][int(query['partNumber'])] = part
+            return web.Response(headers={'ETag': f'"{query["partNumber"]}"'})
+        if request.method == 'POST' and 'uploadId' in query:
+            await request.read()
+            parts = self._uploads.pop(query['uploadId'])
+            with open(path, 'wb') as fp:
+                for number in sorted(parts):
+                    with open(parts[number], 'rb') as part_fp:
+                        shutil.copyfileobj(part_fp, fp)
+                    parts[number].unlink()
+            return self._xml('CompleteMultipartUploadResult', Bucket=request.match_info['bucket'],
+                             Key=request.match_info['key'], ETag='"0"')
+        if request.method == 'PUT':
+            await self._write(request, path)
+            return web.Response(headers={'ETag': '"0"'})
+        return web.Response(status=405)
+
+    @staticmethod
+    async def _write(request: web.Request, path: Path) -> None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, 'wb') as fp:
+            async for chunk in request.content.iter_chunked(CHUNK_SIZE):
+                fp.write(chunk)
+
+    @staticmethod
+    def _xml(root: str, **values: str) -> web.Response:
+        body = ''.join(f'<{key}>{value}</{key}>' for key, value in values.items())
+        return web.Response(text=f'<?xml version="1.0" encoding="UTF-8"?><{root}>{body}</{root}>',
+                            content_type='application/xml')
+
+
+class FakeClient:
+    """
+    Pyrogram Client stand-in: dispatches updates to handler groups the way Pyrogram's dispatcher does,
+    and streams zero-filled media of the reported file size
+    """
+
+    def __init__(self, chunk_latency: float = 0.0):
+        self.chunk_latency = chunk_latency
+        self.groups: Dict[int, list] = defaultdict(list)
+
+    def add_handler(self, handler, group: int = 0):
+        self.groups[group].append(handler)
+        self.groups = defaultdict(list, sorted(self.groups.items()))
+
+    async def dispatch(self, message: PyrogramMessage) -> None:
+        for handlers in self.groups.values():
+            for handler in handlers:
+                try:
+                    await handler.callback(self, message)
+                except StopPropagation:
+                    return
+                except ContinuePropagation:
+                    continue
+                break
+
+    async def stream_media(self, media):
+        remaining = media.file_size
+        chunk = bytes(CHUNK_SIZE)
+        while remaining > 0:
+            if self.chunk_latency > 0:
+                await asyncio.sleep(self.chunk_latency)
+            yield chunk[:min(remaining, CHUNK_SIZE)]
+            remaining -= CHUNK_SIZE
+
+
+class TimedKafkaProducer(AsyncKafkaProducer):
+    """
+    Measures the time from dispatch to Kafka acknowledgement. The kafka handler publishes exactly one event
+    per message and keeps order inside a chat, so the oldest pending dispatch of a chat is the one acknowledged
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.dispatched: Dict[str, Deque[float]] = defaultdict(deque)
+        self.latencies: List[float] = []
+
+    async def send(self, topic: str, key: Optional[str], value: bytes, headers: Optional[Headers] = None,
+                   on_enqueued: Optional[Callable[[], None]] = None):
+        result = await super().send(topic, key, value, headers, on_enqueued)
+        self.latencies.append(time.perf_counter() - self.dispatched[key].popleft())
+        return result
+
+
+def get_percentile(values: List[float], percentile: int) -> float:
+    if len(values) < 2:
+        return values[0] if values else 0.0
+    return statistics.quantiles(values, n=100, method='inclusive')[percentile - 1]
+
+
+async def run_pipeline(mix: str, messages: int, ack_latency: float, chunk_latency: float, seed: int) -> dict:
+    with open(CONFIG_PATH) as fp:
+        _, kafka_config, frontend_config = get_configurations(yaml.load(fp, Loader=yaml.FullLoader))
+
+    directory = Path(tempfile.mkdtemp(prefix='ingest-benchmark-'))
+    server = LocalS3Server(directory)
+    server.start()
+    client = FakeClient(chunk_latency=chunk_latency)
+    fake_producer = InMemoryProducer(ack_latency=ack_latency)
+    producer = TimedKafkaProducer({}, producer_factory=lambda config: fake_producer, poll_timeout=0.01)
+    producer.start(asyncio.get_running_loop())
+    minio = Minio(f'127.0.0.1:{server.port}', access_key='benchmark', secret_key='benchmark',
+                  secure=False, region='us-east-1')
+
+    register_logging_handler(client=client, group=-458155)
+    register_prometheus_handler(client=client, group=-458156)
+    ingest_queue = register_kafka_handler(
+        client=client,
+        group=-458157,
+        media_ingestor=MediaIngestor(
+            uploader=MediaUploader(client, minio, frontend_config.media.part_size,
+                                   frontend_config.media.parallel_uploads),
+            cache=MediaCache(minio, frontend_config.media.cache_size, frontend_config.media.cache_check_s3),
+            types=frontend_config.media.types,
+        ),
+        kafka_producer=producer,
+        serializer=get_serializer(kafka_config.messages_format),
+        frontend=frontend_config.name,
+        topic=kafka_config.messages_topic,
+        upload_files=frontend_config.upload_files,
+        ingest_config=frontend_config.ingest,
+    )
+    ingest_queue.start()
+
+    # Every generated message satisfies the contract, so every one of them is published
+    generator_config = GeneratorConfig(seed=seed, media=MEDIA_MIXES[mix], no_username_rate=0)
+    updates = generate_messages(generator_config, messages)
+    dispatch_latencies = []
+    started_at = time.perf_counter()
+    try:
+        for message in updates:
+            dispatched_at = time.perf_counter()
+            producer.dispatched[str(message.chat.id)].append(dispatched_at)
+            await client.dispatch(message)
+            dispatch_latencies.append(time.perf_counter() - dispatched_at)
+        await ingest_queue.stop(timeout=600)
+        elapsed = time.perf_counter() - started_at
+    finally:
+        await producer.stop()
+        await minio.close_session()
+        server.stop()
+        shutil.rmtree(directory, ignore_errors=True)
+
+    return {
+        'mix': mix,
+        'messages': messages,
+        'published': len(producer.latencies),
+        'messages_per_second': messages / elapsed,
+        'dispatch_p50_ms': get_percentile(dispatch_latencies, 50) * 1000,
+        'dispatch_p99_ms': get_percentile(dispatch_latencies, 99) * 1000,
+        'ack_p50_ms': get_percentile(producer.latencies, 50) * 1000,
+        'ack_p99_ms': get_percentile(producer.latencies, 99) * 1000,
+        # Kilobytes on Linux
+        'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }
+
+
+def run_mix(mix: str, messages: int, ack_latency: float = 0.005, chunk_latency: float = 0.0, seed: int = 0) -> dict:
+    logging.basicConfig()
+    return asyncio.run(run_pipeline(mix, messages, ack_latency, chunk_latency, seed))
+
+
+def print_results(results: List[dict]) -> None:
+    print(f'{"mix":<10}{"msg/s":>10}{"dispatch p50":>14}{"p99":>10}{"ack p50":>10}{"p99":>10}{"peak RSS":>10}')
+    for it in results:
+        print(f'{it["mix"]:<10}{it["messages_per_second"]:>10.0f}'
+              f'{it["dispatch_p50_ms"]:>12.2f}ms{it["dispatch_p99_ms"]:>8.2f}ms'
+              f'{it["ack_p50_ms"]:>8.1f}ms{it["ack_p99_ms"]:>8.1f}ms{it["peak_rss_mb"]:>8.0f}MB')
+
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description='End-to-end ingest throughput benchmark')
+    parser.add_argument('--messages', type=int, default=5000)
+    parser.add_argument('--mix', action='append', choices=list(MEDIA_MIXES), help='Defaults to every mix')
+    parser.add_argument('--ack-latency', type=float, default=0.005, help='Seconds until Kafka acknowledges')
+    parser.add_argument('--chunk-latency', type=float, default=0.0, help='Seconds per 1MiB chunk from Telegram')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', type=Path, help='Store results as JSON')
+    arguments = parser.parse_args(argv)
+
+    results = []
+    context = multiprocessing.get_context('spawn')
+    for mix in arguments.mix or MEDIA_MIXES:
+        with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+            results.append(executor.submit(
+                run_mix, mix, arguments.messages, arguments.ack_latency, arguments.chunk_latency, arguments.seed,
+            ).result())
+    print_results(results)
+    if arguments.output is not None:
+        with open(arguments.output, 'w') as fp:
+            json.dump(results, fp, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,50 @@
+"""
+Compares event encoders on the fixtures from src/test/messages.py
+Run from the repository root: python -m src.test.benchmarks.serialization_benchmark
+"""
+
+import timeit
+
+from pydantic import ValidationError
+
+from src.handlers.kafka_handler import pyrogram_message_to_new_message
+from src.new_message import NewMessage
+from src.serializers import JsonSerializer, MsgpackSerializer
+from src.test import messages
+
+ITERATIONS = 20_000
+
+
+def get_fixture_events() -> list[NewMessage]:
+    events = []
+    for name, value in vars(messages).items():
+        if not isinstance(value, messages.Message):
+            continue
+        try:
+            events.append(pyrogram_message_to_new_message(value, 'telegram'))
+        except ValidationError:
+            print(f'Skipping fixture {name}: it does not satisfy the NewMessage contract')
+    return events
+
+
+def main():
+    events = get_fixture_events()
+    encoders = {
+        'model_dump_json': lambda value: value.model_dump_json().encode('utf-8'),
+        'json': JsonSerializer().serialize,
+    }
+    try:
+        encoders['msgpack'] = MsgpackSerializer().serialize
+    except RuntimeError as e:
+        print(f'Skipping msgpack: {e}')
+
+    print(f'{"encoder":<16}{"us/event":>10}{"bytes/event":>14}')
+    for name, encode in encoders.items():
+        seconds = timeit.timeit(lambda: [encode(event) for event in events], number=ITERATIONS // len(events))
+        per_event = seconds / (ITERATIONS // len(events) * len(events)) * 1_000_000
+        size = sum(len(encode(event)) for event in events) / len(events)
+        print(f'{name:<16}{per_event:>10.2f}{size:>14.1f}')
+
+
+if __name__ == '__main__':
+    main()
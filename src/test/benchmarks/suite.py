@@ -0,0 +1,168 @@
+"""
+Micro-benchmarks of the per-update hot paths on the fixtures from src/test/messages.py
+Run from the repository root:
+    python -m src.test.benchmarks.suite run [--output src/test/benchmarks/baseline.json]
+    python -m src.test.benchmarks.suite compare [--baseline src/test/benchmarks/baseline.json] [--threshold 0.25]
+Baselines are only comparable on the machine and Python version they were recorded with,
+so none is committed: record one with run before the first compare
+"""
+
+import argparse
+import json
+import logging
+import platform
+import sys
+import timeit
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Callable, Dict, List, Tuple
+
+from pydantic import ValidationError
+
+from src.handlers.kafka_handler import pyrogram_chat_to_chat, pyrogram_user_to_user, snapshot_to_new_message
+from src.handlers.logging_handler import get_message_fields
+from src.message_snapshot import MessageSnapshot
+from src.pyrogram_utils import get_action_info, get_media_type
+from src.serializers import JsonSerializer
+from src.structured_logging import FIELDS_ATTRIBUTE, JsonFormatter
+from src.test import messages
+
+DEFAULT_BASELINE = Path(__file__).with_name('baseline.json')
+DEFAULT_THRESHOLD = 0.25
+DEFAULT_REPEAT = 5
+
+
+def get_fixtures() -> List[messages.Message]:
+    return [value for value in vars(messages).values() if isinstance(value, messages.Message)]
+
+
+def get_benchmarks() -> Dict[str, Tuple[Callable[[], object], int]]:
+    """
+    :return: benchmark name -> function running it once over the fixtures, and the number of fixtures it covers
+    """
+
+    fixtures = get_fixtures()
+    snapshots = [MessageSnapshot(it) for it in fixtures]
+    # Fixtures breaking the NewMessage contract only cover the paths that don't validate it
+    valid_snapshots = []
+    for snapshot in snapshots:
+        try:
+            snapshot_to_new_message(snapshot, 'telegram')
+            valid_snapshots.append(snapshot)
+        except ValidationError:
+            pass
+    events = [snapshot_to_new_message(it, 'telegram') for it in valid_snapshots]
+    serializer = JsonSerializer()
+    formatter = JsonFormatter()
+    records = []
+    for snapshot in snapshots:
+        record = logging.LogRecord('benchmark', logging.INFO, __file__, 0, 'Incoming message', None, None)
+        setattr(record, FIELDS_ATTRIBUTE, get_message_fields(snapshot))
+        records.append(record)
+
+    return {
+        'pyrogram_chat_to_chat': (lambda: [pyrogram_chat_to_chat(it.chat) for it in fixtures], len(fixtures)),
+        'pyrogram_user_to_user': (lambda: [pyrogram_user_to_user(it.from_user) for it in fixtures], len(fixtures)),
+        'get_media_type': (lambda: [get_media_type(it) for it in fixtures], len(fixtures)),
+        'get_action_info': (lambda: [get_action_info(it) for it in fixtures], len(fixtures)),
+        'message_snapshot': (lambda: [MessageSnapshot(it) for it in fixtures], len(fixtures)),
+        'snapshot_to_new_message': (
+            lambda: [snapshot_to_new_message(it, 'telegram') for it in valid_snapshots], len(valid_snapshots)
+        ),
+        'new_message_model_dump_json': (lambda: [it.model_dump_json() for it in events], len(events)),
+        'json_serializer': (lambda: [serializer.serialize(it) for it in events], len(events)),
+        'logging_message_fields': (lambda: [get_message_fields(it) for it in snapshots], len(snapshots)),
+        'logging_json_formatter': (lambda: [formatter.format(it) for it in records], len(records)),
+    }
+
+
+def run(repeat: int = DEFAULT_REPEAT, number: int = 0) -> Dict[str, float]:
+    """
+    :param number: calls per measurement, picked so that a measurement takes at least 0.2s if 0
+    :return: benchmark name -> best nanoseconds per fixture over the repeats
+    """
+
+    results = {}
+    for name, (function, size) in get_benchmarks().items():
+        timer = timeit.Timer(function)
+        calls = number or timer.autorange()[0]
+        best = min(timer.repeat(repeat=repeat, number=calls))
+        results[name] = best / (calls * size) * 1e9
+    return results
+
+
+def get_metadata() -> dict:
+    return {
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'machine': platform.machine(),
+        'system': platform.system(),
+        'created': datetime.now(timezone.utc).isoformat(),
+    }
+
+
+def compare(baseline: Dict[str, float],
+            current: Dict[str, float],
+            threshold: float = DEFAULT_THRESHOLD,
+            ) -> List[str]:
+    """
+    :return: names of benchmarks slower than the baseline by more than threshold (0.25 is 25%)
+    """
+
+    return [
+        name for name, value in current.items()
+        if name in baseline and value > baseline[name] * (1 + threshold)
+    ]
+
+
+def print_results(current: Dict[str, float], baseline: Dict[str, float]) -> None:
+    print(f'{"benchmark":<36}{"ns/op":>12}{"baseline":>12}{"change":>10}')
+    for name, value in current.items():
+        if name in baseline:
+            print(f'{name:<36}{value:>12.0f}{baseline[name]:>12.0f}{value / baseline[name] - 1:>+10.1%}')
+        else:
+            print(f'{name:<36}{value:>12.0f}{"-":>12}{"new":>10}')
+
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description='Hot path micro-benchmarks')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    run_parser = subparsers.add_parser('run', help='Run benchmarks and store them as a baseline')
+    run_parser.add_argument('--output', type=Path, default=DEFAULT_BASELINE)
+    run_parser.add_argument('--repeat', type=int, default=DEFAULT_REPEAT)
+    compare_parser = subparsers.add_parser('compare', help='Run benchmarks and fail on regressions over a baseline')
+    compare_parser.add_argument('--baseline', type=Path, default=DEFAULT_BASELINE)
+    compare_parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD)
+    compare_parser.add_argument('--repeat', type=int, default=DEFAULT_REPEAT)
+    arguments = parser.parse_args(argv)
+
+    if arguments.command == 'run':
+        results = run(repeat=arguments.repeat)
+        print_results(results, {})
+        with open(arguments.output, 'w') as fp:
+            json.dump({'metadata': get_metadata(), 'results': results}, fp, indent=2)
+        print(f'Baseline written to {arguments.output}')
+        return 0
+
+    if not arguments.baseline.exists():
+        print(f'No baseline at {arguments.baseline}, record one first with: '
+              f'python -m src.test.benchmarks.suite run --output {arguments.baseline}', file=sys.stderr)
+        return 2
+    with open(arguments.baseline) as fp:
+        stored = json.load(fp)
+    metadata = get_metadata()
+    for key in ('python', 'implementation', 'machine'):
+        if stored['metadata'].get(key) != metadata[key]:
+            print(f'Warning: baseline was recorded with {key} {stored["metadata"].get(key)}, '
+                  f'this run uses {metadata[key]}')
+    results = run(repeat=arguments.repeat)
+    print_results(results, stored['results'])
+    regressions = compare(stored['results'], results, arguments.threshold)
+    if regressions:
+        print(f'Regressions over {arguments.threshold:.0%}: {", ".join(regressions)}')
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,58 @@
+import asyncio
+import json
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+from src.test.benchmarks import ingest, suite
+
+
+class CompareTests(unittest.TestCase):
+    def test_regression_over_threshold(self):
+        baseline = {'fast': 100.0, 'slow': 100.0, 'removed': 100.0}
+        current = {'fast': 90.0, 'slow': 130.0, 'added': 1000.0}
+
+        self.assertEqual(['slow'], suite.compare(baseline, current, threshold=0.25))
+        self.assertEqual([], suite.compare(baseline, current, threshold=0.5))
+
+
+class SuiteTests(unittest.TestCase):
+    def test_every_benchmark_runs(self):
+        results = suite.run(repeat=1, number=1)
+
+        self.assertEqual(set(suite.get_benchmarks()), set(results))
+        self.assertTrue(all(value > 0 for value in results.values()))
+
+    def test_compare_command_fails_on_regression(self):
+        with tempfile.TemporaryDirectory() as directory:
+            baseline = Path(directory) / 'baseline.json'
+            with mock.patch.object(suite, 'run', return_value={'fast': 100.0}):
+                self.assertEqual(0, suite.main(['run', '--output', str(baseline)]))
+            stored = json.loads(baseline.read_text())
+            self.assertEqual({'fast': 100.0}, stored['results'])
+
+            with mock.patch.object(suite, 'run', return_value={'fast': 200.0}):
+                self.assertEqual(1, suite.main(['compare', '--baseline', str(baseline)]))
+            with mock.patch.object(suite, 'run', return_value={'fast': 110.0}):
+                self.assertEqual(0, suite.main(['compare', '--baseline', str(baseline)]))
+
+    def test_compare_command_without_baseline(self):
+        with tempfile.TemporaryDirectory() as directory, mock.patch.object(suite, 'run') as run:
+            self.assertEqual(2, suite.main(['compare', '--baseline', str(Path(directory) / 'missing.json')]))
+        run.assert_not_called()
+
+
+class IngestBenchmarkTests(unittest.TestCase):
+    def test_every_message_is_published(self):
+        for mix in ('text', 'photos'):
+            with self.subTest(mix=mix):
+                result = asyncio.run(ingest.run_pipeline(mix, messages=50, ack_latency=0, chunk_latency=0, seed=1))
+
+                self.assertEqual(50, result['published'])
+                self.assertGreater(result['messages_per_second'], 0)
+                self.assertLessEqual(result['ack_p50_ms'], result['ack_p99_ms'])
+
+
+if __name__ == '__main__':
+    unittest.main()
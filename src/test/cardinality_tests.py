@@ -0,0 +1,104 @@
+import base64
+import os
+import tempfile
+import unittest
+
+from src.cardinality import CardinalitySnapshots, ExactCounter, HyperLogLog, create_cardinality_counter
+from src.config import CardinalityConfig, CardinalityMode
+
+
+class HyperLogLogTests(unittest.TestCase):
+    def test_estimate_within_error_bounds(self):
+        for size in (10, 1000, 100_000):
+            with self.subTest(size=size):
+                sketch = HyperLogLog(precision=12)
+                # Sequential and negative ids, like Telegram chats
+                for value in range(-size, 0):
+                    sketch.add(value)
+
+                # Three standard errors
+                self.assertAlmostEqual(size, sketch.count(), delta=max(1.0, size * 3 * 1.04 / 64))
+
+    def test_repeated_values_do_not_change_count(self):
+        sketch = HyperLogLog(precision=10)
+        for value in range(500):
+            sketch.add(value)
+        count = sketch.count()
+
+        self.assertFalse(any(sketch.add(value) for value in range(500)))
+        self.assertEqual(count, sketch.count())
+
+    def test_memory_is_fixed(self):
+        sketch = HyperLogLog(precision=10)
+        for value in range(10_000):
+            sketch.add(value)
+
+        self.assertEqual(1024, len(base64.b64decode(sketch.dump()['registers'])))
+
+    def test_dump_and_load(self):
+        first, second = HyperLogLog(precision=10), HyperLogLog(precision=10)
+        for value in range(1000):
+            first.add(value)
+        for value in range(500, 1500):
+            second.add(value)
+
+        restored = HyperLogLog(precision=10)
+        restored.load(first.dump())
+        self.assertEqual(first.count(), restored.count())
+        restored.load(second.dump())
+        self.assertAlmostEqual(1500, restored.count(), delta=1500 * 3 * 1.04 / 32)
+
+    def test_other_precision_is_ignored(self):
+        source = HyperLogLog(precision=10)
+        source.add(1)
+        sketch = HyperLogLog(precision=12)
+        sketch.load(source.dump())
+
+        self.assertEqual(0, sketch.count())
+
+    def test_precision_is_bounded(self):
+        with self.assertRaises(ValueError):
+            HyperLogLog(precision=3)
+
+
+class ExactCounterTests(unittest.TestCase):
+    def test_counts_distinct_values(self):
+        counter = ExactCounter()
+
+        self.assertTrue(counter.add(1))
+        self.assertFalse(counter.add(1))
+        self.assertTrue(counter.add(-1))
+        self.assertEqual(2, counter.count())
+
+    def test_mode_selects_counter(self):
+        self.assertIsInstance(create_cardinality_counter(CardinalityConfig(mode=CardinalityMode.EXACT)), ExactCounter)
+        self.assertIsInstance(create_cardinality_counter(CardinalityConfig()), HyperLogLog)
+
+
+class CardinalitySnapshotsTests(unittest.IsolatedAsyncioTestCase):
+    async def test_counts_survive_restart(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'cardinality.json')
+            users, chats = HyperLogLog(precision=10), ExactCounter()
+            for value in range(300):
+                users.add(value)
+                chats.add(value % 7)
+            await CardinalitySnapshots({'users': users, 'chats': chats}, path).save()
+
+            restored_users, restored_chats = HyperLogLog(precision=10), ExactCounter()
+            CardinalitySnapshots({'users': restored_users, 'chats': restored_chats}, path).load()
+
+            self.assertEqual(users.count(), restored_users.count())
+            self.assertEqual(7, restored_chats.count())
+            self.assertFalse(os.path.exists(f'{path}.tmp'))
+
+    def test_missing_snapshot_is_ignored(self):
+        with tempfile.TemporaryDirectory() as directory:
+            counter = ExactCounter()
+            CardinalitySnapshots({'users': counter}, os.path.join(directory, 'missing.json')).load()
+
+            self.assertEqual(0, counter.count())
+
+
+if __name__ == '__main__':
+    unittest.main()
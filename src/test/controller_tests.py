@@ -0,0 +1,87 @@
+import asyncio
+import json
+import unittest
+from types import SimpleNamespace
+
+from pydantic import ValidationError
+from pyrogram.errors import FloodWait
+
+from src.controller import Controller, SendTextMessagesRequest, MAX_BATCH_SIZE
+from src.send_scheduler import SendScheduler
+from src.test.fakes import make_scheduler_config
+
+
+class FakePyrogramClient:
+    def __init__(self):
+        self.sent: list[tuple[int, str]] = []
+        self._ids = iter(range(100, 1000))
+
+    async def send_message(self, chat_id: int, text: str, reply_to_message_id=None):
+        # Lets other sends run in between
+        await asyncio.sleep(0)
+        if text == 'flood':
+            raise FloodWait(value=120)
+        if text == 'broken':
+            raise RuntimeError('Boom')
+        self.sent.append((chat_id, text))
+        return SimpleNamespace(id=next(self._ids))
+
+
+def make_request(*messages: dict) -> SendTextMessagesRequest:
+    return SendTextMessagesRequest(messages=list(messages))
+
+
+class BatchSendTests(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.client = FakePyrogramClient()
+        self.scheduler = SendScheduler(make_scheduler_config(max_pending=4, max_flood_wait=10.0))
+        self.scheduler.start()
+        self.controller = Controller(pyrogram_client=self.client, scheduler=self.scheduler)
+
+    async def asyncTearDown(self):
+        await self.scheduler.stop()
+
+    async def send(self, request: SendTextMessagesRequest) -> list[dict]:
+        response = await self.controller.send_text_messages(request)
+        self.assertEqual(200, response.status_code)
+        return json.loads(response.body)['results']
+
+    async def test_chat_order_is_kept(self):
+        results = await self.send(make_request(
+            {'chat_id': '1', 'text': 'first'},
+            {'chat_id': '-2', 'text': 'other'},
+            {'chat_id': '1', 'text': 'second'},
+            {'chat_id': '1', 'text': 'third'},
+        ))
+
+        self.assertEqual([(1, 'first'), (1, 'second'), (1, 'third')], [it for it in self.client.sent if it[0] == 1])
+        self.assertEqual(4, len({it['message_id'] for it in results}))
+
+    async def test_results_are_per_message(self):
+        with self.assertLogs('src', level='WARNING'):
+            results = await self.send(make_request(
+                {'chat_id': '1', 'text': 'flood'},
+                {'chat_id': 'one', 'text': 'invalid'},
+                {'chat_id': '2', 'text': 'broken'},
+                {'chat_id': '3', 'text': 'sent'},
+            ))
+
+        self.assertEqual({'error_code': 'FLOOD_WAIT', 'retry_after': 120}, {
+            key: value for key, value in results[0].items() if key != 'error_message'
+        })
+        self.assertEqual('INVALID_ID', results[1]['error_code'])
+        self.assertEqual('UNKNOWN_ERROR', results[2]['error_code'])
+        self.assertEqual({'message_id'}, results[3].keys())
+        self.assertEqual([(3, 'sent')], self.client.sent)
+
+    async def test_messages_over_queue_capacity_are_rejected(self):
+        results = await self.send(make_request(*({'chat_id': '1', 'text': str(it)} for it in range(6))))
+
+        self.assertEqual([None] * 4 + ['QUEUE_FULL'] * 2, [it.get('error_code') for it in results])
+        self.assertEqual([(1, str(it)) for it in range(4)], self.client.sent)
+
+    def test_batch_size_is_bounded(self):
+        with self.assertRaises(ValidationError):
+            make_request()
+        with self.assertRaises(ValidationError):
+            make_request(*({'chat_id': '1', 'text': 'text'} for _ in range(MAX_BATCH_SIZE + 1)))
@@ -0,0 +1,82 @@
+import threading
+
+from prometheus_client import CollectorRegistry, REGISTRY
+
+from src.config import SendSchedulerConfig
+
+
+class FakeClient:
+    """
+    Collects handlers registered on a Pyrogram client, in registration order
+    """
+
+    def __init__(self):
+        self.handlers = []
+
+    def add_handler(self, handler, group=0):
+        self.handlers.append(handler)
+
+
+class FakeMessage(tuple):
+    """
+    Delivered (topic, key, value), with the confluent_kafka.Message accessors the producer reads
+    """
+
+    def topic(self):
+        return self[0]
+
+    def partition(self):
+        return 0
+
+    def latency(self):
+        return 0.001
+
+
+class FakeProducer:
+    """
+    confluent_kafka.Producer that acknowledges every message on the next poll
+    """
+
+    def __init__(self, capacity: int = 10, error=None):
+        self.capacity = capacity
+        self.error = error
+        self.pending = []
+        self.delivered = []
+        self.lock = threading.Lock()
+
+    def produce(self, topic, key=None, value=None, headers=None, on_delivery=None):
+        with self.lock:
+            if len(self.pending) >= self.capacity:
+                raise BufferError('Local: Queue full')
+            self.pending.append((topic, key, value, on_delivery))
+
+    def poll(self, timeout=None):
+        with self.lock:
+            pending, self.pending = self.pending, []
+        for topic, key, value, on_delivery in pending:
+            self.delivered.append((topic, key, value))
+            on_delivery(self.error, FakeMessage((topic, key, value)))
+        return len(pending)
+
+    def flush(self, timeout=None):
+        self.poll()
+        return 0
+
+
+def make_scheduler_config(**overrides) -> SendSchedulerConfig:
+    """
+    Limits high enough that the scheduler never makes a test wait, unless overridden
+    """
+
+    values = dict(global_rate=1000.0, global_burst=1000, private_rate=1000.0, private_burst=1000,
+                  group_rate=1000.0, group_burst=1000)
+    values.update(overrides)
+    return SendSchedulerConfig(**values)
+
+
+def get_sample(name: str, registry: CollectorRegistry = REGISTRY, **labels) -> float:
+    """
+    :return: the sample value, 0 if nothing was observed yet
+    """
+
+    return registry.get_sample_value(name, labels) or 0.0
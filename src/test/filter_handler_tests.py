@@ -0,0 +1,90 @@
+import asyncio
+import copy
+import unittest
+
+import pyrogram
+from pyrogram.enums import ChatType, MessageMediaType
+
+from src.config import FilterConfig, get_filter_config
+from src.handlers.filter_handler import FilterEngine, register_filter_handler
+from src.test.fakes import FakeClient
+from src.test.messages import new_message, new_message_picture
+
+CHAT_ID = new_message.chat.id
+
+
+class FilterEngineTests(unittest.TestCase):
+    def test_chat_outside_whitelist_is_rejected(self):
+        engine = FilterEngine(FilterConfig(whitelist=[-1]))
+
+        self.assertIsNotNone(engine.reject(new_message))
+
+    def test_message_without_chat_is_rejected(self):
+        engine = FilterEngine(FilterConfig(whitelist=[CHAT_ID]))
+
+        self.assertIsNotNone(engine.reject(pyrogram.types.Message(id=1)))
+
+    def test_everything_is_accepted_by_default(self):
+        engine = FilterEngine(FilterConfig(whitelist=[CHAT_ID]))
+
+        self.assertIsNone(engine.reject(new_message))
+        self.assertIsNone(engine.reject(new_message_picture))
+
+    def test_chat_type(self):
+        engine = FilterEngine(FilterConfig(whitelist=[CHAT_ID], chat_types=[ChatType.SUPERGROUP]))
+
+        self.assertIsNotNone(engine.reject(new_message))
+
+    def test_media_type(self):
+        engine = FilterEngine(FilterConfig(whitelist=[CHAT_ID], deny_media_types=[MessageMediaType.PHOTO]))
+
+        self.assertIsNone(engine.reject(new_message))
+        self.assertIsNotNone(engine.reject(new_message_picture))
+
+    def test_bots(self):
+        message = copy.copy(new_message)
+        message.from_user = copy.copy(new_message.from_user)
+        message.from_user.is_bot = True
+        engine = FilterEngine(FilterConfig(whitelist=[CHAT_ID], allow_bots=False))
+
+        self.assertIsNone(engine.reject(new_message))
+        self.assertIsNotNone(engine.reject(message))
+
+    def test_reload(self):
+        engine = FilterEngine(FilterConfig(whitelist=[-1]))
+        engine.reload(FilterConfig(whitelist=[CHAT_ID]))
+
+        self.assertIsNone(engine.reject(new_message))
+
+
+class GetFilterConfigTests(unittest.TestCase):
+    def test_names_are_parsed(self):
+        config = get_filter_config({'frontend': {
+            'chat': {'whitelist': [-1]},
+            'filter': {'chat-types': ['supergroup'], 'deny-media-types': ['video-note'], 'allow-bots': False},
+        }})
+
+        self.assertEqual([ChatType.SUPERGROUP], config.chat_types)
+        self.assertEqual([MessageMediaType.VIDEO_NOTE], config.deny_media_types)
+        self.assertFalse(config.allow_bots)
+
+
+class FilterHandlerTests(unittest.TestCase):
+    def setUp(self):
+        self.client = FakeClient()
+
+    def call_handler(self, engine: FilterEngine, message):
+        register_filter_handler(self.client, engine, group=-1)
+        handler = self.client.handlers[0]
+        asyncio.run(handler.callback(self.client, message))
+
+    def test_rejected_update_stops_propagation(self):
+        with self.assertRaises(pyrogram.StopPropagation):
+            self.call_handler(FilterEngine(FilterConfig(whitelist=[-1])), new_message)
+
+    def test_accepted_update_propagates(self):
+        self.call_handler(FilterEngine(FilterConfig(whitelist=[CHAT_ID])), new_message)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,73 @@
+import asyncio
+import unittest
+
+from prometheus_client import CollectorRegistry
+
+from src.config import FilterConfig, IngestConfig, LatencyConfig
+from src.handlers.filter_handler import FilterEngine, register_filter_handler
+from src.handlers.kafka_handler import register_kafka_handler
+from src.ingest_latency import IngestLatency, get_latency_labels
+from src.kafka_producer import AsyncKafkaProducer
+from src.serializers import JsonSerializer
+from src.test.fakes import FakeClient, FakeProducer, get_sample
+from src.test.messages import new_message, new_message_picture
+
+
+class IngestLatencyTests(unittest.TestCase):
+    def test_labels(self):
+        self.assertEqual(('none', 'group'), get_latency_labels(new_message))
+        self.assertEqual(('photo', new_message_picture.chat.type.value), get_latency_labels(new_message_picture))
+
+    def test_buckets_come_from_config(self):
+        registry = CollectorRegistry()
+        latency = IngestLatency(LatencyConfig(stage_buckets=[0.1, 0.3], end_to_end_buckets=[5.0]), registry)
+
+        latency.observe('conversion', ('none', 'group'), 0.2)
+        latency.observe('conversion', ('none', 'group'), 0.2)
+        latency.observe_end_to_end(('none', 'group'), 1.0)
+
+        labels = {'stage': 'conversion', 'media_type': 'none', 'chat_type': 'group'}
+        self.assertEqual(0, registry.get_sample_value('frontend_ingest_stage_seconds_bucket', {**labels, 'le': '0.1'}))
+        self.assertEqual(2, registry.get_sample_value('frontend_ingest_stage_seconds_bucket', {**labels, 'le': '0.3'}))
+        self.assertEqual(1, registry.get_sample_value(
+            'frontend_ingest_end_to_end_seconds_bucket', {'media_type': 'none', 'chat_type': 'group', 'le': '5.0'}
+        ))
+
+
+class HandlerLatencyTests(unittest.IsolatedAsyncioTestCase):
+    async def test_every_stage_of_a_text_message_is_observed(self):
+        registry = CollectorRegistry()
+        latency = IngestLatency(LatencyConfig(), registry)
+        client = FakeClient()
+        producer = AsyncKafkaProducer({}, producer_factory=lambda config: FakeProducer(), poll_timeout=0.01)
+        producer.start(asyncio.get_running_loop())
+        register_filter_handler(client, FilterEngine(FilterConfig(whitelist=[new_message.chat.id])), latency=latency)
+        ingest_queue = register_kafka_handler(
+            client=client,
+            group=0,
+            media_ingestor=None,
+            kafka_producer=producer,
+            serializer=JsonSerializer(),
+            frontend='telegram',
+            topic='topic',
+            upload_files=False,
+            ingest_config=IngestConfig(lanes=1),
+            latency=latency,
+        )
+        ingest_queue.start()
+        try:
+            for handler in client.handlers:
+                await handler.callback(client, new_message)
+            await ingest_queue.stop(timeout=1)
+        finally:
+            await producer.stop()
+
+        for stage in ('filter', 'conversion', 'kafka_enqueue', 'kafka_ack'):
+            self.assertEqual(1, get_sample('frontend_ingest_stage_seconds_count', registry,
+                                          stage=stage, media_type='none', chat_type='group'), stage)
+        self.assertEqual(1, get_sample('frontend_ingest_end_to_end_seconds_count', registry,
+                                      media_type='none', chat_type='group'))
+
+
+if __name__ == '__main__':
+    unittest.main()
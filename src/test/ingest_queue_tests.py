@@ -0,0 +1,168 @@
+import asyncio
+import gc
+import unittest
+
+from pyrogram.enums import ChatType
+from pyrogram.types import Message, Chat
+
+from src.config import OverflowPolicy
+from src.ingest_queue import IngestQueue, IngestJob, get_lane_index
+from src.test.messages import new_message, new_message_picture
+
+
+def make_message(message_id: int, chat_id: int) -> Message:
+    return Message(id=message_id, chat=Chat(id=chat_id, type=ChatType.GROUP))
+
+
+class IngestQueueTests(unittest.IsolatedAsyncioTestCase):
+    async def test_jobs_are_processed_by_workers(self):
+        processed: list[IngestJob] = []
+
+        async def processor(job: IngestJob):
+            processed.append(job)
+
+        queue = IngestQueue(processor, max_size=10, lanes=2)
+        queue.start()
+        await queue.put(new_message)
+        await queue.put(new_message_picture)
+        await queue.stop()
+
+        self.assertEqual({new_message.id, new_message_picture.id}, {job.snapshot.id for job in processed})
+
+    async def test_processor_error_does_not_kill_worker(self):
+        processed: list[IngestJob] = []
+
+        async def processor(job: IngestJob):
+            if job.snapshot.id == new_message.id:
+                raise RuntimeError('Boom')
+            processed.append(job)
+
+        queue = IngestQueue(processor, max_size=10, lanes=1)
+        queue.start()
+        with self.assertLogs(level='ERROR'):
+            await queue.put(new_message)
+            await queue.put(new_message_picture)
+            await queue.stop()
+
+        self.assertEqual([new_message_picture.id], [job.snapshot.id for job in processed])
+
+    async def test_job_keeps_only_snapshot_and_media(self):
+        message = make_message(1, chat_id=-100500)
+        message.photo = new_message_picture.photo
+        message.media = new_message_picture.media
+        queue = IngestQueue(None, max_size=1, lanes=1)
+        await queue.put(message)
+        job = await queue.get_lane(-100500).queue.get()
+
+        self.assertIs(message.photo, job.media)
+        self.assertEqual(1, job.snapshot.id)
+        self.assertNotIn(message, gc.get_referents(job))
+        self.assertNotIn(message, gc.get_referents(job.snapshot))
+
+    async def test_drop_message_policy(self):
+        queue = IngestQueue(None, max_size=1, lanes=1, overflow_policy=OverflowPolicy.DROP_MESSAGE)
+
+        self.assertTrue(await queue.put(new_message))
+        with self.assertLogs(level='WARNING'):
+            self.assertFalse(await queue.put(new_message))
+        self.assertEqual(1, queue.qsize())
+
+    async def test_drop_media_policy_skips_media_of_overflowing_jobs(self):
+        release = asyncio.Event()
+        processed: list[IngestJob] = []
+
+        async def processor(job: IngestJob):
+            await release.wait()
+            processed.append(job)
+
+        queue = IngestQueue(processor, max_size=1, lanes=1, overflow_policy=OverflowPolicy.DROP_MEDIA)
+        queue.start()
+        await queue.put(new_message_picture)
+        await asyncio.sleep(0)
+        await queue.put(new_message_picture)
+        overflowing = asyncio.create_task(queue.put(new_message_picture))
+        await asyncio.sleep(0)
+        release.set()
+        await overflowing
+        await queue.stop()
+
+        self.assertEqual([False, False, True], [job.skip_media for job in processed])
+        self.assertIsNone(processed[-1].media)
+
+    async def test_drop_media_policy_never_blocks(self):
+        queue = IngestQueue(None, max_size=1, lanes=1, overflow_policy=OverflowPolicy.DROP_MEDIA)
+
+        # Nothing drains the lane: one job as is, one without media, then messages are dropped
+        self.assertTrue(await asyncio.wait_for(queue.put(new_message_picture), timeout=0.1))
+        self.assertTrue(await asyncio.wait_for(queue.put(new_message_picture), timeout=0.1))
+        with self.assertLogs(level='WARNING'):
+            self.assertFalse(await asyncio.wait_for(queue.put(new_message), timeout=0.1))
+        self.assertEqual(2, queue.qsize())
+
+    async def test_detached_tasks_are_bounded_per_lane(self):
+        release = asyncio.Event()
+        queue = IngestQueue(None, max_size=1, lanes=1, max_in_flight=2)
+
+        tasks = [await queue.detach(1, release.wait()) for _ in range(2)]
+        third = asyncio.create_task(queue.detach(1, release.wait()))
+        await asyncio.sleep(0.01)
+        self.assertFalse(third.done())
+
+        release.set()
+        tasks.append(await asyncio.wait_for(third, timeout=1))
+        await queue.stop(timeout=1)
+        self.assertTrue(all(task.done() for task in tasks))
+
+    async def test_messages_of_one_chat_are_processed_in_order(self):
+        processed: list[int] = []
+
+        async def processor(job: IngestJob):
+            await asyncio.sleep(0.001 * (job.snapshot.id % 3))
+            processed.append(job.snapshot.id)
+
+        queue = IngestQueue(processor, max_size=100, lanes=4)
+        queue.start()
+        for message_id in range(20):
+            await queue.put(make_message(message_id, chat_id=-100500))
+        await queue.stop()
+
+        self.assertEqual(list(range(20)), processed)
+
+    async def test_slow_chat_does_not_block_other_lanes(self):
+        slow_chat_id = -1
+        fast_chat_id = next(i for i in range(-2, -100, -1) if get_lane_index(i, 2) != get_lane_index(slow_chat_id, 2))
+        release = asyncio.Event()
+        processed: list[int] = []
+
+        async def processor(job: IngestJob):
+            if job.snapshot.chat.id == slow_chat_id:
+                await release.wait()
+            processed.append(job.snapshot.chat.id)
+
+        queue = IngestQueue(processor, max_size=10, lanes=2)
+        queue.start()
+        await queue.put(make_message(1, slow_chat_id))
+        await queue.put(make_message(2, fast_chat_id))
+        await asyncio.sleep(0.01)
+        self.assertEqual([fast_chat_id], processed)
+        release.set()
+        await queue.stop()
+
+        self.assertEqual([fast_chat_id, slow_chat_id], processed)
+
+
+class GetLaneIndexTests(unittest.TestCase):
+    def test_lane_is_stable_and_in_range(self):
+        for chat_id in (-1001234567890, -1, 0, 1, 5267243):
+            lane = get_lane_index(chat_id, 16)
+            self.assertEqual(lane, get_lane_index(chat_id, 16))
+            self.assertTrue(0 <= lane < 16)
+
+    def test_sequential_chat_ids_are_spread(self):
+        lanes = {get_lane_index(chat_id, 8) for chat_id in range(-100, -60)}
+
+        self.assertEqual(8, len(lanes))
+
+
+if __name__ == '__main__':
+    unittest.main()
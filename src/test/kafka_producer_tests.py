@@ -0,0 +1,112 @@
+import asyncio
+import unittest
+
+from confluent_kafka import KafkaError, KafkaException
+from prometheus_client import REGISTRY
+
+from src.config import KafkaConfig
+from src.kafka_producer import AsyncKafkaProducer, build_producer_config
+from src.test.fakes import FakeProducer
+
+
+class BlockedProducer(FakeProducer):
+    def poll(self, timeout=None):
+        return 0
+
+
+class AsyncKafkaProducerTests(unittest.IsolatedAsyncioTestCase):
+    async def test_send_resolves_on_delivery(self):
+        fake = FakeProducer()
+        producer = AsyncKafkaProducer({}, producer_factory=lambda config: fake, poll_timeout=0.01)
+        labels = {'topic': 'topic', 'partition': '0'}
+        observed = REGISTRY.get_sample_value('frontend_kafka_delivery_seconds_count', labels) or 0
+        producer.start(asyncio.get_running_loop())
+        try:
+            delivered = await asyncio.wait_for(producer.send('topic', '1', b'value'), timeout=1)
+        finally:
+            await producer.stop()
+
+        self.assertEqual(('topic', '1', b'value'), delivered)
+        self.assertEqual(observed + 1, REGISTRY.get_sample_value('frontend_kafka_delivery_seconds_count', labels))
+
+    async def test_send_raises_on_delivery_error(self):
+        fake = FakeProducer(error=KafkaError(KafkaError._MSG_TIMED_OUT))
+        producer = AsyncKafkaProducer({}, producer_factory=lambda config: fake, poll_timeout=0.01)
+        producer.start(asyncio.get_running_loop())
+        try:
+            with self.assertRaises(KafkaException):
+                await asyncio.wait_for(producer.send('topic', '1', b'value'), timeout=1)
+        finally:
+            await producer.stop()
+
+    async def test_send_raises_buffer_error_after_enqueue_timeout(self):
+        fake = BlockedProducer(capacity=0)
+        producer = AsyncKafkaProducer(
+            {}, producer_factory=lambda config: fake, enqueue_timeout=0.05, poll_timeout=0.01
+        )
+        producer.start(asyncio.get_running_loop())
+        try:
+            with self.assertRaises(BufferError):
+                await producer.send('topic', '1', b'value')
+        finally:
+            await producer.stop()
+
+    async def test_send_waits_for_queue_space(self):
+        fake = FakeProducer(capacity=1)
+        producer = AsyncKafkaProducer({}, producer_factory=lambda config: fake, poll_timeout=0.01)
+        producer.start(asyncio.get_running_loop())
+        try:
+            await asyncio.wait_for(
+                asyncio.gather(*(producer.send('topic', str(i), b'value') for i in range(5))),
+                timeout=1
+            )
+        finally:
+            await producer.stop()
+
+        self.assertEqual(5, len(fake.delivered))
+
+    async def test_stop_flushes_pending_deliveries(self):
+        fake = BlockedProducer()
+        fake.flush = lambda timeout=None: FakeProducer.poll(fake)
+        producer = AsyncKafkaProducer({}, producer_factory=lambda config: fake, poll_timeout=0.01)
+        producer.start(asyncio.get_running_loop())
+        sent = asyncio.create_task(producer.send('topic', '1', b'value'))
+        await asyncio.sleep(0.02)
+        self.assertFalse(sent.done())
+
+        await producer.stop()
+        self.assertEqual(('topic', '1', b'value'), await asyncio.wait_for(sent, timeout=1))
+
+    async def test_all_brokers_down_marks_producer_unavailable(self):
+        fake = FakeProducer()
+        producer = AsyncKafkaProducer({}, producer_factory=lambda config: fake, poll_timeout=0.01)
+
+        with self.assertLogs(level='ERROR'):
+            producer._on_error(KafkaError(KafkaError._ALL_BROKERS_DOWN))
+        self.assertFalse(producer.available)
+
+        producer.start(asyncio.get_running_loop())
+        try:
+            await asyncio.wait_for(producer.send('topic', '1', b'value'), timeout=1)
+        finally:
+            await producer.stop()
+        self.assertTrue(producer.available)
+
+
+class BuildProducerConfigTests(unittest.TestCase):
+    def test_tuning_is_passed_to_librdkafka(self):
+        config = build_producer_config(KafkaConfig(
+            bootstrap_servers='localhost:9092',
+            messages_topic='topic',
+            linger_ms=20,
+            compression_type='zstd',
+        ))
+
+        self.assertEqual('localhost:9092', config['bootstrap.servers'])
+        self.assertEqual(20, config['linger.ms'])
+        self.assertEqual('zstd', config['compression.type'])
+        self.assertTrue(config['enable.idempotence'])
+
+
+if __name__ == '__main__':
+    unittest.main()
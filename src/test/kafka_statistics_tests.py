@@ -0,0 +1,89 @@
+import json
+import unittest
+
+from prometheus_client import CollectorRegistry
+
+from src.kafka_statistics import KafkaStatisticsCollector
+
+window = {'min': 100, 'max': 900, 'avg': 300, 'sum': 3000, 'cnt': 10, 'p50': 250, 'p75': 400, 'p90': 700,
+          'p95': 800, 'p99': 900, 'p99_99': 900}
+
+statistics = {
+    'name': 'rdkafka#producer-1',
+    'type': 'producer',
+    'msg_cnt': 12,
+    'msg_size': 3400,
+    'tx_bytes': 10000,
+    'rx_bytes': 2000,
+    'txmsgs': 40,
+    'brokers': {
+        'localhost:9092/1': {
+            'name': 'localhost:9092/1',
+            'nodeid': 1,
+            'txretries': 2,
+            'txerrs': 1,
+            'req_timeouts': 0,
+            'rtt': window,
+        },
+        'GroupCoordinator': {
+            'name': 'GroupCoordinator',
+            'nodeid': -1,
+            'rtt': window,
+        },
+    },
+    'topics': {
+        'frontends.messages.v1': {
+            'topic': 'frontends.messages.v1',
+            'batchsize': window,
+            'batchcnt': window,
+            'partitions': {
+                '0': {'partition': 0, 'msgq_cnt': 5, 'txmsgs': 40, 'txbytes': 8000, 'msgs_inflight': 3},
+                '-1': {'partition': -1, 'msgq_cnt': 0, 'txmsgs': 0},
+            },
+        },
+    },
+}
+
+
+class KafkaStatisticsCollectorTests(unittest.TestCase):
+    def setUp(self):
+        self.collector = KafkaStatisticsCollector()
+        self.registry = CollectorRegistry()
+        self.registry.register(self.collector)
+
+    def test_nothing_is_exported_before_first_statistics(self):
+        self.assertIsNone(self.registry.get_sample_value('frontend_kafka_producer_queue_messages'))
+
+    def test_statistics_are_exported(self):
+        self.collector.update(json.dumps(statistics))
+
+        self.assertEqual(12, self.registry.get_sample_value('frontend_kafka_producer_queue_messages'))
+        self.assertEqual(3400, self.registry.get_sample_value('frontend_kafka_producer_queue_bytes'))
+        self.assertEqual(10000, self.registry.get_sample_value('frontend_kafka_producer_tx_bytes_total'))
+        self.assertAlmostEqual(0.0009, self.registry.get_sample_value(
+            'frontend_kafka_broker_rtt_seconds', {'broker': 'localhost:9092/1', 'quantile': '0.99'}))
+        self.assertEqual(2, self.registry.get_sample_value(
+            'frontend_kafka_broker_tx_retries_total', {'broker': 'localhost:9092/1'}))
+        self.assertIsNone(self.registry.get_sample_value(
+            'frontend_kafka_broker_tx_retries_total', {'broker': 'GroupCoordinator'}))
+        self.assertEqual(250, self.registry.get_sample_value(
+            'frontend_kafka_topic_batch_bytes', {'topic': 'frontends.messages.v1', 'quantile': '0.5'}))
+        self.assertEqual(5, self.registry.get_sample_value(
+            'frontend_kafka_partition_queue_messages', {'topic': 'frontends.messages.v1', 'partition': '0'}))
+        self.assertIsNone(self.registry.get_sample_value(
+            'frontend_kafka_partition_queue_messages', {'topic': 'frontends.messages.v1', 'partition': '-1'}))
+        self.assertEqual(8000, self.registry.get_sample_value(
+            'frontend_kafka_partition_tx_bytes_total', {'topic': 'frontends.messages.v1', 'partition': '0'}))
+        self.assertEqual(3, self.registry.get_sample_value(
+            'frontend_kafka_partition_in_flight_messages', {'topic': 'frontends.messages.v1', 'partition': '0'}))
+
+    def test_malformed_statistics_keep_previous_snapshot(self):
+        self.collector.update(json.dumps(statistics))
+        with self.assertLogs(level='ERROR'):
+            self.collector.update('{not json')
+
+        self.assertEqual(12, self.registry.get_sample_value('frontend_kafka_producer_queue_messages'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,70 @@
+import copy
+import logging
+import unittest
+
+from src.config import LoggingConfig
+from src.handlers.logging_handler import ChatLogSampler, get_message_fields, register_logging_handler, truncate
+from src.message_snapshot import MessageSnapshot, SNAPSHOT_ATTRIBUTE
+from src.structured_logging import FIELDS_ATTRIBUTE
+from src.test.fakes import FakeClient
+from src.test.messages import new_message, new_message_picture_with_caption
+
+
+class MessageFieldsTests(unittest.TestCase):
+    def test_fields(self):
+        fields = get_message_fields(MessageSnapshot(new_message_picture_with_caption))
+
+        self.assertEqual(new_message_picture_with_caption.chat.id, fields['chat_id'])
+        self.assertEqual('photo', fields['media'])
+        self.assertEqual(new_message_picture_with_caption.caption, fields['caption'])
+        self.assertNotIn('text', fields)
+
+    def test_text_is_truncated(self):
+        self.assertEqual('short', truncate('short', 10))
+        self.assertEqual('0123456789…', truncate('0123456789abc', 10))
+        self.assertEqual('Hel…', get_message_fields(MessageSnapshot(new_message), 3)['text'])
+
+
+class ChatLogSamplerTests(unittest.TestCase):
+    def test_noisy_chat_is_sampled_until_window_ends(self):
+        now = [0.0]
+        sampler = ChatLogSampler(threshold=2, window=60, sample_every=3, clock=lambda: now[0])
+
+        results = [sampler.sample(1) for _ in range(8)]
+        self.assertEqual([0, 0, None, None, 2, None, None, 2], results)
+        self.assertEqual(0, sampler.sample(2))
+
+        now[0] = 60
+        self.assertEqual(0, sampler.sample(1))
+
+
+class LoggingHandlerTests(unittest.IsolatedAsyncioTestCase):
+    async def test_message_is_logged_with_fields(self):
+        client = FakeClient()
+        register_logging_handler(client, config=LoggingConfig(max_text_length=3))
+
+        with self.assertLogs('src.handlers.logging_handler', level='INFO') as logs:
+            await client.handlers[0].callback(client, new_message)
+
+        fields = getattr(logs.records[0], FIELDS_ATTRIBUTE)
+        self.assertEqual(new_message.id, fields['message_id'])
+        self.assertEqual('Hel…', fields['text'])
+
+    async def test_nothing_is_read_when_info_is_disabled(self):
+        client = FakeClient()
+        register_logging_handler(client)
+        logger = logging.getLogger('src.handlers.logging_handler.logging_handler')
+        level = logger.level
+        logger.setLevel(logging.WARNING)
+        try:
+            message = copy.copy(new_message)
+            message.__dict__.pop(SNAPSHOT_ATTRIBUTE, None)
+            await client.handlers[0].callback(client, message)
+        finally:
+            logger.setLevel(level)
+
+        self.assertNotIn(SNAPSHOT_ATTRIBUTE, message.__dict__)
+
+
+if __name__ == '__main__':
+    unittest.main()
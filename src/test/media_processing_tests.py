@@ -0,0 +1,63 @@
+import io
+import time
+import unittest
+
+from src.config import ImageFormat
+from src.media_processing import MediaProcessor, normalize_image
+from src.new_message import MediaType
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+
+def make_image(width: int, height: int, image_format: str = 'PNG') -> bytes:
+    output = io.BytesIO()
+    Image.new('RGBA' if image_format == 'PNG' else 'RGB', (width, height), 'red').save(output, format=image_format)
+    return output.getvalue()
+
+
+@unittest.skipIf(Image is None, 'Pillow is not installed')
+class NormalizeImageTests(unittest.TestCase):
+    def test_large_image_is_downscaled_keeping_aspect_ratio(self):
+        data, _, _ = normalize_image(make_image(400, 200), ImageFormat.WEBP, 80, 100, time.monotonic())
+
+        image = Image.open(io.BytesIO(data))
+        self.assertEqual('WEBP', image.format)
+        self.assertEqual((100, 50), image.size)
+
+    def test_small_image_is_not_upscaled(self):
+        data, _, _ = normalize_image(make_image(40, 20, 'JPEG'), ImageFormat.JPEG, 80, 100, time.monotonic())
+
+        self.assertEqual((40, 20), Image.open(io.BytesIO(data)).size)
+
+    def test_transparent_image_is_converted_for_jpeg(self):
+        data, _, _ = normalize_image(make_image(40, 20), ImageFormat.JPEG, 80, 100, time.monotonic())
+
+        self.assertEqual('RGB', Image.open(io.BytesIO(data)).mode)
+
+
+@unittest.skipIf(Image is None, 'Pillow is not installed')
+class MediaProcessorTests(unittest.IsolatedAsyncioTestCase):
+    async def test_process_in_pool(self):
+        processor = MediaProcessor(workers=1, image_format=ImageFormat.JPEG, max_dimension=100)
+        processor.start()
+        try:
+            data = await processor.process(make_image(400, 400, 'JPEG'))
+        finally:
+            processor.stop()
+
+        self.assertEqual((100, 100), Image.open(io.BytesIO(data)).size)
+
+    def test_accepts(self):
+        processor = MediaProcessor(max_file_size=1000, types=[MediaType.PHOTO])
+
+        self.assertTrue(processor.accepts(MediaType.PHOTO, 'image/jpeg', 1000))
+        self.assertFalse(processor.accepts(MediaType.PHOTO, 'image/jpeg', 1001))
+        self.assertFalse(processor.accepts(MediaType.PHOTO, 'image/gif', 10))
+        self.assertFalse(processor.accepts(MediaType.STICKER, 'image/webp', 10))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,368 @@
+import asyncio
+import unittest
+from typing import Optional
+from unittest import mock
+
+from miniopy_async import Minio
+from miniopy_async.error import S3Error
+
+from src.config import MediaTypeConfig, VariantPolicy
+from src.media import TelegramMediaStream, MediaUploader, MultipartUploads, MediaCache, MediaIngestor, IngestedMedia, \
+    select_variant
+from src.new_message import MediaType
+from src.test.messages import new_message_picture, new_message_voice, new_message_video
+
+
+async def chunks(*values: bytes):
+    for value in values:
+        yield value
+
+
+class FakeMinio:
+    def __init__(self):
+        self.objects = {}
+        self.stat_calls = 0
+        self.uploads = {}
+        self.part_gate = asyncio.Event()
+        self.part_gate.set()
+
+    async def stat_object(self, bucket_name, object_name):
+        self.stat_calls += 1
+        if (bucket_name, object_name) not in self.objects:
+            raise S3Error('NoSuchKey', 'Object does not exist', None, None, None, None)
+        return object()
+
+    async def put_object(self, bucket_name, object_name, data, length, content_type):
+        self.objects[(bucket_name, object_name)] = (data.read(length), content_type, [length])
+
+    async def _create_multipart_upload(self, bucket_name, object_name, headers):
+        upload_id = f'upload-{len(self.uploads)}'
+        self.uploads[upload_id] = (headers['Content-Type'], {})
+        return upload_id
+
+    async def _upload_part(self, bucket_name, object_name, data, headers, upload_id, part_number):
+        await self.part_gate.wait()
+        self.uploads[upload_id][1][part_number] = data
+        return f'etag-{part_number}'
+
+    async def _complete_multipart_upload(self, bucket_name, object_name, upload_id, parts):
+        content_type, uploaded = self.uploads.pop(upload_id)
+        data = [uploaded[it.part_number] for it in parts]
+        self.objects[(bucket_name, object_name)] = (b''.join(data), content_type, [len(it) for it in data])
+
+    async def _abort_multipart_upload(self, bucket_name, object_name, upload_id):
+        self.uploads.pop(upload_id)
+
+
+class FakeClient:
+    def __init__(self, content: Optional[bytes], chunk_size: int):
+        # None streams as many bytes as the media reports
+        self.content = content
+        self.chunk_size = chunk_size
+        self.streamed = []
+        self.read = 0
+
+    async def stream_media(self, media):
+        self.streamed.append(media)
+        content = self.content if self.content is not None else b'x' * media.file_size
+        for i in range(0, len(content), self.chunk_size):
+            self.read += len(content[i:i + self.chunk_size])
+            yield content[i:i + self.chunk_size]
+
+
+class FakeProcessor:
+    content_type = 'image/webp'
+
+    def accepts(self, media_type, content_type, file_size):
+        return media_type == MediaType.PHOTO
+
+    async def process(self, data: bytes) -> bytes:
+        return data.upper()
+
+
+class BrokenProcessor(FakeProcessor):
+    async def process(self, data: bytes) -> bytes:
+        raise ValueError('Truncated image')
+
+
+class FakeHasher:
+    def __init__(self, *hashes: int):
+        self.hashes = list(hashes)
+
+    def accepts(self, media_type, content_type, file_size):
+        return media_type == MediaType.PHOTO
+
+    async def hash(self, data: bytes) -> int:
+        return self.hashes.pop(0)
+
+
+class TelegramMediaStreamTests(unittest.IsolatedAsyncioTestCase):
+    async def test_read_splits_and_joins_chunks(self):
+        stream = TelegramMediaStream(chunks(b'abc', b'defg', b'h'))
+
+        self.assertEqual(b'ab', await stream.read(2))
+        self.assertEqual(b'cdef', await stream.read(4))
+        self.assertEqual(b'gh', await stream.read(10))
+        self.assertEqual(b'', await stream.read(10))
+
+    async def test_read_all(self):
+        stream = TelegramMediaStream(chunks(b'abc', b'def'))
+
+        self.assertEqual(b'abcdef', await stream.read())
+
+
+class MediaUploaderTests(unittest.IsolatedAsyncioTestCase):
+    async def test_upload_streams_media_in_parts(self):
+        content = bytes(range(256)) * 100
+        minio = FakeMinio()
+        uploader = MediaUploader(FakeClient(content, chunk_size=1000), minio, part_size=10_000)
+
+        await uploader.upload('file_id', 'photo', 'file_id.jpg', length=len(content), content_type='image/jpeg')
+
+        uploaded, content_type, part_sizes = minio.objects[('photo', 'file_id.jpg')]
+        self.assertEqual(content, uploaded)
+        self.assertEqual('image/jpeg', content_type)
+        self.assertEqual([10_000, 10_000, 5_600], part_sizes)
+
+    async def test_download_waits_for_upload_slots(self):
+        content = bytes(range(256)) * 100
+        minio = FakeMinio()
+        minio.part_gate.clear()
+        client = FakeClient(content, chunk_size=1000)
+        uploader = MediaUploader(client, minio, part_size=5_000, parallel_uploads=2)
+
+        upload = asyncio.create_task(uploader.upload('file_id', 'photo', 'file_id.jpg', length=len(content)))
+        for _ in range(50):
+            await asyncio.sleep(0)
+
+        # Two parts uploading, nothing more is read until a slot is free
+        self.assertEqual(10_000, client.read)
+        minio.part_gate.set()
+        await upload
+        self.assertEqual(content, minio.objects[('photo', 'file_id.jpg')][0])
+
+    async def test_failed_part_aborts_upload(self):
+        content = bytes(range(256)) * 100
+        minio = FakeMinio()
+
+        async def fail(*args):
+            raise OSError('S3 is down')
+
+        minio._upload_part = fail
+        uploader = MediaUploader(FakeClient(content, chunk_size=1000), minio, part_size=10_000)
+
+        with self.assertRaises(OSError):
+            await uploader.upload('file_id', 'photo', 'file_id.jpg', length=len(content))
+        self.assertEqual({}, minio.uploads)
+        self.assertEqual({}, minio.objects)
+
+    async def test_short_stream_fails(self):
+        uploader = MediaUploader(FakeClient(b'content', chunk_size=4), FakeMinio())
+
+        with self.assertRaises(IOError):
+            await uploader.upload('file_id', 'photo', 'file_id.jpg', length=100)
+
+
+class MultipartUploadsTests(unittest.IsolatedAsyncioTestCase):
+    async def test_calls_match_installed_minio(self):
+        # Autospec raises TypeError if a private signature no longer takes these arguments
+        minio = mock.create_autospec(Minio, instance=True)
+        minio._create_multipart_upload.return_value = 'upload'
+        minio._upload_part.return_value = 'etag'
+        multipart = MultipartUploads(minio)
+
+        upload_id = await multipart.create('bucket', 'object', 'video/mp4')
+        part = await multipart.upload_part('bucket', 'object', upload_id, 1, b'data')
+        await multipart.complete('bucket', 'object', upload_id, [part])
+        await multipart.abort('bucket', 'object', upload_id)
+
+        self.assertEqual('upload', upload_id)
+        self.assertEqual((1, 'etag'), (part.part_number, part.etag))
+        minio._create_multipart_upload.assert_awaited_once_with('bucket', 'object', {'Content-Type': 'video/mp4'})
+        minio._complete_multipart_upload.assert_awaited_once_with('bucket', 'object', 'upload', [part])
+
+
+class MediaCacheTests(unittest.IsolatedAsyncioTestCase):
+    async def test_miss_then_memory_hit(self):
+        minio = FakeMinio()
+        cache = MediaCache(minio)
+
+        self.assertIsNone(await cache.lookup('unique', 'photo', 'unique.jpg'))
+        cache.remember('unique', 'photo', 'unique.jpg')
+        self.assertEqual(('photo', 'unique.jpg'), await cache.lookup('unique', 'photo', 'unique.jpg'))
+        self.assertEqual(1, minio.stat_calls)
+
+    async def test_s3_hit_is_remembered(self):
+        minio = FakeMinio()
+        minio.objects[('photo', 'unique.jpg')] = b''
+        cache = MediaCache(minio)
+
+        self.assertEqual(('photo', 'unique.jpg'), await cache.lookup('unique', 'photo', 'unique.jpg'))
+        self.assertEqual(('photo', 'unique.jpg'), await cache.lookup('unique', 'photo', 'unique.jpg'))
+        self.assertEqual(1, minio.stat_calls)
+
+    async def test_s3_check_can_be_disabled(self):
+        minio = FakeMinio()
+        minio.objects[('photo', 'unique.jpg')] = b''
+        cache = MediaCache(minio, check_s3=False)
+
+        self.assertIsNone(await cache.lookup('unique', 'photo', 'unique.jpg'))
+        self.assertEqual(0, minio.stat_calls)
+
+    async def test_least_recently_used_entry_is_evicted(self):
+        cache = MediaCache(FakeMinio(), max_size=2, check_s3=False)
+        cache.remember('first', 'photo', 'first.jpg')
+        cache.remember('second', 'photo', 'second.jpg')
+        await cache.lookup('first', 'photo', 'first.jpg')
+        cache.remember('third', 'photo', 'third.jpg')
+
+        self.assertIsNotNone(await cache.lookup('first', 'photo', 'first.jpg'))
+        self.assertIsNone(await cache.lookup('second', 'photo', 'second.jpg'))
+
+
+class MediaIngestorTests(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.client = FakeClient(None, chunk_size=4096)
+        self.minio = FakeMinio()
+        self.ingestor = MediaIngestor(
+            uploader=MediaUploader(self.client, self.minio),
+            cache=MediaCache(self.minio),
+            types={
+                MediaType.PHOTO: MediaTypeConfig(bucket='photo', max_file_size=1_000_000),
+                MediaType.VOICE: MediaTypeConfig(bucket='voice', max_file_size=1_000_000, concurrency=8),
+                MediaType.VIDEO: MediaTypeConfig(bucket='video', max_file_size=1_000_000),
+            },
+        )
+
+    async def test_media_goes_to_its_bucket(self):
+        self.assertEqual(
+            IngestedMedia('photo', 'AgAD8cQxGyhOWUg.jpg'),
+            await self.ingestor.ingest(new_message_picture.photo, MediaType.PHOTO)
+        )
+        self.assertEqual(
+            IngestedMedia('voice', 'AgADxSgAAihOWUg.oga'),
+            await self.ingestor.ingest(new_message_voice.voice, MediaType.VOICE)
+        )
+        self.assertEqual('audio/ogg', self.minio.objects[('voice', 'AgADxSgAAihOWUg.oga')][1])
+
+    async def test_media_over_size_cap_is_replaced_with_thumbnail(self):
+        self.assertEqual(
+            IngestedMedia('video', 'AgADwigAAihOWUg_303x320.jpg'),
+            await self.ingestor.ingest(new_message_video.video, MediaType.VIDEO)
+        )
+        self.assertEqual([new_message_video.video.thumbs[0]], self.client.streamed)
+
+    async def test_media_is_skipped_if_no_variant_fits(self):
+        self.ingestor.types[MediaType.VIDEO].max_file_size = 1000
+
+        self.assertIsNone(await self.ingestor.ingest(new_message_video.video, MediaType.VIDEO))
+        self.assertEqual([], self.client.streamed)
+
+    async def test_unconfigured_media_type_is_skipped(self):
+        self.assertIsNone(await self.ingestor.ingest(new_message_picture.photo, MediaType.STICKER))
+
+    async def test_repeated_media_is_uploaded_once(self):
+        await self.ingestor.ingest(new_message_picture.photo, MediaType.PHOTO)
+        await self.ingestor.ingest(new_message_picture.photo, MediaType.PHOTO)
+
+        self.assertEqual(1, len(self.client.streamed))
+
+    async def test_transfer_times_are_reported_unless_cached(self):
+        uploaded = await self.ingestor.ingest(new_message_picture.photo, MediaType.PHOTO)
+        cached = await self.ingestor.ingest(new_message_picture.photo, MediaType.PHOTO)
+
+        self.assertGreaterEqual(uploaded.download_seconds, 0)
+        self.assertGreaterEqual(uploaded.upload_seconds, 0)
+        self.assertIsNone(cached.download_seconds)
+        self.assertIsNone(cached.upload_seconds)
+
+    async def test_processed_media_is_uploaded_with_processor_content_type(self):
+        self.ingestor.processor = FakeProcessor()
+
+        self.assertEqual(
+            IngestedMedia('photo', 'AgAD8cQxGyhOWUg.webp'),
+            await self.ingestor.ingest(new_message_picture.photo, MediaType.PHOTO)
+        )
+        size = new_message_picture.photo.file_size
+        self.assertEqual((b'X' * size, 'image/webp', [size]), self.minio.objects[('photo', 'AgAD8cQxGyhOWUg.webp')])
+        self.assertEqual(
+            IngestedMedia('voice', 'AgADxSgAAihOWUg.oga'),
+            await self.ingestor.ingest(new_message_voice.voice, MediaType.VOICE)
+        )
+
+
+    async def test_media_that_fails_processing_is_uploaded_as_is(self):
+        self.ingestor.processor = BrokenProcessor()
+
+        with self.assertLogs('src.media', level='WARNING'):
+            uploaded = await self.ingestor.ingest(new_message_picture.photo, MediaType.PHOTO)
+
+        self.assertEqual(IngestedMedia('photo', 'AgAD8cQxGyhOWUg.jpg'), uploaded)
+        size = new_message_picture.photo.file_size
+        self.assertEqual((b'x' * size, 'image/jpeg', [size]), self.minio.objects[('photo', 'AgAD8cQxGyhOWUg.jpg')])
+
+
+class NearDuplicateTests(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.client = FakeClient(b'content', chunk_size=4)
+        self.minio = FakeMinio()
+        self.ingestor = MediaIngestor(
+            uploader=MediaUploader(self.client, self.minio),
+            cache=MediaCache(self.minio),
+            types={
+                MediaType.PHOTO: MediaTypeConfig(bucket='photo', max_file_size=10_000),
+            },
+            hasher=FakeHasher(0b1111_0000, 0b1111_0001, 0xffff_0000),
+        )
+
+    async def test_near_duplicate_points_at_existing_object(self):
+        first = await self.ingestor.ingest(new_message_picture.photo, MediaType.PHOTO)
+        # Other sizes of the same photo have different keys, so the exact cache doesn't catch them
+        self.ingestor.types[MediaType.PHOTO].max_file_size = 30_000
+        second = await self.ingestor.ingest(new_message_picture.photo, MediaType.PHOTO)
+
+        self.assertEqual(IngestedMedia('photo', 'AgAD8cQxGyhOWUg_90x90.jpg', 0b1111_0000), first)
+        self.assertEqual(IngestedMedia('photo', 'AgAD8cQxGyhOWUg_90x90.jpg', 0b1111_0001, 1), second)
+        self.assertEqual(1, len(self.minio.objects))
+
+    async def test_different_image_is_uploaded(self):
+        await self.ingestor.ingest(new_message_picture.photo, MediaType.PHOTO)
+        self.ingestor.types[MediaType.PHOTO].max_file_size = 30_000
+        self.ingestor.hasher.hashes.pop(0)
+        second = await self.ingestor.ingest(new_message_picture.photo, MediaType.PHOTO)
+
+        self.assertIsNone(second.near_duplicate_distance)
+        self.assertEqual(2, len(self.minio.objects))
+
+
+class SelectVariantTests(unittest.TestCase):
+    def test_original_under_size_cap(self):
+        variant = select_variant(new_message_picture.photo, MediaType.PHOTO,
+                                 MediaTypeConfig(bucket='photo', max_file_size=100_000))
+
+        self.assertFalse(variant.is_thumbnail)
+        self.assertIs(new_message_picture.photo, variant.file)
+        self.assertEqual('image/jpeg', variant.content_type)
+
+    def test_largest_thumbnail_under_size_cap(self):
+        variant = select_variant(new_message_picture.photo, MediaType.PHOTO,
+                                 MediaTypeConfig(bucket='photo', max_file_size=50_000))
+
+        self.assertTrue(variant.is_thumbnail)
+        self.assertEqual(21833, variant.file_size)
+
+    def test_thumbnail_policy_ignores_original(self):
+        variant = select_variant(new_message_video.video, MediaType.VIDEO,
+                                 MediaTypeConfig(bucket='video', max_file_size=100_000_000,
+                                                 variant=VariantPolicy.THUMBNAIL))
+
+        self.assertTrue(variant.is_thumbnail)
+        self.assertEqual('image/jpeg', variant.content_type)
+
+    def test_no_variant_fits(self):
+        self.assertIsNone(select_variant(new_message_voice.voice, MediaType.VOICE,
+                                         MediaTypeConfig(bucket='voice', max_file_size=1000)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,59 @@
+import unittest
+from collections import Counter
+from types import GeneratorType
+
+from pyrogram.enums import ChatType, MessageMediaType
+
+from src.handlers.kafka_handler import pyrogram_message_to_new_message
+from src.test.tools.message_generator import GeneratorConfig, generate_messages
+
+
+class MessageGeneratorTests(unittest.TestCase):
+    def test_same_seed_same_messages(self):
+        config = GeneratorConfig(seed=7, chats=20, users=100)
+
+        first = [str(it) for it in generate_messages(config, 200)]
+        second = [str(it) for it in generate_messages(config, 200)]
+        other = [str(it) for it in generate_messages(GeneratorConfig(seed=8, chats=20, users=100), 200)]
+
+        self.assertEqual(first, second)
+        self.assertNotEqual(first, other)
+
+    def test_lazy_and_endless(self):
+        messages = generate_messages(GeneratorConfig(chats=5, users=10))
+
+        self.assertIsInstance(messages, GeneratorType)
+        self.assertEqual(10_000, sum(1 for _, _ in zip(range(10_000), messages)))
+
+    def test_distributions(self):
+        config = GeneratorConfig(
+            chats=50,
+            users=200,
+            chat_types={ChatType.SUPERGROUP: 1},
+            media={None: 1, MessageMediaType.PHOTO: 1},
+            service_rate=0,
+        )
+
+        messages = list(generate_messages(config, 2000))
+        media = Counter(it.media for it in messages)
+
+        self.assertEqual({ChatType.SUPERGROUP}, {it.chat.type for it in messages})
+        self.assertEqual({None, MessageMediaType.PHOTO}, set(media))
+        self.assertAlmostEqual(0.5, media[MessageMediaType.PHOTO] / len(messages), delta=0.05)
+        self.assertTrue(all(it.photo.file_size > 0 for it in messages if it.photo is not None))
+
+    def test_message_ids_increase_per_chat(self):
+        last_ids = {}
+        for message in generate_messages(GeneratorConfig(chats=10, users=50), 1000):
+            self.assertGreater(message.id, last_ids.get(message.chat.id, 0))
+            if message.reply_to_message_id is not None:
+                self.assertLess(message.reply_to_message_id, message.id)
+            last_ids[message.chat.id] = message.id
+
+    def test_messages_convert(self):
+        for message in generate_messages(GeneratorConfig(chats=20, users=100, no_username_rate=0), 500):
+            pyrogram_message_to_new_message(message, 'telegram')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,84 @@
+import unittest
+
+from pydantic import ValidationError
+from pyrogram.types import Message
+
+from src.handlers.gateway_handler import snapshot_to_new_message_request
+from src.handlers.kafka_handler import pyrogram_message_to_new_message, pyrogram_chat_to_chat, \
+    pyrogram_user_to_user, snapshot_to_new_message
+from src.handlers.prometheus_handler import MESSAGE_COUNTERS
+from src.ingest_latency import get_latency_labels
+from src.message_snapshot import COUNTED_ATTRIBUTES, MessageSnapshot, get_snapshot
+from src.new_message import ChatType, MediaType
+from src.new_message_request import ActionType, MessageType
+from src.pyrogram_utils import get_action_type, get_media_type, get_message_type
+from src.test.messages import member_left, new_member, new_message, new_message_picture_with_caption, \
+    new_message_gif, new_message_reply_to_text, new_message_forwarded
+
+
+class MessageSnapshotTests(unittest.TestCase):
+    def test_fields(self):
+        snapshot = MessageSnapshot(new_message_reply_to_text)
+
+        self.assertEqual(new_message_reply_to_text.id, snapshot.id)
+        self.assertEqual(new_message_reply_to_text.chat.id, snapshot.chat.id)
+        self.assertEqual(new_message_reply_to_text.from_user.username, snapshot.from_user.username)
+        self.assertEqual(new_message_reply_to_text.reply_to_message_id, snapshot.reply_to_message_id)
+        self.assertIsNone(snapshot.forward_from)
+
+    def test_present_attributes(self):
+        snapshot = MessageSnapshot(new_message_picture_with_caption)
+
+        self.assertIn('caption', snapshot.present)
+        self.assertIn('photo', snapshot.present)
+        self.assertIn('media', snapshot.present)
+        self.assertNotIn('text', snapshot.present)
+
+    def test_snapshot_is_built_once(self):
+        first = get_snapshot(new_message_forwarded)
+
+        self.assertIs(first, get_snapshot(new_message_forwarded))
+        self.assertNotIn('_snapshot', str(new_message_forwarded))
+
+    def test_every_counted_attribute_has_counter(self):
+        self.assertEqual(set(COUNTED_ATTRIBUTES), set(MESSAGE_COUNTERS))
+
+
+    def test_message_without_chat(self):
+        snapshot = MessageSnapshot(Message(id=1))
+
+        self.assertIsNone(snapshot.chat)
+        self.assertEqual(('none', 'unknown'), get_latency_labels(snapshot))
+
+
+class ConverterTests(unittest.TestCase):
+    def test_new_message(self):
+        value = pyrogram_message_to_new_message(new_message_gif, 'telegram')
+
+        self.assertEqual(value, snapshot_to_new_message(MessageSnapshot(new_message_gif), 'telegram'))
+        self.assertEqual(MediaType.ANIMATION, value.media_type)
+        self.assertEqual(ChatType.GROUP, value.chat.type)
+        self.assertEqual(pyrogram_user_to_user(new_message_gif.from_user), value.user)
+        self.assertEqual(pyrogram_chat_to_chat(new_message_gif.chat), value.chat)
+
+    def test_contract_violation(self):
+        with self.assertRaises(ValidationError):
+            snapshot_to_new_message(MessageSnapshot(member_left), 'telegram')
+
+    def test_gateway_helpers_accept_snapshots(self):
+        for message in (member_left, new_member, new_message, new_message_gif):
+            snapshot = MessageSnapshot(message)
+            self.assertEqual(get_media_type(message), get_media_type(snapshot))
+            self.assertEqual(get_message_type(message), get_message_type(snapshot))
+            self.assertEqual(get_action_type(message), get_action_type(snapshot))
+
+    def test_new_message_request(self):
+        value = snapshot_to_new_message_request(MessageSnapshot(member_left), 'telegram')
+
+        self.assertEqual(MessageType.ACTION, value.type)
+        self.assertEqual(ActionType.MEMBER_LEFT, value.action_info.action_type)
+        self.assertEqual(str(member_left.left_chat_member.id), value.action_info.related_user.id)
+
+
+if __name__ == '__main__':
+    unittest.main()
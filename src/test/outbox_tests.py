@@ -0,0 +1,197 @@
+import asyncio
+import os
+import tempfile
+import threading
+import unittest
+
+from confluent_kafka import KafkaError, KafkaException
+
+from src.outbox import KafkaOutbox, OutboxRecord, encode_record, decode_record, read_records, FRAME_HEADER, _sync
+
+
+class FakeProducer:
+    def __init__(self):
+        self.available = True
+        self.failing = False
+        # Cleared, sends wait for an ack until it is set, like while librdkafka still retries unreachable brokers
+        self.acks = asyncio.Event()
+        self.acks.set()
+        # Values that fail once, then go through
+        self.fail_once: set[bytes] = set()
+        self.enqueued: list[bytes] = []
+        self.sent: list[bytes] = []
+
+    async def send(self, topic, key, value, headers=None, on_enqueued=None):
+        if self.failing or value in self.fail_once:
+            self.fail_once.discard(value)
+            raise KafkaException(KafkaError(KafkaError._MSG_TIMED_OUT))
+        self.enqueued.append(value)
+        if on_enqueued is not None:
+            on_enqueued()
+        await self.acks.wait()
+        self.sent.append(value)
+
+
+class RecordEncodingTests(unittest.TestCase):
+    def test_round_trip(self):
+        record = OutboxRecord(topic='topic', key='-100', value=b'\x00value', headers=[('content-type', b'json')])
+
+        self.assertEqual(record, decode_record(encode_record(record)[FRAME_HEADER.size:]))
+
+    def test_round_trip_without_key(self):
+        record = OutboxRecord(topic='topic', key=None, value=b'value')
+
+        self.assertEqual(record, decode_record(encode_record(record)[FRAME_HEADER.size:]))
+
+    def test_torn_tail_is_ignored(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'segment')
+            first = encode_record(OutboxRecord(topic='topic', key='1', value=b'first'))
+            second = encode_record(OutboxRecord(topic='topic', key='1', value=b'second'))
+            with open(path, 'wb') as fp:
+                fp.write(first + second[:-1])
+
+            records = read_records(path, 0, 10)
+
+        self.assertEqual([b'first'], [record.value for record, _ in records])
+        self.assertEqual(len(first), records[0][1])
+
+
+class SyncTests(unittest.TestCase):
+    def test_closed_segment_is_not_synced(self):
+        lock = threading.Lock()
+        with tempfile.TemporaryFile() as fp:
+            _sync(fp, lock, close=True)
+            self.assertTrue(fp.closed)
+            # Its descriptor may belong to another file by now
+            _sync(fp, lock)
+
+
+class KafkaOutboxTests(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.producer = FakeProducer()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def make_outbox(self, segment_size: int = 1024) -> KafkaOutbox:
+        return KafkaOutbox(self.producer, self.directory.name, segment_size=segment_size,
+                           fsync_interval=0.01, retry_interval=0.01, send_timeout=0.05)
+
+    async def wait_until_drained(self, outbox: KafkaOutbox):
+        async def drained():
+            while outbox.has_pending():
+                await asyncio.sleep(0.01)
+
+        await asyncio.wait_for(drained(), timeout=2)
+
+    async def test_publish_sends_directly_when_kafka_is_healthy(self):
+        outbox = self.make_outbox()
+        await outbox.start()
+        delivered = await outbox.publish('topic', '1', b'value')
+        await outbox.stop()
+
+        self.assertTrue(delivered)
+        self.assertEqual([b'value'], self.producer.sent)
+        self.assertFalse(outbox.has_pending())
+
+    async def test_failed_events_are_replayed_in_order(self):
+        outbox = self.make_outbox(segment_size=64)
+        await outbox.start()
+        self.producer.failing = True
+        with self.assertLogs(level='WARNING'):
+            for i in range(10):
+                await outbox.publish('topic', '1', str(i).encode())
+            self.assertTrue(outbox.has_pending())
+            self.producer.failing = False
+            await self.wait_until_drained(outbox)
+        await outbox.stop()
+
+        self.assertEqual([str(i).encode() for i in range(10)], self.producer.sent)
+        segments = [name for name in os.listdir(self.directory.name) if name.endswith('.seg')]
+        self.assertEqual(1, len(segments))
+
+    async def test_replay_failure_neither_duplicates_nor_reorders(self):
+        outbox = self.make_outbox()
+        await outbox.start()
+        self.producer.failing = True
+        values = [b'a0', b'b0', b'a1', b'b1', b'a2', b'b2']
+        with self.assertLogs(level='WARNING'):
+            for value in values:
+                await outbox.publish('topic', value[:1].decode(), value)
+            self.producer.fail_once = {b'a1'}
+            self.producer.failing = False
+            await self.wait_until_drained(outbox)
+        await outbox.stop()
+
+        self.assertEqual(sorted(values), sorted(self.producer.sent))
+        self.assertEqual([b'a0', b'a1', b'a2'], [it for it in self.producer.sent if it.startswith(b'a')])
+        self.assertEqual([b'b0', b'b1', b'b2'], [it for it in self.producer.sent if it.startswith(b'b')])
+
+    async def test_unacknowledged_event_goes_to_outbox(self):
+        outbox = self.make_outbox()
+        await outbox.start()
+        self.producer.acks.clear()
+        with self.assertLogs(level='WARNING'):
+            self.assertFalse(await asyncio.wait_for(outbox.publish('topic', '1', b'first'), timeout=1))
+        # Queued behind the first one, without waiting for Kafka
+        self.assertFalse(await asyncio.wait_for(outbox.publish('topic', '1', b'second'), timeout=0.01))
+        self.assertTrue(outbox.has_pending())
+
+        self.producer.acks.set()
+        await self.wait_until_drained(outbox)
+        await outbox.stop()
+        self.assertEqual([b'first', b'second'], self.producer.sent)
+
+    async def test_event_does_not_overtake_its_timed_out_predecessor(self):
+        outbox = self.make_outbox()
+        await outbox.start()
+        self.producer.acks.clear()
+        with self.assertLogs(level='WARNING'):
+            first = asyncio.create_task(outbox.publish('topic', '1', b'first'))
+            second = asyncio.create_task(outbox.publish('topic', '1', b'second'))
+            other = asyncio.create_task(outbox.publish('topic', '2', b'other'))
+            await asyncio.sleep(0.01)
+            # Other chats are not held back
+            self.assertEqual([b'first', b'other'], self.producer.enqueued)
+
+            self.assertEqual([False, False, False], await asyncio.wait_for(asyncio.gather(first, second, other), 1))
+        self.producer.acks.set()
+        await self.wait_until_drained(outbox)
+        await outbox.stop()
+
+        self.assertEqual([b'first', b'second'], [it for it in self.producer.sent if it != b'other'])
+        self.assertEqual({}, outbox._key_tails)
+
+    async def test_unavailable_producer_is_bypassed(self):
+        outbox = self.make_outbox()
+        self.producer.available = False
+        self.producer.failing = True
+        await outbox.start()
+        self.assertFalse(await outbox.publish('topic', '1', b'value'))
+
+        self.assertTrue(outbox.has_pending())
+        self.assertEqual([], self.producer.sent)
+        await outbox.stop()
+
+    async def test_events_survive_restart(self):
+        self.producer.failing = True
+        outbox = self.make_outbox()
+        with self.assertLogs(level='WARNING'):
+            await outbox.start()
+            await outbox.publish('topic', '1', b'first')
+            await outbox.publish('topic', '1', b'second')
+            await outbox.stop()
+
+        self.producer.failing = False
+        restarted = self.make_outbox()
+        await restarted.start()
+        await self.wait_until_drained(restarted)
+        await restarted.stop()
+
+        self.assertEqual([b'first', b'second'], self.producer.sent)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,98 @@
+import io
+import random
+import time
+import unittest
+
+from src.perceptual_hash import HashIndex, dhash, hamming_distance, format_hash
+
+try:
+    import numpy as np
+    from PIL import Image
+except ImportError:
+    np = None
+    Image = None
+
+
+class HashIndexTests(unittest.TestCase):
+    def test_nearest_hash_within_distance(self):
+        index = HashIndex(max_distance=4)
+        index.add(0, 'zero')
+        index.add(0b111, 'three bits')
+
+        self.assertEqual((1, 'three bits'), index.find(0b1111))
+        self.assertEqual((1, 'zero'), index.find(1 << 63))
+        self.assertIsNone(index.find(0b11111 << 40))
+
+    def test_matches_brute_force(self):
+        rng = random.Random(42)
+        index = HashIndex(max_distance=6)
+        hashes = [rng.getrandbits(64) for _ in range(2000)]
+        for value in hashes:
+            index.add(value, value)
+
+        for value in hashes[:200]:
+            query = value
+            for bit in rng.sample(range(64), rng.randint(0, 8)):
+                query ^= 1 << bit
+            expected = min(hamming_distance(query, it) for it in hashes)
+            found = index.find(query)
+            if expected <= 6:
+                self.assertEqual(expected, found[0])
+            else:
+                self.assertIsNone(found)
+
+    def test_least_recently_used_hash_is_evicted(self):
+        index = HashIndex(max_distance=1, max_size=2)
+        index.add(0b1, 'first')
+        index.add(0b1 << 20, 'second')
+        index.find(0b1)
+        index.add(0b1 << 40, 'third')
+
+        self.assertEqual(2, len(index))
+        self.assertIsNotNone(index.find(0b1))
+        self.assertIsNone(index.find(0b1 << 20))
+
+    def test_lookup_is_fast(self):
+        rng = random.Random(1)
+        index = HashIndex(max_distance=4)
+        for _ in range(100_000):
+            index.add(rng.getrandbits(64), None)
+
+        started_at = time.perf_counter()
+        for _ in range(1000):
+            index.find(rng.getrandbits(64))
+
+        self.assertLess((time.perf_counter() - started_at) / 1000, 0.001)
+
+    def test_format_hash(self):
+        self.assertEqual('00000000000000ff', format_hash(0xff))
+
+
+def make_image(image_format: str, quality: int = 95, size=(256, 192)) -> bytes:
+    rng = np.random.default_rng(1)
+    # Smooth gradient with blobs, so resizing and recompression keep its structure
+    x, y = np.meshgrid(np.linspace(0, 1, 256), np.linspace(0, 1, 192))
+    pixels = (np.sin(x * 7) * np.cos(y * 5) * 127 + 128 + rng.normal(0, 2, x.shape)).clip(0, 255).astype(np.uint8)
+    image = Image.fromarray(pixels).convert('RGB').resize(size)
+    output = io.BytesIO()
+    image.save(output, format=image_format, quality=quality)
+    return output.getvalue()
+
+
+@unittest.skipIf(np is None or Image is None, 'numpy or Pillow is not installed')
+class DhashTests(unittest.TestCase):
+    def test_recompressed_and_resized_copies_are_close(self):
+        original = dhash(make_image('PNG'))
+
+        self.assertLessEqual(hamming_distance(original, dhash(make_image('JPEG', quality=30))), 4)
+        self.assertLessEqual(hamming_distance(original, dhash(make_image('WEBP', size=(128, 96)))), 4)
+
+    def test_different_images_are_far(self):
+        mirrored = Image.open(io.BytesIO(make_image('PNG'))).transpose(Image.Transpose.FLIP_LEFT_RIGHT)
+        output = io.BytesIO()
+        mirrored.save(output, format='PNG')
+
+        self.assertGreater(hamming_distance(dhash(make_image('PNG')), dhash(output.getvalue())), 10)
+
+if __name__ == '__main__':
+    unittest.main()
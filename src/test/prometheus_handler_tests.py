@@ -0,0 +1,51 @@
+import os
+import tempfile
+import unittest
+
+from prometheus_client import REGISTRY
+
+from src.config import CardinalityConfig
+from src.handlers.prometheus_handler import register_prometheus_handler
+from src.prometheus_metrics import prometheus_frontend_known_users
+from src.test.fakes import FakeClient, get_sample
+from src.test.messages import new_message_picture_with_caption
+
+
+def get_kind_count(kind: str) -> float:
+    return get_sample('frontend_messages_total', kind=kind)
+
+
+class PrometheusHandlerTests(unittest.IsolatedAsyncioTestCase):
+    async def test_message_kinds_are_counted_under_one_family(self):
+        client = FakeClient()
+        register_prometheus_handler(client)
+        before = {kind: get_kind_count(kind) for kind in ('photo', 'caption', 'media', 'text', 'sticker')}
+        received = REGISTRY.get_sample_value('frontend_messages_received_total')
+
+        await client.handlers[0].callback(client, new_message_picture_with_caption)
+
+        self.assertEqual(received + 1, REGISTRY.get_sample_value('frontend_messages_received_total'))
+        self.assertEqual(before['photo'] + 1, get_kind_count('photo'))
+        self.assertEqual(before['caption'] + 1, get_kind_count('caption'))
+        self.assertEqual(before['media'] + 1, get_kind_count('media'))
+        self.assertEqual(before['text'], get_kind_count('text'))
+        self.assertEqual(before['sticker'], get_kind_count('sticker'))
+
+    async def test_known_counts_are_restored_from_snapshot(self):
+        with tempfile.TemporaryDirectory() as directory:
+            config = CardinalityConfig(snapshot_path=os.path.join(directory, 'cardinality.json'))
+            client = FakeClient()
+            snapshots = register_prometheus_handler(client, cardinality=config)
+            await client.handlers[0].callback(client, new_message_picture_with_caption)
+            await snapshots.save()
+            prometheus_frontend_known_users.set(0)
+
+            self.assertIsNotNone(register_prometheus_handler(FakeClient(), cardinality=config))
+            self.assertEqual(1, REGISTRY.get_sample_value('frontend_known_users'))
+
+    def test_no_snapshots_without_path(self):
+        self.assertIsNone(register_prometheus_handler(FakeClient()))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,170 @@
+import asyncio
+import time
+import unittest
+from unittest import mock
+
+from pyrogram import Client
+from pyrogram.errors import FloodWait
+
+from src.send_scheduler import PacedClient, SendPriority, SendQueueFull, SendRejected, SendScheduler, TokenBucket, \
+    flood_sleep_threshold
+from src.test.fakes import make_scheduler_config
+
+
+class TokenBucketTests(unittest.TestCase):
+    def test_burst_then_rate(self):
+        bucket = TokenBucket(rate=2.0, capacity=2, now=0.0)
+        bucket.take(0.0)
+        bucket.take(0.0)
+
+        self.assertEqual(0.5, bucket.ready_at(0.0))
+        self.assertEqual(1.0, bucket.ready_at(1.0))
+
+    def test_tokens_are_capped(self):
+        bucket = TokenBucket(rate=1.0, capacity=2, now=0.0)
+
+        self.assertTrue(bucket.is_full(100.0))
+        bucket.take(100.0)
+        bucket.take(100.0)
+        self.assertEqual(101.0, bucket.ready_at(100.0))
+
+
+class PacedClientTests(unittest.IsolatedAsyncioTestCase):
+    async def test_threshold_comes_from_context(self):
+        client = PacedClient(name='test', in_memory=True)
+        with mock.patch.object(Client, 'invoke', mock.AsyncMock()) as invoke:
+            await client.invoke('query')
+            flood_sleep_threshold.set(0)
+            await client.invoke('query')
+            await client.invoke('query', sleep_threshold=5)
+
+        self.assertEqual([None, 0, 5], [call.args[3] for call in invoke.call_args_list])
+
+
+class SendSchedulerTests(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.sent: list = []
+
+    def make_send(self, value, errors=()):
+        errors = list(errors)
+
+        async def send():
+            if errors:
+                raise errors.pop(0)
+            self.sent.append(value)
+            return value
+
+        return send
+
+    async def test_chat_order_is_kept(self):
+        scheduler = SendScheduler(make_scheduler_config(private_rate=50.0, private_burst=1))
+        scheduler.start()
+        results = await asyncio.gather(*(scheduler.submit(1, self.make_send(it)) for it in range(5)))
+        await scheduler.stop()
+
+        self.assertEqual(list(range(5)), results)
+        self.assertEqual(list(range(5)), self.sent)
+
+    async def test_chat_rate_is_kept(self):
+        scheduler = SendScheduler(make_scheduler_config(group_rate=20.0, group_burst=1))
+        scheduler.start()
+        started = time.monotonic()
+        await asyncio.gather(*(scheduler.submit(-1, self.make_send(it)) for it in range(4)))
+        await scheduler.stop()
+
+        # The first send takes the burst token, the other three wait 50ms each
+        self.assertGreaterEqual(time.monotonic() - started, 0.14)
+
+    async def test_higher_priority_goes_first(self):
+        scheduler = SendScheduler(make_scheduler_config())
+        # Queued up before the scheduler runs
+        submitted = [
+            asyncio.create_task(scheduler.submit(1, self.make_send('low'), SendPriority.LOW)),
+            asyncio.create_task(scheduler.submit(2, self.make_send('normal'))),
+            asyncio.create_task(scheduler.submit(1, self.make_send('high'), SendPriority.HIGH)),
+            asyncio.create_task(scheduler.submit(2, self.make_send('other high'), SendPriority.HIGH)),
+        ]
+        await asyncio.sleep(0)
+        scheduler.start()
+        await asyncio.gather(*submitted)
+        await scheduler.stop()
+
+        self.assertEqual(['high', 'other high'], self.sent[:2])
+        self.assertEqual(['normal', 'low'], sorted(self.sent[2:], reverse=True))
+        self.assertLess(self.sent.index('high'), self.sent.index('low'))
+
+    async def test_queue_is_bounded(self):
+        scheduler = SendScheduler(make_scheduler_config(max_pending=2))
+        submitted = [asyncio.create_task(scheduler.submit(1, self.make_send(it))) for it in range(2)]
+        await asyncio.sleep(0)
+
+        with self.assertRaises(SendQueueFull):
+            await scheduler.submit(1, self.make_send(2))
+        self.assertEqual(2, scheduler.qsize())
+
+        scheduler.start()
+        await asyncio.gather(*submitted)
+        await scheduler.stop()
+        self.assertEqual([0, 1], self.sent)
+
+    async def test_flood_wait_is_retried_in_order(self):
+        scheduler = SendScheduler(make_scheduler_config())
+        scheduler.start()
+        with self.assertLogs('src.send_scheduler', level='WARNING'):
+            results = await asyncio.gather(
+                scheduler.submit(1, self.make_send('first', [FloodWait(value=0)])),
+                scheduler.submit(1, self.make_send('second')),
+            )
+        chat = scheduler._chats[1]
+        await scheduler.stop()
+
+        self.assertEqual(['first', 'second'], results)
+        self.assertEqual(['first', 'second'], self.sent)
+        # Halved by the FloodWait, then partly recovered by the two sends
+        self.assertAlmostEqual(0.6, chat.rate_factor)
+        self.assertAlmostEqual(600.0, chat.bucket.rate)
+
+    async def test_long_flood_wait_is_rejected(self):
+        scheduler = SendScheduler(make_scheduler_config(max_flood_wait=10.0))
+        scheduler.start()
+        with self.assertLogs('src.send_scheduler', level='WARNING'), self.assertRaises(SendRejected) as context:
+            await scheduler.submit(1, self.make_send('first', [FloodWait(value=120)]))
+        await scheduler.stop()
+
+        self.assertEqual(120, context.exception.retry_after)
+        self.assertEqual([], self.sent)
+
+    async def test_repeated_flood_waits_are_rejected(self):
+        scheduler = SendScheduler(make_scheduler_config(max_attempts=2))
+        scheduler.start()
+        with self.assertLogs('src.send_scheduler', level='WARNING'), self.assertRaises(SendRejected):
+            await scheduler.submit(1, self.make_send('first', [FloodWait(value=0), FloodWait(value=0)]))
+        await scheduler.stop()
+
+    async def test_send_errors_are_raised(self):
+        scheduler = SendScheduler(make_scheduler_config())
+        scheduler.start()
+        with self.assertRaises(RuntimeError):
+            await scheduler.submit(1, self.make_send('first', [RuntimeError('Boom')]))
+        self.assertEqual('second', await scheduler.submit(1, self.make_send('second')))
+        await scheduler.stop()
+
+    async def test_sends_do_not_sleep_through_flood_waits(self):
+        scheduler = SendScheduler(make_scheduler_config())
+        scheduler.start()
+
+        async def send():
+            return flood_sleep_threshold.get()
+
+        self.assertEqual(0, await scheduler.submit(1, send))
+        await scheduler.stop()
+        self.assertIsNone(flood_sleep_threshold.get())
+
+    async def test_idle_chats_are_forgotten(self):
+        scheduler = SendScheduler(make_scheduler_config())
+        scheduler.start()
+        await scheduler.submit(1, self.make_send('first'))
+        await scheduler.stop()
+        scheduler._sweep(time.monotonic() + 60)
+
+        self.assertEqual({}, scheduler._chats)
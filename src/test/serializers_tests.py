@@ -0,0 +1,60 @@
+import json
+import unittest
+
+from src.config import SerializationFormat
+from src.handlers.kafka_handler import pyrogram_message_to_new_message
+from src.new_message import MediaReady, MediaStatus, MediaType
+from src.serializers import get_serializer, JsonSerializer, MsgpackSerializer, SCHEMA_VERSION
+from src.test.messages import new_message_picture_with_caption
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+class JsonSerializerTests(unittest.TestCase):
+    def test_output_matches_pydantic_json(self):
+        value = pyrogram_message_to_new_message(new_message_picture_with_caption, 'telegram')
+
+        serialized = JsonSerializer().serialize(value)
+
+        self.assertIsInstance(serialized, bytes)
+        self.assertEqual(json.loads(value.model_dump_json()), json.loads(serialized))
+
+    def test_headers(self):
+        headers = dict(JsonSerializer().headers)
+
+        self.assertEqual(b'application/json', headers['content-type'])
+        self.assertEqual(SCHEMA_VERSION.encode(), headers['schema-version'])
+
+    def test_event_type_header(self):
+        serializer = JsonSerializer()
+        value = pyrogram_message_to_new_message(new_message_picture_with_caption, 'telegram')
+        media_ready = MediaReady(correlation_id='1:2', chat=value.chat, frontend='telegram',
+                                 media_type=MediaType.PHOTO, status=MediaStatus.FAILED)
+
+        self.assertEqual(b'NewMessage', dict(serializer.get_headers(value))['event-type'])
+        self.assertEqual(b'MediaReady', dict(serializer.get_headers(media_ready))['event-type'])
+        self.assertIs(serializer.get_headers(value), serializer.get_headers(value))
+        self.assertNotIn('event-type', dict(serializer.headers))
+
+
+@unittest.skipIf(msgpack is None, 'msgpack is not installed')
+class MsgpackSerializerTests(unittest.TestCase):
+    def test_round_trip(self):
+        value = pyrogram_message_to_new_message(new_message_picture_with_caption, 'telegram')
+
+        serialized = MsgpackSerializer().serialize(value)
+
+        self.assertEqual(value.model_dump(mode='json'), msgpack.unpackb(serialized))
+        self.assertEqual(b'application/msgpack', dict(MsgpackSerializer().headers)['content-type'])
+
+
+class GetSerializerTests(unittest.TestCase):
+    def test_json(self):
+        self.assertIsInstance(get_serializer(SerializationFormat.JSON), JsonSerializer)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,102 @@
+import json
+import logging
+import queue
+import threading
+import unittest
+from pathlib import Path
+
+import yaml
+
+from src.structured_logging import FIELDS_ATTRIBUTE, JsonFormatter, StructuredQueueHandler, configure_logging
+
+
+class RecordingHandler(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.setFormatter(JsonFormatter())
+        self.lines = []
+        self.threads = set()
+
+    def emit(self, record):
+        self.lines.append(self.format(record))
+        self.threads.add(threading.current_thread().name)
+
+
+def make_record(message='Hello %s', args=('world',), exc_info=None, **fields) -> logging.LogRecord:
+    record = logging.LogRecord('test', logging.INFO, __file__, 1, message, args, exc_info)
+    if fields:
+        setattr(record, FIELDS_ATTRIBUTE, fields)
+    return record
+
+
+class JsonFormatterTests(unittest.TestCase):
+    def test_fields_are_merged(self):
+        result = json.loads(JsonFormatter().format(make_record(chat_id=-100, text='Привет')))
+
+        self.assertEqual('Hello world', result['message'])
+        self.assertEqual('INFO', result['level'])
+        self.assertEqual('test', result['logger'])
+        self.assertEqual(-100, result['chat_id'])
+        self.assertEqual('Привет', result['text'])
+
+    def test_exception(self):
+        try:
+            raise ValueError('broken')
+        except ValueError:
+            record = StructuredQueueHandler(queue.Queue()).prepare(make_record(exc_info=logging.sys.exc_info()))
+
+        result = json.loads(JsonFormatter().format(record))
+
+        self.assertEqual('Hello world', result['message'])
+        self.assertIn('ValueError: broken', result['exception'])
+
+
+class QueueHandlerTests(unittest.TestCase):
+    def test_full_queue_drops_records(self):
+        records = queue.Queue(maxsize=1)
+        handler = StructuredQueueHandler(records)
+
+        handler.handle(make_record())
+        handler.handle(make_record())
+
+        self.assertEqual(1, records.qsize())
+
+
+class ConfigureLoggingTests(unittest.TestCase):
+    def setUp(self):
+        root = logging.getLogger()
+        self.root_state = (root.level, list(root.handlers))
+
+    def tearDown(self):
+        root = logging.getLogger()
+        for handler in list(root.handlers):
+            root.removeHandler(handler)
+        level, handlers = self.root_state
+        root.setLevel(level)
+        for handler in handlers:
+            root.addHandler(handler)
+
+    def test_records_are_written_on_listener_thread(self):
+        handler = RecordingHandler()
+        config = {'version': 1, 'disable_existing_loggers': False, 'handlers': {'recording': {'()': lambda: handler}},
+                  'root': {'level': 'DEBUG', 'handlers': ['recording']}}
+
+        listener = configure_logging(config, level='info')
+        listener.start()
+        logging.getLogger('test').debug('Hidden')
+        logging.getLogger('test').info('Shown', extra={FIELDS_ATTRIBUTE: {'chat_id': 1}})
+        listener.stop()
+
+        self.assertEqual(['Shown'], [json.loads(it)['message'] for it in handler.lines])
+        self.assertNotIn(threading.current_thread().name, handler.threads)
+
+    def test_repository_config_is_valid(self):
+        with open(Path(__file__).parents[2] / 'logging.yaml') as fp:
+            listener = configure_logging(yaml.load(fp, Loader=yaml.FullLoader), level='WARNING')
+
+        self.assertEqual(logging.WARNING, logging.getLogger().level)
+        self.assertIsInstance(listener.handlers[0].formatter, JsonFormatter)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,263 @@
+"""
+Seeded generator of realistic Pyrogram messages for load tests and benchmarks.
+Messages are built lazily one at a time, so corpora of any size never sit in memory:
+
+    for message in generate_messages(GeneratorConfig(seed=42), count=1_000_000):
+        ...
+
+The same seed and config always produce the same messages
+"""
+
+import base64
+import datetime
+import math
+import random
+from dataclasses import dataclass, field
+from itertools import accumulate, count as count_from
+from typing import Dict, Iterator, List, Optional
+
+from pyrogram.enums import ChatType, MessageMediaType, MessageServiceType, UserStatus
+from pyrogram.types import Animation, Audio, Chat, Message, Photo, Sticker, Thumbnail, User, Video, VideoNote, Voice
+
+from src.test.tools.print_message_constructor import mock_first_name, mock_last_name, mock_titles, mock_usernames
+
+# Copied, print_constructor_recursive pops from the originals
+FIRST_NAMES = tuple(mock_first_name) + ('Alex', 'Maria', 'Ivan', 'Yuki', 'Omar', 'Chen', 'Anna', 'Lucas')
+LAST_NAMES = tuple(mock_last_name) + ('Smith', 'Ivanova', 'Tanaka', 'Haddad', 'Wang', None, None, None)
+USERNAMES = tuple(mock_usernames) + ('night_owl', 'cat_enjoyer', 'meme_lord', 'rustacean', 'shrek_fan')
+TITLES = tuple(mock_titles) + ('Python Developers', 'Weekend Hikers', 'Memes 24/7', 'Book Club', 'Family')
+WORDS = (
+    'hello', 'world', 'did', 'you', 'see', 'this', 'lol', 'omega', 'momiji', 'kafka', 'tomorrow', 'meeting',
+    'cat', 'photo', 'why', 'is', 'it', 'broken', 'again', 'works', 'on', 'my', 'machine', 'shrek', 'film',
+    'tonight', 'anyone', 'wants', 'pizza', 'ok', 'thanks', 'great', 'idea', 'no', 'yes', 'maybe', 'later',
+)
+
+# Typical sizes in bytes, actual sizes are spread log-normally around them
+MEDIA_SIZES: Dict[MessageMediaType, int] = {
+    MessageMediaType.PHOTO: 150_000,
+    MessageMediaType.STICKER: 30_000,
+    MessageMediaType.VOICE: 40_000,
+    MessageMediaType.VIDEO: 8_000_000,
+    MessageMediaType.ANIMATION: 1_000_000,
+    MessageMediaType.VIDEO_NOTE: 1_500_000,
+    MessageMediaType.AUDIO: 5_000_000,
+}
+
+MEDIA_TYPES: Dict[MessageMediaType, type] = {
+    MessageMediaType.PHOTO: Photo,
+    MessageMediaType.STICKER: Sticker,
+    MessageMediaType.VOICE: Voice,
+    MessageMediaType.VIDEO: Video,
+    MessageMediaType.ANIMATION: Animation,
+    MessageMediaType.VIDEO_NOTE: VideoNote,
+    MessageMediaType.AUDIO: Audio,
+}
+
+MEDIA_ATTRIBUTES: Dict[MessageMediaType, str] = {
+    MessageMediaType.PHOTO: 'photo',
+    MessageMediaType.STICKER: 'sticker',
+    MessageMediaType.VOICE: 'voice',
+    MessageMediaType.VIDEO: 'video',
+    MessageMediaType.ANIMATION: 'animation',
+    MessageMediaType.VIDEO_NOTE: 'video_note',
+    MessageMediaType.AUDIO: 'audio',
+}
+
+
+@dataclass
+class GeneratorConfig:
+    seed: int = 0
+    chats: int = 1_000
+    users: int = 10_000
+    # Weights, not probabilities: they don't have to sum up to 1
+    chat_types: Dict[ChatType, float] = field(default_factory=lambda: {
+        ChatType.GROUP: 0.3,
+        ChatType.SUPERGROUP: 0.5,
+        ChatType.PRIVATE: 0.2,
+    })
+    # None is a text message
+    media: Dict[Optional[MessageMediaType], float] = field(default_factory=lambda: {
+        None: 0.7,
+        MessageMediaType.PHOTO: 0.12,
+        MessageMediaType.STICKER: 0.06,
+        MessageMediaType.VOICE: 0.04,
+        MessageMediaType.VIDEO: 0.03,
+        MessageMediaType.ANIMATION: 0.03,
+        MessageMediaType.VIDEO_NOTE: 0.01,
+        MessageMediaType.AUDIO: 0.01,
+    })
+    # Chat activity follows a power law: chat i gets messages proportionally to 1 / (i + 1) ** chat_skew
+    chat_skew: float = 1.0
+    caption_rate: float = 0.3
+    reply_rate: float = 0.2
+    forward_rate: float = 0.05
+    service_rate: float = 0.02
+    mention_rate: float = 0.05
+    bot_rate: float = 0.02
+    # Users without a username break the NewMessage contract, set it to 0 to get only valid messages
+    no_username_rate: float = 0.1
+    # Share of media that repeats a recently sent file, same file_unique_id
+    repeat_media_rate: float = 0.1
+    # Average seconds between two messages
+    interval: float = 0.5
+    start: datetime.datetime = datetime.datetime(2024, 1, 1)
+
+
+class MessageGenerator:
+    def __init__(self, config: GeneratorConfig):
+        self.config = config
+        self.rng = random.Random(config.seed)
+
+        self.users = [self._make_user(i) for i in range(config.users)]
+        self.chats = [self._make_chat(i) for i in range(config.chats)]
+        self._chat_weights = list(accumulate(1 / (i + 1) ** config.chat_skew for i in range(config.chats)))
+        self._media_kinds = list(config.media)
+        self._media_weights = list(accumulate(config.media.values()))
+        self._last_message_ids: Dict[int, int] = {}
+        self._recent_media: List[object] = []
+        self._date = config.start
+
+    def _random_id(self, length: int) -> str:
+        return base64.urlsafe_b64encode(self.rng.getrandbits(length * 6).to_bytes(length * 6 // 8 + 1, 'big')) \
+            .decode('ascii')[:length]
+
+    def _make_user(self, index: int) -> User:
+        rng = self.rng
+        return User(
+            id=1_000_000 + index,
+            is_self=False,
+            is_bot=rng.random() < self.config.bot_rate,
+            is_premium=rng.random() < 0.1,
+            first_name=rng.choice(FIRST_NAMES),
+            last_name=rng.choice(LAST_NAMES),
+            username=f'{rng.choice(USERNAMES)}_{index}' if rng.random() >= self.config.no_username_rate else None,
+            status=UserStatus.RECENTLY,
+            language_code=rng.choice(('en', 'ru', 'ja', 'de')),
+            dc_id=rng.randint(1, 5),
+        )
+
+    def _make_chat(self, index: int) -> Chat:
+        chat_type = self.rng.choices(list(self.config.chat_types), weights=list(self.config.chat_types.values()))[0]
+        if chat_type in (ChatType.PRIVATE, ChatType.BOT):
+            user = self.users[index % len(self.users)]
+            return Chat(id=user.id, type=chat_type, username=user.username,
+                        first_name=user.first_name, last_name=user.last_name)
+        chat_id = -(1_000_000_000_000 + index) if chat_type in (ChatType.SUPERGROUP, ChatType.CHANNEL) \
+            else -(10_000_000 + index)
+        return Chat(id=chat_id, type=chat_type, title=f'{self.rng.choice(TITLES)} {index}',
+                    members_count=self.rng.randint(2, 5000))
+
+    def _make_text(self, max_words: int) -> str:
+        words = self.rng.randint(1, max_words)
+        return ' '.join(self.rng.choices(WORDS, k=words)).capitalize()
+
+    def _make_thumbnails(self, unique_id: str, sizes: List[int]) -> List[Thumbnail]:
+        return [
+            Thumbnail(file_id=self._random_id(80), file_unique_id=unique_id, width=size, height=size,
+                      file_size=size * size // 5)
+            for size in sizes
+        ]
+
+    def _make_media(self, kind: MessageMediaType):
+        rng = self.rng
+        same_kind = [it for it in self._recent_media[-20:] if isinstance(it, MEDIA_TYPES[kind])]
+        if same_kind and rng.random() < self.config.repeat_media_rate:
+            return rng.choice(same_kind)
+
+        file_id = self._random_id(80)
+        unique_id = 'AgAD' + self._random_id(11)
+        size = max(1000, int(rng.lognormvariate(math.log(MEDIA_SIZES[kind]), 0.8)))
+        duration = rng.randint(1, 300)
+        match kind:
+            case MessageMediaType.PHOTO:
+                media = Photo(file_id=file_id, file_unique_id=unique_id, width=1280, height=960, file_size=size,
+                              date=self._date, thumbs=self._make_thumbnails(unique_id, [90, 320]))
+            case MessageMediaType.STICKER:
+                media = Sticker(file_id=file_id, file_unique_id=unique_id, width=512, height=512,
+                                is_animated=False, is_video=False, mime_type='image/webp', file_size=size,
+                                emoji=rng.choice(('😂', '👍', '🔥', '😭')),
+                                thumbs=self._make_thumbnails(unique_id, [128]))
+            case MessageMediaType.VOICE:
+                media = Voice(file_id=file_id, file_unique_id=unique_id, duration=duration,
+                              mime_type='audio/ogg', file_size=size)
+            case MessageMediaType.VIDEO:
+                media = Video(file_id=file_id, file_unique_id=unique_id, width=1280, height=720, duration=duration,
+                              mime_type='video/mp4', file_size=size, thumbs=self._make_thumbnails(unique_id, [320]))
+            case MessageMediaType.ANIMATION:
+                media = Animation(file_id=file_id, file_unique_id=unique_id, width=480, height=270,
+                                  duration=duration, mime_type='video/mp4', file_size=size,
+                                  thumbs=self._make_thumbnails(unique_id, [320]))
+            case MessageMediaType.VIDEO_NOTE:
+                media = VideoNote(file_id=file_id, file_unique_id=unique_id, length=384, duration=duration,
+                                  mime_type='video/mp4', file_size=size,
+                                  thumbs=self._make_thumbnails(unique_id, [320]))
+            case _:
+                media = Audio(file_id=file_id, file_unique_id=unique_id, duration=duration, mime_type='audio/mpeg',
+                              file_size=size, title=self._make_text(3), performer=rng.choice(FIRST_NAMES))
+        self._recent_media.append(media)
+        if len(self._recent_media) > 100:
+            del self._recent_media[:50]
+        return media
+
+    def _make_sender(self, chat: Chat) -> User:
+        if chat.type in (ChatType.PRIVATE, ChatType.BOT):
+            return self.users[(chat.id - 1_000_000) % len(self.users)]
+        # Members of a group are a stable slice of the user pool
+        offset = (abs(chat.id) * 7919) % len(self.users)
+        return self.users[(offset + int(self.rng.paretovariate(1.5))) % len(self.users)]
+
+    def __next__(self) -> Message:
+        rng = self.rng
+        config = self.config
+        chat = rng.choices(self.chats, cum_weights=self._chat_weights)[0]
+        message_id = self._last_message_ids.get(chat.id, 0) + 1
+        self._last_message_ids[chat.id] = message_id
+        self._date += datetime.timedelta(seconds=rng.expovariate(1 / config.interval))
+        sender = self._make_sender(chat)
+        values = {
+            'id': message_id,
+            'from_user': sender,
+            'date': self._date,
+            'chat': chat,
+            'mentioned': rng.random() < config.mention_rate,
+            'outgoing': False,
+        }
+
+        if chat.type not in (ChatType.PRIVATE, ChatType.BOT) and rng.random() < config.service_rate:
+            if rng.random() < 0.5:
+                values['service'] = MessageServiceType.NEW_CHAT_MEMBERS
+                values['new_chat_members'] = [sender]
+            else:
+                values['service'] = MessageServiceType.LEFT_CHAT_MEMBERS
+                values['left_chat_member'] = sender
+            return Message(**values)
+
+        if message_id > 1 and rng.random() < config.reply_rate:
+            values['reply_to_message_id'] = rng.randint(max(1, message_id - 50), message_id - 1)
+        if rng.random() < config.forward_rate:
+            values['forward_from'] = rng.choice(self.users)
+            values['forward_date'] = self._date - datetime.timedelta(days=rng.randint(0, 365))
+
+        kind = rng.choices(self._media_kinds, cum_weights=self._media_weights)[0]
+        if kind is None:
+            values['text'] = self._make_text(30)
+        else:
+            values['media'] = kind
+            values[MEDIA_ATTRIBUTES[kind]] = self._make_media(kind)
+            if kind != MessageMediaType.STICKER and rng.random() < config.caption_rate:
+                values['caption'] = self._make_text(15)
+        return Message(**values)
+
+    def __iter__(self) -> Iterator[Message]:
+        return self
+
+
+
+def generate_messages(config: GeneratorConfig = None, count: Optional[int] = None) -> Iterator[Message]:
+    """
+    :param count: number of messages, endless if None
+    """
+
+    generator = MessageGenerator(config or GeneratorConfig())
+    for _ in (range(count) if count is not None else count_from()):
+        yield next(generator)
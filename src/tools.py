@@ -38,7 +38,7 @@ def convert_string_size_to_bytes(value: str) -> Optional[int]:
     return base
 
 
-def get_dict_key_by_path(dictionary: dict, path: str, fail: bool = True) -> Optional[Any]:
+def get_dict_key_by_path(dictionary: dict, path: str, fail: bool = True, default: Optional[Any] = None) -> Optional[Any]:
     try:
         value = dictionary
         for key in path.split('.'):
@@ -47,5 +47,5 @@ def get_dict_key_by_path(dictionary: dict, path: str, fail: bool = True) -> Opti
         if fail:
             raise KeyError(f"Key {path} not found in config file") from e
         else:
-            return None
+            return default
     return value